@@ -4,7 +4,7 @@ set -euo pipefail
 # Works on both Mac and GNU/Linux.
 DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 VERSION_FILENAME=${DIR}/../src/version.txt
-SRC_FILES=$(echo -n ${DIR}/../src/{android_sdk_helper.py,main.py,output_helper.py,platform_helper.py,android_enhanced.py,version.txt})
+SRC_FILES=$(echo -n ${DIR}/../src/{android_sdk_helper.py,avd_helper.py,cache_helper.py,check_runner.py,daemon_helper.py,disk_usage_helper.py,emulator_helper.py,import_helper.py,java_helper.py,license_helper.py,lock_helper.py,main.py,mirror_helper.py,output_helper.py,package_store_helper.py,platform_helper.py,profile_helper.py,sdk_catalog.py,sdk_scanner.py,android_enhanced.py,version.txt})
 
 # Open setup file to increment the version
   echo -n "Next the editor will open ${VERSION_FILENAME}, increment the version number in it. Press enter to continue:" &&
@@ -1,94 +1,234 @@
+import json
 import os
 import re
-from typing import Optional
+import sys
+import threading
+import time
+from typing import Iterator, Optional
 
 try:
     # This works when the code is executed directly.
-    from android_sdk_helper import AndroidSdkHelper
-    from platform_helper import PlatformHelper
+    from import_helper import LazyImport
+    from sdk_catalog import SdkCatalog, SdkCatalogParser, SdkPackage, SdkPackageIndex
+    from profile_helper import profile_span
     from output_helper import print_message, print_error, print_error_and_exit, print_verbose
 except ImportError:
     # This fails when the code is executed directly and not as a part of python package installation,
     # I definitely need a better way to handle this.
     from androide.output_helper import print_message, print_error, print_error_and_exit, print_verbose
-    from androide.android_sdk_helper import AndroidSdkHelper
-    from androide.platform_helper import PlatformHelper
+    from androide.import_helper import LazyImport
+    from androide.sdk_catalog import SdkCatalog, SdkCatalogParser, SdkPackage, SdkPackageIndex
+    from androide.profile_helper import profile_span
+
+# Only some of the commands need these, they are imported on first use to keep the startup fast.
+AndroidSdkHelper = LazyImport('android_sdk_helper', 'AndroidSdkHelper')
+AvdHelper = LazyImport('avd_helper', 'AvdHelper')
+CacheHelper = LazyImport('cache_helper', 'CacheHelper')
+CheckRunner = LazyImport('check_runner', 'CheckRunner')
+DiskUsageHelper = LazyImport('disk_usage_helper', 'DiskUsageHelper')
+EmulatorHelper = LazyImport('emulator_helper', 'EmulatorHelper')
+JavaHelper = LazyImport('java_helper', 'JavaHelper')
+SdkLock = LazyImport('lock_helper', 'SdkLock')
+LicenseHelper = LazyImport('license_helper', 'LicenseHelper')
+MirrorHelper = LazyImport('mirror_helper', 'MirrorHelper')
+PackageStoreHelper = LazyImport('package_store_helper', 'PackageStoreHelper')
+PlatformHelper = LazyImport('platform_helper', 'PlatformHelper')
+SdkScanner = LazyImport('sdk_scanner', 'SdkScanner')
 
 
 _JAVA_VERSION_FOR_ANDROID = '1.8'
 _JAVA8_INSTALL_COMMAND_FOR_MAC = 'brew cask install caskroom/versions/java8'
 _SET_JAVA8_AS_DEFAULT_ON_MAC = 'export JAVA_HOME=$(/usr/libexec/java_home -v 1.8)'
-_GET_ALL_JAVA_VERSIONS_ON_MAC = '/usr/libexec/java_home -V'
-_GET_ALL_JAVA_VERSIONS_ON_LINUX = 'update-alternatives --display java'
 
-_BUILD_TOOLS_REGEX = r'build-tools;\S*'
-_SYSTEM_IMAGES_REGEX = 'system-images;android-([0-9]+);(.*);(.*)\n'
+# Packages which are listed by other commands and are hence, not listed by "list other packages".
+_LIST_OTHERS_EXCLUDED_PREFIXES = ('system-images;', 'platforms;', 'sources;', 'platform-tools', 'build-tools;')
+_SDK_MANAGER_LIST_CACHE = 'sdkmanager-catalog'
+_INSTALLED_PACKAGES_CACHE = 'installed-packages'
+_MAX_SIMILAR_PACKAGES = 3
+_PACKAGE_XML = 'package.xml'
+_EMULATOR_LOGS_DIR = 'emulator-logs'
+# Snapshot saved by create avd --prebake right after the first boot, start avd boots from it.
+_PREBAKED_SNAPSHOT_NAME = 'androidtool_prebaked'
+# avdmanager is a JVM, too many of them at once only slow each other down.
+_MAX_CONCURRENT_AVD_CREATIONS = 8
+# Arguments of AvdHelper.get_hardware_config(), these can be set for the AVDs in the manifest of create_avds.
+_AVD_HARDWARE_KEYS = ('cores', 'ram_size', 'heap_size', 'gpu_mode', 'data_partition_size', 'quick_boot')
+# A long-lived process, like the daemon, reloads the catalog at least this often so that it sees the cached listing
+# expire.
+_MAX_SDK_STATE_AGE_IN_SECONDS = 60 * 60
+# Computing the SDK fingerprint takes longer than answering a query from memory, a burst of commands checks it once.
+_SDK_REVALIDATION_INTERVAL_IN_SECONDS = 1
+# Written to the stdin of sdkmanager, one "y" for every license it asks to accept, more than there are licenses.
+_SDK_MANAGER_ANSWERS = 'y\n' * 100
 
 
 class AndroidEnhanced:
 
-    def __init__(self) -> None:
+    def __init__(self, refresh_cache=False, offline=False, lock_timeout=None) -> None:
+        """
+        :param refresh_cache: ignore the cached sdkmanager package listing and fetch a new one
+        :param offline: always use the cached sdkmanager package listing, even if it is stale
+        :param lock_timeout: seconds to wait for the other processes installing into the SDK, None to wait forever
+        """
         # Initialize to None
+        self._adb = None
         self._avd_manager = None
         self._emulator = None
         self._sdk_manager = None
+        self._refresh_cache = refresh_cache
+        self._offline = offline
+        self._lock_timeout = lock_timeout
+        self._catalog = None
+        self._installed_packages = None
+        # Guards the catalog and the installed packages. The doctor checks and the commands of the daemon run
+        # concurrently, the SDK root is scanned and sdkmanager lists the packages once for all of them.
+        self._sdk_state_lock = threading.RLock()
+        # Fingerprint of the SDK directory tree when the catalog and the installed packages were read.
+        self._sdk_fingerprint = None
+        self._sdk_state_time = time.monotonic()
+        self._sdk_check_time = None
 
-    def run_doctor(self) -> None:
-        print_message('Checking java version...')
-        self._ensure_correct_java_version()
-        print_message('Checking SDK manager is installed...')
-        self._ensure_sdkmanager_is_installed()
-        print_message('Checking that basic Android packages are installed...')
-        if not self._ensure_basic_packages_are_installed():
-            print_error_and_exit('Not all basic packages are installed')
-    
-    def _ensure_basic_packages_are_installed(self) -> bool:
-        success = True
-        installed_packages = self._get_installed_packages()
+    def revalidate_sdk_state(self) -> None:
+        """
+        Forgets the catalog and the installed packages kept in memory if the SDK directory tree changed since the last
+        check or if they are too old. Long-lived callers, like the daemon, call this before every command, the SDK is
+        checked at most once every _SDK_REVALIDATION_INTERVAL_IN_SECONDS.
+        """
+        with self._sdk_state_lock:
+            now = time.monotonic()
+            if self._sdk_check_time is not None and \
+                    now - self._sdk_check_time < _SDK_REVALIDATION_INTERVAL_IN_SECONDS:
+                return
+            self._sdk_check_time = now
+            fingerprint = CacheHelper.get_sdk_fingerprint(AndroidSdkHelper.get_android_sdk_root())
+            if fingerprint != self._sdk_fingerprint or now - self._sdk_state_time > _MAX_SDK_STATE_AGE_IN_SECONDS:
+                print_verbose('SDK changed, forgetting the package catalog and the installed packages')
+                self.clear_sdk_state()
+                self._sdk_fingerprint = fingerprint
+
+    def clear_sdk_state(self) -> None:
+        with self._sdk_state_lock:
+            self._catalog = None
+            self._installed_packages = None
+            self._sdk_fingerprint = None
+            self._sdk_state_time = time.monotonic()
+
+    def run_doctor(self, output_format='text') -> None:
+        """
+        Runs the checks concurrently, the results are printed in a fixed order as they become available.
+        :param output_format: "json" prints a single JSON report once all the checks are done, "ndjson" prints every
+        result as a JSON object as soon as it is available
+        """
+        runner = CheckRunner()
+        runner.add_check('default_java_version', AndroidEnhanced._check_default_java_version)
+        runner.add_check('all_java_versions', AndroidEnhanced._check_all_java_versions)
+        runner.add_check('java_version', AndroidEnhanced._check_java_version,
+                         dependencies=('default_java_version', 'all_java_versions'), title='Checking java version...')
+        runner.add_check('sdkmanager', self._check_sdkmanager_is_installed,
+                         title='Checking SDK manager is installed...')
+        runner.add_check('basic_packages', self._check_basic_packages_are_installed, dependencies=('sdkmanager',),
+                         title='Checking that basic Android packages are installed...')
+        runner.add_check('licenses', self._check_licenses_are_accepted, dependencies=('sdkmanager',),
+                         title='Checking that the licenses of the installed packages are accepted...')
+
+        start_time = time.monotonic()
+        if output_format == 'ndjson':
+            results = runner.run(on_result=lambda result: print(json.dumps(result.to_dict()), flush=True))
+        elif output_format == 'json':
+            results = runner.run()
+        else:
+            results = runner.run(on_result=AndroidEnhanced._print_check_result)
+        duration = time.monotonic() - start_time
+        failed_checks = [result.name for result in results if not result.success]
+        if output_format == 'ndjson':
+            if failed_checks:
+                sys.exit(1)
+        elif output_format == 'json':
+            print(json.dumps({
+                'success': not failed_checks,
+                'duration': round(duration, 3),
+                'checks': [result.to_dict() for result in results],
+            }, indent=2))
+            if failed_checks:
+                sys.exit(1)
+        else:
+            print_verbose('Doctor finished in %.3f seconds' % duration)
+            if failed_checks:
+                print_error_and_exit('Failed checks: %s' % ', '.join(failed_checks))
+
+    @staticmethod
+    def _print_check_result(result) -> None:
+        if result.title is None:
+            return
+        print_message(result.title)
+        for message in result.messages:
+            print_message(message)
+        for error in result.errors:
+            print_error(error)
+
+    def _check_basic_packages_are_installed(self, _sdk_manager) -> (bool, None, [str], [str]):
+        sdk_root = AndroidSdkHelper.get_android_sdk_root()
+        if not sdk_root:
+            return False, None, [], ['Android SDK not found, set ANDROID_SDK_ROOT']
+        # doctor works offline, so sdkmanager is never run here, not even if the cached package catalog is stale or
+        # the scan finds no packages.
+        installed_sdk_packages = self._scan_installed_packages(sdk_root)
+        installed_packages = [package.path for package in installed_sdk_packages]
         print_verbose('Installed packages are %s' % installed_packages)
-        basic_packages = self._get_basic_packages()
+        messages = []
+        errors = []
+        catalog = self._read_cached_catalog()
+        latest_build_tools = catalog.get_index().get_latest_build_tools() if catalog is not None else None
+        if latest_build_tools is None:
+            latest_build_tools = SdkPackageIndex(installed_sdk_packages).get_latest_build_tools()
+            if latest_build_tools is None:
+                return False, None, [], ['No build tools are installed']
+            messages.append('No cached package list found, checking against the latest installed build tools')
+        basic_packages = self._get_basic_packages(latest_build_tools.path)
         num_packages = len(basic_packages)
         for i in range(0, num_packages):
             basic_package = basic_packages[i]
             if basic_package == 'tools':
-                print_message('Skipping over obsolete package \"%s\"' % basic_package)
+                messages.append('Skipping over obsolete package \"%s\"' % basic_package)
                 continue
             if basic_package not in installed_packages:
-                print_error('Basic packages \"%s\" is not installed' % basic_package)
-                success = False
+                errors.append('Basic packages \"%s\" is not installed' % basic_package)
             else:
-                print_message('Package %d/%d: \"%s\" is installed' % (i + 1, num_packages, basic_package))
+                messages.append('Package %d/%d: \"%s\" is installed' % (i + 1, num_packages, basic_package))
+        return not errors, None, messages, errors
 
-        return success
+    def _check_licenses_are_accepted(self, _sdk_manager) -> (bool, None, [str], [str]):
+        licenses = LicenseHelper.get_licenses(self._get_installed_package_xml_paths())
+        unaccepted_licenses = LicenseHelper.get_unaccepted_licenses(AndroidSdkHelper.get_android_sdk_root(), licenses)
+        if unaccepted_licenses:
+            return False, None, [], ['License \"%s\" is not accepted, run \"androidtool accept licenses\"' % license_id
+                                     for license_id in sorted(unaccepted_licenses)]
+        return True, None, ['All %d licenses of the installed packages are accepted' % len(licenses)], []
 
-    def list_packages(self, arch=None, api_type=None) -> None:
-        print_verbose('List packages(arch: %s, api_type: %s)' % (arch, api_type))
-        if api_type is None:
-            google_api_type = '.*?'
-        else:
-            google_api_type = api_type
-
-        if arch is None:
-            arch_pattern = '.*?'
-        else:
-            arch_pattern = arch + '.*?'
-        regex_pattern = 'system-images;android-([0-9]+);(%s);(%s)\n' % (google_api_type, arch_pattern)
-        print_verbose('Package pattern: %s' % regex_pattern)
-        return_code, stdout, stderr = PlatformHelper.execute_cmd(
-            '%s --verbose --list --include_obsolete' % self._get_sdk_manager_path())
-        if return_code != 0:
-            print_error_and_exit('Failed to list packages (return code: %d)' % return_code)
-        system_images = re.findall(regex_pattern, stdout)
+    def list_packages(self, arch=None, api_type=None, output_format='text', min_api_version=None,
+                      max_api_version=None) -> None:
+        """
+        Lists the system images by API type and architecture, in the order of their API version.
+        :param min_api_version: if not None, the oldest API version to list
+        :param max_api_version: if not None, the newest API version to list
+        """
+        print_verbose('List packages(arch: %s, api_type: %s, API versions: %s - %s)' % (
+            arch, api_type, min_api_version, max_api_version))
+        system_images = self._get_catalog().get_index().get_system_images(min_api_version, max_api_version,
+                                                                          api_type, arch)
+        if output_format != 'text':
+            _print_records((dict(package.to_dict(), api_version=str(android_api_version), api_type=google_api_type,
+                                 arch=architecture)
+                            for (package, android_api_version, google_api_type, architecture) in system_images),
+                           output_format)
+            return
         arch_to_android_version_map = {}
-        for system_image in system_images:
-            android_api_version = system_image[0]
-            google_api_type = system_image[1]
-            arch = system_image[2]
+        for (_, android_api_version, google_api_type, architecture) in system_images:
             if google_api_type not in arch_to_android_version_map:
                 arch_to_android_version_map[google_api_type] = {}
-            if arch not in arch_to_android_version_map[google_api_type]:
-                arch_to_android_version_map[google_api_type][arch] = []
-            arch_to_android_version_map[google_api_type][arch].append(android_api_version)
+            if architecture not in arch_to_android_version_map[google_api_type]:
+                arch_to_android_version_map[google_api_type][architecture] = []
+            arch_to_android_version_map[google_api_type][architecture].append(str(android_api_version))
 
         for (google_api_type, architectures) in arch_to_android_version_map.items():
             if google_api_type == 'default':
@@ -100,31 +240,44 @@ class AndroidEnhanced:
                 print('%s -> %s' % (architecture, ', '.join(android_api_versions)))
             print()
 
-    def list_installed_packages(self):
+    def list_installed_packages(self, output_format='text'):
+        if output_format != 'text':
+            _print_records((package.to_dict() for package in self._get_installed_sdk_packages()), output_format)
+            return
         installed_packages = self._get_installed_packages()
         if installed_packages:
             print('\n'.join(installed_packages))
         else:
             print_error('No installed packages found')
 
-    def list_avds(self):
-        avd_manager = self._get_avd_manager_path()
-        if not avd_manager:
-            print_error_and_exit('avdmanager not found')
-        cmd = '%s --verbose list avd' % avd_manager
-        return_code, stdout, stderr = PlatformHelper.execute_cmd(cmd)
-        if return_code != 0:
-            print_error_and_exit('Failed to execute avdmanager')
-        start = stdout.find('Virtual Devices')
-        if start != -1:
-            stdout = stdout[start:]
-        print(stdout)
+    def list_avds(self, output_format='text'):
+        avds = AvdHelper.list_avds(with_disk_size=True)
+        if output_format != 'text':
+            _print_records((avd.to_dict() for avd in avds), output_format)
+            return
+        if not avds:
+            print_error('No AVDs found in \"%s\"' % AvdHelper.get_avd_home())
+            return
+        print('Available Android Virtual Devices:')
+        for avd in avds:
+            print('    Name: %s' % avd.name)
+            print('    Path: %s' % avd.path)
+            print('  Target: %s' % avd.target)
+            print(' Tag/ABI: %s/%s' % (avd.tag, avd.abi))
+            print('    Size: %s' % _get_human_readable_size(avd.disk_size))
+            print('---------')
 
     def install_api_version(self, version, arch=None, api_type=None) -> None:
-        platform_package = self._get_platform_package(version)
-        sources_package = self._get_sources_package(version)
-        addons_package = self._get_add_ons_package(version, api_type)
-        system_images_package = self._get_system_images_package(version, arch, api_type)
+        package_list = AndroidEnhanced._get_api_version_packages(version, arch, api_type)
+        if not self._install_sdk_packages(package_list):
+            print_error_and_exit('Failed to install packages for api version: %s' % version)
+
+    @staticmethod
+    def _get_api_version_packages(version, arch, api_type) -> [str]:
+        platform_package = AndroidEnhanced._get_platform_package(version)
+        sources_package = AndroidEnhanced._get_sources_package(version)
+        addons_package = AndroidEnhanced._get_add_ons_package(version, api_type)
+        system_images_package = AndroidEnhanced._get_system_images_package(version, arch, api_type)
 
         package_list = list()
         package_list.append(platform_package)
@@ -134,49 +287,31 @@ class AndroidEnhanced:
             package_list.append(addons_package)
         if system_images_package:
             package_list.append(system_images_package)
-        if not self._install_sdk_packages(package_list):
-            print_error_and_exit('Failed to install packages for api version: %s' % version)
+        return package_list
 
-    def list_build_tools(self):
+    def list_build_tools(self, output_format='text'):
+        if output_format != 'text':
+            _print_records((package.to_dict() for package in self._get_catalog().get_index().get_build_tools()),
+                           output_format)
+            return
         build_tools = self._get_build_tools()
         for build_tool in build_tools:
             print(build_tool)
 
-    def list_others(self):
-        cmd = '%s --verbose --list --include_obsolete' % self._get_sdk_manager_path()
-        return_code, stdout, stderr = PlatformHelper.execute_cmd(cmd)
-        if return_code != 0:
-            print_error_and_exit('Failed to list packages')
-
-        print('Installed Packages:')
-        lines = stdout.split('\n')
-        for (i, line) in enumerate(lines):
-            line = line.strip()
-            previous_line = None
+    def list_others(self, output_format='text'):
+        if output_format != 'text':
+            _print_records((dict(package.to_dict(), section=section)
+                            for (section, packages) in self._get_catalog().get_sections()
+                            for package in packages if not package.path.startswith(_LIST_OTHERS_EXCLUDED_PREFIXES)),
+                           output_format)
+            return
+        for (i, (section, packages)) in enumerate(self._get_catalog().get_sections()):
             if i > 0:
-                previous_line = lines[i - 1].strip()
-
-            is_package_name = not previous_line or previous_line.startswith('---')
-
-            if not is_package_name:
-                continue
-
-            print_verbose('Line is \"%s\" and previous line is \"%s\"' % (line, previous_line))
-
-            if not line:
-                continue
-            elif line.startswith('system-images;') or line.startswith('platforms;') or line.startswith('sources;'):
-                continue
-            elif line.startswith('platform-tools'):
-                continue
-            elif line.startswith('build-tools;'):
-                continue
-            elif line.find('Info:') != -1:
-                continue
-
-            if line.endswith(':'):
                 print('')
-            print(line)
+            print('%s:' % section)
+            for package in packages:
+                if not package.path.startswith(_LIST_OTHERS_EXCLUDED_PREFIXES):
+                    print(package.path)
 
     def install_basic_packages(self):
         packages_to_install = self._get_basic_packages()
@@ -184,88 +319,515 @@ class AndroidEnhanced:
             print_error_and_exit('Failed to install basic packages')
 
     def update_all(self):
-        cmd = '%s --update' % self._get_sdk_manager_path()
-        return_code, stdout, stderr = PlatformHelper.execute_cmd(cmd)
-        if return_code != 0:
-            print_error_and_exit('Failed to update, return code: %d' % return_code)
-        count = 0
-        if stdout:
-            for line in stdout.split('\r'):
-                if line.find('Fetch remote repository'):
-                    continue
-                else:
-                    count += 1
-        if count == 0:
+        """
+        Updates only the installed packages which have a newer revision available, in a single sdkmanager call.
+        The available revisions come from the cached package catalog, so nothing is started when all the packages are
+        up-to-date.
+        """
+        updates = self._get_catalog().get_updates(self._get_installed_sdk_packages())
+        if not updates:
             print_message('No packages to update')
-            self._accept_all_licenses()
-        else:
-            print_message(stdout)
+            return
+        for (package, new_version) in updates:
+            print_message('%s: %s -> %s' % (package.path, package.version, new_version))
+        with SdkLock(AndroidSdkHelper.get_android_sdk_root(), [package.path for (package, _) in updates],
+                     self._lock_timeout) as lock:
+            if lock.waited:
+                # Another process might have updated the packages meanwhile.
+                self.clear_sdk_state()
+                updates = self._get_catalog().get_updates(self._get_installed_sdk_packages())
+                if not updates:
+                    print_message('The packages were updated by another process')
+                    return
+            package_names = [package.path for (package, _) in updates]
+            versions = {package.path: new_version for (package, new_version) in updates}
+            if not self._run_sdk_manager_install(package_names, versions):
+                print_error_and_exit('Failed to update packages')
+        print_message('Updated %d package%s' % (len(updates), '' if len(updates) == 1 else 's'))
 
-    def create_avd(self, avd_name, api_version, arch, api_type):
-        if api_type is None:
-            api_type = 'google_apis'  # Preferred
-        if arch is None:
-            if PlatformHelper.is_64bit_architecture():
-                arch = 'x86_64'
+    def print_disk_usage(self, output_format='text') -> None:
+        """
+        Prints the size of every installed package, largest first.
+        """
+        sizes = self._get_package_sizes()
+        packages = sorted(self._get_installed_sdk_packages(), key=lambda package: (-sizes[package.path], package.path))
+        if output_format != 'text':
+            _print_records((dict(package.to_dict(), size=sizes[package.path]) for package in packages), output_format)
+            return
+        for package in packages:
+            print('%10s  %s' % (_get_human_readable_size(sizes[package.path]), package.path))
+        print('Total: %s in %d packages' % (_get_human_readable_size(sum(sizes.values())), len(packages)))
+
+    def collect_garbage(self, keep_latest, dry_run=False) -> None:
+        """
+        Removes the build tools, platforms and system images which are not among the keep_latest latest ones of their
+        kind, except for the system images which the AVDs use.
+        :param dry_run: only print what would be removed
+        """
+        sdk_root = AndroidSdkHelper.get_android_sdk_root()
+        if not sdk_root:
+            print_error_and_exit('Android SDK not found, set ANDROID_SDK_ROOT')
+        used_packages = self._get_packages_used_by_avds()
+        packages = []
+        for package in SdkPackageIndex(self._get_installed_sdk_packages()).get_outdated_packages(keep_latest):
+            if package.path in used_packages:
+                print_message('Keeping %s, it is used by the AVDs [%s]' % (
+                    package.path, ', '.join(used_packages[package.path])))
+            elif not package.location or not _is_inside_directory(package.location, sdk_root):
+                print_verbose('Keeping %s, it is not in the SDK root' % package.path)
             else:
-                arch = 'x86'
+                packages.append(package)
+        if not packages:
+            print_message('Nothing to remove')
+            return
+        sizes = self._get_package_sizes()
+        # The files which are linked elsewhere, e.g. into the shared store, take the same space after the removal.
+        freed_size = sum(DiskUsageHelper.get_unshared_size(package.location) for package in packages)
+        if dry_run:
+            for package in packages:
+                print_message('Would remove %s (%s)' % (package.path, _get_human_readable_size(sizes[package.path])))
+            print_message('Would free %s' % _get_human_readable_size(freed_size))
+            return
+        import shutil
+        with SdkLock(sdk_root, [package.path for package in packages], self._lock_timeout, action='removing'):
+            for package in packages:
+                print_message('Removing %s (%s)' % (package.path, _get_human_readable_size(sizes[package.path])))
+                shutil.rmtree(package.location, ignore_errors=True)
+                _remove_empty_parent_directories(package.location, sdk_root)
+            self._invalidate_sdk_manager_listing()
+        print_message('Freed %s' % _get_human_readable_size(freed_size))
+        # No SDK root may use the stored revisions of the removed packages any more.
+        if PackageStoreHelper.is_root(sdk_root):
+            self._prune_package_store()
+
+    @staticmethod
+    def _prune_package_store() -> None:
+        freed_store_size = PackageStoreHelper.prune()
+        if freed_store_size:
+            print_message('Freed %s in the shared store' % _get_human_readable_size(freed_store_size))
+
+    def print_sdk_roots(self, output_format='text', add=False) -> None:
+        """
+        Lists the SDK roots which share the package store and verifies that their packages are still the stored ones.
+        :param add: add the packages of the current SDK root to the store first, their files are replaced by links to
+        the stored ones
+        """
+        sdk_root = AndroidSdkHelper.get_android_sdk_root()
+        if add:
+            if not sdk_root:
+                print_error_and_exit('Android SDK not found, set ANDROID_SDK_ROOT')
+            packages = [package for package in self._get_installed_sdk_packages()
+                        if package.location and _is_inside_directory(package.location, sdk_root)]
+            with SdkLock(sdk_root, [package.path for package in packages], self._lock_timeout, action='storing'):
+                saved_size = PackageStoreHelper.add_packages(sdk_root, packages)
+            print_message('Stored %d packages of \"%s\", saved %s' % (
+                len(packages), sdk_root, _get_human_readable_size(saved_size)))
+
+        records = self._get_sdk_root_records(sdk_root)
+        if output_format != 'text':
+            _print_records(records, output_format)
+            return
+        if not PackageStoreHelper.get_roots():
+            print_message('No SDK roots share the package store yet, add one with roots --add')
+            return
+        modified = False
+        for record in records:
+            if not record['exists']:
+                print('%s  missing' % record['path'])
+                continue
+            counts = ['%d packages' % record['packages']] + ['%d %s' % (record[status], status.replace('_', ' '))
+                                                           for status in ('linked', 'copied', 'not_stored')
+                                                           if record[status]]
+            if record['modified']:
+                counts.append('%d modified' % len(record['modified']))
+            print('%s%s  %s' % (record['path'], ' (current)' if record['current'] else '', ', '.join(counts)))
+            for package_path in record['modified']:
+                modified = True
+                print_error('  %s differs from the shared store' % package_path)
+        if modified:
+            print_error_and_exit('Some packages differ from the shared store, reinstall them')
+
+    @staticmethod
+    def _get_sdk_root_records(sdk_root) -> Iterator[dict]:
+        """
+        :return: generator of a record per SDK root of the shared store, with the number of its packages by status
+        """
+        current_sdk_root = os.path.abspath(sdk_root) if sdk_root else None
+        for path in PackageStoreHelper.get_roots():
+            record = {'path': path, 'current': path == current_sdk_root, 'exists': os.path.isdir(path), 'packages': 0,
+                      'linked': 0, 'copied': 0, 'not_stored': 0, 'modified': []}
+            if record['exists']:
+                for package in SdkScanner.get_installed_packages(path):
+                    status = PackageStoreHelper.verify_package(package)
+                    record['packages'] += 1
+                    if status == 'modified':
+                        record['modified'].append(package.path)
+                    else:
+                        record[status.replace(' ', '_')] += 1
+            yield record
+
+    def accept_licenses(self, seed=False) -> None:
+        """
+        Accepts the licenses of the installed and the mirrored packages by writing their hashes into the licenses
+        directory, sdkmanager is only started if there are no license texts to hash.
+        :param seed: accept the standard licenses as well, even if no package uses them yet
+        """
+        sdk_root = AndroidSdkHelper.get_android_sdk_root()
+        if not sdk_root:
+            print_error_and_exit('Android SDK not found, set ANDROID_SDK_ROOT')
+        licenses = LicenseHelper.get_licenses(self._get_installed_package_xml_paths() +
+                                              MirrorHelper.get_mirrored_xml_paths())
+        if seed:
+            for (license_id, hashes) in LicenseHelper.get_known_licenses().items():
+                licenses.setdefault(license_id, set()).update(hashes)
+        if not licenses:
+            print_message('No license texts found in the SDK, accepting the licenses with sdkmanager')
+            self._accept_licenses_with_sdk_manager()
+            return
+        unaccepted_licenses = LicenseHelper.get_unaccepted_licenses(sdk_root, licenses)
+        if not unaccepted_licenses:
+            print_message('All %d licenses are already accepted' % len(licenses))
+            return
+        LicenseHelper.accept(sdk_root, unaccepted_licenses)
+        for license_id in sorted(unaccepted_licenses):
+            print_message('Accepted license \"%s\"' % license_id)
+
+    @staticmethod
+    def mirror_packages(package_names, repository_url=None):
+        if not MirrorHelper.mirror(package_names, repository_url):
+            print_error_and_exit('Failed to mirror packages')
+
+    def create_avd(self, avd_name, api_version, arch, api_type, hardware=None, prebake=False, boot_timeout=None):
+        """
+        :param hardware: arguments of AvdHelper.get_hardware_config(), e.g. {'cores': 4, 'gpu_mode': 'host'}
+        :param prebake: boot the AVD once and save a snapshot, so that it is not cold booted when it is started
+        :param boot_timeout: time in seconds to wait for the AVD to boot when prebaking
+        """
+        if AvdHelper.get_avd(avd_name) is not None:
+            print_error_and_exit('AVD \"%s\" already exists' % avd_name)
+        hardware_config = AndroidEnhanced._get_hardware_config(hardware or {})
+        arch, api_type = AndroidEnhanced._get_avd_defaults(arch, api_type)
         package_name = AndroidEnhanced._get_system_images_package(api_version, arch, api_type)
         print_verbose('Package is %s' % package_name)
         self.install_api_version(api_version, arch=arch, api_type=api_type)
-        # Say no to custom hardware profile.
         print_message('Creating AVD "%s" of type "%s" ' % (avd_name, package_name))
-        create_cmd = 'echo no | %s --verbose create avd --name %s --package "%s"' % (
-            self._get_avd_manager_path(), avd_name, package_name)
-        return_code, stdout, stderr = PlatformHelper.execute_cmd(create_cmd)
+        return_code, stdout, stderr = self._run_avd_manager_create(avd_name, package_name)
         if return_code != 0:
             print_error('Failed to create AVD')
             print_error('stdout: %s' % stdout)
             print_error_and_exit('stderr: %s' % stderr)
+        AndroidEnhanced._set_avd_hardware(avd_name, hardware_config)
         print_message('AVD \"%s\" created successfully' % avd_name)
+        if prebake:
+            self._prebake_snapshot(avd_name, boot_timeout)
+
+    def _prebake_snapshot(self, avd_name, boot_timeout) -> None:
+        console_ports = EmulatorHelper.find_free_console_ports(1)
+        if not console_ports:
+            print_error_and_exit('No free emulator port found to boot AVD \"%s\"' % avd_name)
+        console_port = console_ports[0]
+        adb_path = self._get_adb_path()
+        log_path = os.path.join(CacheHelper.get_cache_dir(), _EMULATOR_LOGS_DIR, '%s-%d.log' % (avd_name, console_port))
+        # A cold boot, the snapshot is saved by name below rather than by the quick boot on exit.
+        args = ['-avd', avd_name, '-port', str(console_port), '-no-window', '-no-audio', '-no-boot-anim',
+                '-no-snapshot-load', '-no-snapshot-save']
+        print_message('Booting AVD \"%s\" to save snapshot \"%s\"...' % (avd_name, _PREBAKED_SNAPSHOT_NAME))
+        with profile_span('prebake snapshot', 'emulator', avd=avd_name):
+            process = EmulatorHelper.launch(self._get_emulator_path(), args, log_path)
+            boot_time = EmulatorHelper.wait_for_boot(adb_path, console_port, process, boot_timeout)
+            saved = boot_time is not None and EmulatorHelper.save_snapshot(adb_path, console_port,
+                                                                           _PREBAKED_SNAPSHOT_NAME)
+            if process.poll() is None:
+                EmulatorHelper.stop(adb_path, console_port, process)
+        if boot_time is None:
+            print_error_and_exit('AVD \"%s\" failed to boot, see %s' % (avd_name, log_path))
+        if not saved:
+            print_error_and_exit('Failed to save snapshot \"%s\" of AVD \"%s\", see %s' % (
+                _PREBAKED_SNAPSHOT_NAME, avd_name, log_path))
+        print_message('AVD \"%s\" booted in %.1f seconds, saved snapshot \"%s\"' % (
+            avd_name, boot_time, _PREBAKED_SNAPSHOT_NAME))
+
+    def create_avds(self, manifest_path):
+        """
+        Creates all the AVDs listed in the manifest. The system images for all of them are installed with a
+        single sdkmanager call and then the AVDs are created concurrently. The manifest is a JSON file like
+        {
+          "matrix": {"api_versions": [28, 29], "archs": ["x86_64"], "api_types": ["google_apis"],
+                     "name": "test_{api_version}_{api_type}_{arch}"},
+          "avds": [{"name": "pixel", "api_version": 28, "arch": "x86", "api_type": "default",
+                    "hardware": {"cores": 2, "ram_size": 2048}}],
+          "hardware": {"gpu_mode": "swiftshader_indirect", "data_partition_size": "6G"}
+        }
+        The top-level hardware applies to all the AVDs, see AvdHelper.get_hardware_config() for the keys.
+        """
+        avds_to_create = []
+        failed = False
+        for (avd_name, api_version, arch, api_type, hardware) in AndroidEnhanced._read_avd_manifest(manifest_path):
+            arch, api_type = AndroidEnhanced._get_avd_defaults(arch, api_type)
+            package_name = AndroidEnhanced._get_system_images_package(api_version, arch, api_type)
+            existing_avd = AvdHelper.get_avd(avd_name)
+            if existing_avd is None:
+                hardware_config = AndroidEnhanced._get_hardware_config(hardware)
+                avds_to_create.append((avd_name, api_version, arch, api_type, package_name, hardware_config))
+            elif os.path.join(*package_name.split(';')) in existing_avd.get_system_image_dirs():
+                print_message('AVD \"%s\" of type \"%s\" already exists, skipping it' % (avd_name, package_name))
+            else:
+                print_error('AVD \"%s\" already exists with a different system image \"%s\"' % (
+                    avd_name, ', '.join(existing_avd.get_system_image_dirs()) or 'unknown'))
+                failed = True
+        if not avds_to_create:
+            if failed:
+                print_error_and_exit('Failed to create AVDs')
+            print_message('No AVDs to create')
+            return
+
+        packages = []
+        for (_, api_version, arch, api_type, _, _) in avds_to_create:
+            for package in AndroidEnhanced._get_api_version_packages(api_version, arch, api_type):
+                if package not in packages:
+                    packages.append(package)
+        if not self._install_sdk_packages(packages):
+            print_error_and_exit('Failed to install the packages for the AVDs')
+
+        from concurrent.futures import ThreadPoolExecutor
+        print_message('Creating %d AVDs...' % len(avds_to_create))
+        with ThreadPoolExecutor(max_workers=min(len(avds_to_create), _MAX_CONCURRENT_AVD_CREATIONS)) as executor:
+            results = list(executor.map(lambda avd: self._run_avd_manager_create(avd[0], avd[4]), avds_to_create))
+        for ((avd_name, _, _, _, package_name, hardware_config), (return_code, stdout, stderr)) in \
+                zip(avds_to_create, results):
+            if return_code != 0:
+                failed = True
+                print_error('Failed to create AVD \"%s\" of type \"%s\"\nstdout: %s\nstderr: %s' % (
+                    avd_name, package_name, stdout, stderr))
+            else:
+                AndroidEnhanced._set_avd_hardware(avd_name, hardware_config)
+                print_message('AVD \"%s\" of type \"%s\" created successfully' % (avd_name, package_name))
+        if failed:
+            print_error_and_exit('Failed to create AVDs')
+
+    @staticmethod
+    def _read_avd_manifest(manifest_path) -> [(str, str, Optional[str], Optional[str], dict)]:
+        """
+        :return: list of (avd name, api version, arch, api type, hardware) from the manifest used by create_avds
+        """
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError) as e:
+            print_error_and_exit('Failed to read AVD manifest \"%s\": %s' % (manifest_path, e))
+        avds = []
+        hardware = manifest.get('hardware', {})
+        matrix = manifest.get('matrix', None)
+        if matrix is not None:
+            name_format = matrix.get('name', 'avd_{api_version}_{api_type}_{arch}')
+            for api_version in matrix.get('api_versions', []):
+                for arch in matrix.get('archs', [None]):
+                    for api_type in matrix.get('api_types', [None]):
+                        arch, api_type = AndroidEnhanced._get_avd_defaults(arch, api_type)
+                        name = name_format.format(api_version=api_version, arch=arch, api_type=api_type)
+                        avds.append((name, str(api_version), arch, api_type, dict(hardware)))
+        for avd in manifest.get('avds', []):
+            if 'name' not in avd or 'api_version' not in avd:
+                print_error_and_exit('Every AVD in the manifest needs a \"name\" and an \"api_version\": %s' % avd)
+            avd_hardware = dict(hardware)
+            avd_hardware.update(avd.get('hardware', {}))
+            avds.append((avd['name'], str(avd['api_version']), avd.get('arch', None), avd.get('api_type', None),
+                         avd_hardware))
+
+        names = [avd[0] for avd in avds]
+        duplicate_names = sorted(set(name for name in names if names.count(name) > 1))
+        if duplicate_names:
+            print_error_and_exit('Duplicate AVD names in the manifest: %s' % ', '.join(duplicate_names))
+        return avds
+
+    @staticmethod
+    def _get_avd_defaults(arch, api_type) -> (str, str):
+        """
+        :return: (arch, api_type) with the defaults filled in for None
+        """
+        if api_type is None:
+            api_type = 'google_apis'  # Preferred
+        if arch is None:
+            if PlatformHelper.is_64bit_architecture():
+                arch = 'x86_64'
+            else:
+                arch = 'x86'
+        return arch, api_type
+
+    @staticmethod
+    def _get_hardware_config(hardware) -> {str: str}:
+        """
+        :param hardware: arguments of AvdHelper.get_hardware_config()
+        :return: config.ini values
+        """
+        unknown_keys = sorted(set(hardware) - set(_AVD_HARDWARE_KEYS))
+        if unknown_keys:
+            print_error_and_exit('Unknown AVD hardware %s, it must be one of %s' % (
+                ', '.join(unknown_keys), ', '.join(_AVD_HARDWARE_KEYS)))
+        return AvdHelper.get_hardware_config(**hardware)
+
+    @staticmethod
+    def _set_avd_hardware(avd_name, hardware_config) -> None:
+        avd = AvdHelper.get_avd(avd_name)
+        if avd is None:
+            print_error_and_exit('AVD \"%s\" not found after creating it' % avd_name)
+        AvdHelper.update_config(avd, hardware_config)
+        print_verbose('Hardware of AVD \"%s\": %s' % (
+            avd_name, ', '.join('%s=%s' % (key, value) for (key, value) in sorted(hardware_config.items()))))
+
+    def _run_avd_manager_create(self, avd_name, package_name) -> (int, str, str):
+        # Say no to custom hardware profile, the hardware is set in config.ini afterwards.
+        create_cmd = [self._get_avd_manager_path(), '--verbose', 'create', 'avd', '--name', avd_name,
+                      '--package', package_name]
+        return PlatformHelper.execute_cmd(create_cmd, stdin_text='no\n')
 
     def start_avd(self, avd_name, headless_mode, verbose_mode):
+        self._ensure_avds_exist([avd_name])
         # cmd = '%s -avd %s -no-boot-anim -no-skin' % (self._get_emulator_path(), avd_name)
-        cmd = '%s -avd %s -no-boot-anim' % ('./emulator', avd_name)
+        cmd = ['./emulator', '-avd', avd_name, '-no-boot-anim'] + AndroidEnhanced._get_snapshot_args(avd_name)
         if headless_mode:
-            cmd = '%s -no-window' % cmd.strip()
+            cmd.append('-no-window')
         if verbose_mode:
-            cmd = '%s -verbose' % cmd.strip()
+            cmd.append('-verbose')
         return_code, stdout, stderr = PlatformHelper.execute_cmd(cmd, cwd=os.path.dirname(self._get_emulator_path()))
         if return_code != 0:
             print_error('Failed to start emulator\nstdout:\n' + stdout + '\n\nstderr:\n' + stderr)
             print_message('List of valid virtual devices')
             self.list_avds()
 
+    def start_avds(self, avd_names, instances, headless_mode, verbose_mode, boot_timeout):
+        """
+        Starts the emulators in the background concurrently and waits for all of them to boot.
+        :param avd_names: AVDs to start, instances emulators are started for each of them
+        :param boot_timeout: time in seconds to wait for an emulator to boot
+        """
+        self._ensure_avds_exist(avd_names)
+        launches = [avd_name for avd_name in avd_names for _ in range(instances)]
+        console_ports = EmulatorHelper.find_free_console_ports(len(launches))
+        if len(console_ports) < len(launches):
+            print_error_and_exit('Only %d free emulator ports found, %d are required' % (
+                len(console_ports), len(launches)))
+
+        emulator_path = self._get_emulator_path()
+        adb_path = self._get_adb_path()
+        log_dir = os.path.join(CacheHelper.get_cache_dir(), _EMULATOR_LOGS_DIR)
+        processes = []
+        for (avd_name, console_port) in zip(launches, console_ports):
+            args = ['-avd', avd_name, '-port', str(console_port), '-no-boot-anim']
+            args.extend(AndroidEnhanced._get_snapshot_args(avd_name))
+            if launches.count(avd_name) > 1:
+                # Multiple instances of the same AVD can only run if none of them writes to it.
+                args.append('-read-only')
+            if headless_mode:
+                args.append('-no-window')
+            if verbose_mode:
+                args.append('-verbose')
+            log_path = os.path.join(log_dir, '%s-%d.log' % (avd_name, console_port))
+            processes.append(EmulatorHelper.launch(emulator_path, args, log_path))
+            print_message('Starting AVD \"%s\" as \"%s\"' % (avd_name, EmulatorHelper.get_serial(console_port)))
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=len(launches)) as executor:
+            boot_times = list(executor.map(
+                lambda i: EmulatorHelper.wait_for_boot(adb_path, console_ports[i], processes[i], boot_timeout),
+                range(len(launches))))
+
+        failed = False
+        for (avd_name, console_port, boot_time) in zip(launches, console_ports, boot_times):
+            serial = EmulatorHelper.get_serial(console_port)
+            if boot_time is None:
+                failed = True
+                print_error('AVD \"%s\" (%s) failed to boot, see %s' % (
+                    avd_name, serial, os.path.join(log_dir, '%s-%d.log' % (avd_name, console_port))))
+            else:
+                print_message('AVD \"%s\" (%s) booted in %.1f seconds' % (avd_name, serial, boot_time))
+        if failed:
+            print_error_and_exit('Failed to boot all the AVDs')
+
+    def reset_avd_to_snapshot(self, avd_name) -> bool:
+        """
+        Loads the pre-baked snapshot into the running emulators of the AVD, which takes seconds instead of restarting
+        them.
+        :return: False if no emulator of the AVD is running
+        """
+        self._ensure_avds_exist([avd_name])
+        if _PREBAKED_SNAPSHOT_NAME not in AvdHelper.get_avd(avd_name).get_snapshot_names():
+            print_error_and_exit('AVD \"%s\" has no snapshot \"%s\", create it with create avd --prebake' % (
+                avd_name, _PREBAKED_SNAPSHOT_NAME))
+        adb_path = self._get_adb_path()
+        console_ports = [console_port for (console_port, name) in EmulatorHelper.get_running_avds(adb_path).items()
+                         if name == avd_name]
+        if not console_ports:
+            print_verbose('No emulator of AVD \"%s\" is running' % avd_name)
+            return False
+        failed = False
+        for console_port in console_ports:
+            serial = EmulatorHelper.get_serial(console_port)
+            if EmulatorHelper.load_snapshot(adb_path, console_port, _PREBAKED_SNAPSHOT_NAME):
+                print_message('AVD \"%s\" (%s) reset to snapshot \"%s\"' % (avd_name, serial, _PREBAKED_SNAPSHOT_NAME))
+            else:
+                failed = True
+                print_error('Failed to reset AVD \"%s\" (%s) to snapshot \"%s\"' % (
+                    avd_name, serial, _PREBAKED_SNAPSHOT_NAME))
+        if failed:
+            print_error_and_exit('Failed to reset the AVD')
+        return True
+
     @staticmethod
-    def _ensure_correct_java_version():
-        default_java_version = AndroidEnhanced._get_default_java_version()
+    def _get_snapshot_args(avd_name) -> [str]:
+        avd = AvdHelper.get_avd(avd_name)
+        if avd is None or _PREBAKED_SNAPSHOT_NAME not in avd.get_snapshot_names():
+            return []
+        # The snapshot is never saved over, every start begins from the state right after the first boot.
+        return ['-snapshot', _PREBAKED_SNAPSHOT_NAME, '-no-snapshot-save']
+
+    def _ensure_avds_exist(self, avd_names) -> None:
+        missing_avds = [avd_name for avd_name in avd_names if AvdHelper.get_avd(avd_name) is None]
+        if missing_avds:
+            print_error('AVD not found: %s' % ', '.join(missing_avds))
+            print_message('List of valid virtual devices')
+            self.list_avds()
+            print_error_and_exit('Failed to start emulator')
+
+    @staticmethod
+    def _check_default_java_version() -> (bool, Optional[str], [str], [str]):
+        return True, JavaHelper.get_default_java_version(), [], []
+
+    @staticmethod
+    def _check_all_java_versions() -> (bool, [str], [str], [str]):
+        return True, JavaHelper.get_all_java_versions(), [], []
+
+    @staticmethod
+    def _check_java_version(default_java_version, all_java_versions) -> (bool, Optional[str], [str], [str]):
         if default_java_version is None:
-            print_error_and_exit('Java is not installed. Install Java for Android via %s' %
-                                 _JAVA8_INSTALL_COMMAND_FOR_MAC)
+            return False, None, [], ['Java is not installed. Install Java for Android via %s' %
+                                     _JAVA8_INSTALL_COMMAND_FOR_MAC]
         if default_java_version != _JAVA_VERSION_FOR_ANDROID:
-            all_java_versions = AndroidEnhanced._get_all_java_versions()
             if _JAVA_VERSION_FOR_ANDROID in all_java_versions:
-                print_error_and_exit('Java version %s is installed but default is set to Java %s.\n'
-                                     'Set the correct java version via "%s"' % (
-                                         _JAVA_VERSION_FOR_ANDROID,
-                                         default_java_version,
-                                         _SET_JAVA8_AS_DEFAULT_ON_MAC))
+                return False, default_java_version, [], [
+                    'Java version %s is installed but default is set to Java %s.\n'
+                    'Set the correct java version via "%s"' % (
+                        _JAVA_VERSION_FOR_ANDROID,
+                        default_java_version,
+                        _SET_JAVA8_AS_DEFAULT_ON_MAC)]
             else:
-                print_error_and_exit('Java version is %s, Android needs Java %s.\n'
-                                     'On Mac install it with "%s"\nAnd then set default version'
-                                     'via "%s"' % (
-                                         default_java_version, _JAVA_VERSION_FOR_ANDROID,
-                                         _JAVA8_INSTALL_COMMAND_FOR_MAC, _SET_JAVA8_AS_DEFAULT_ON_MAC))
-        else:
-            print_message('Correct Java version %s is installed' % default_java_version)
+                return False, default_java_version, [], [
+                    'Java version is %s, Android needs Java %s.\n'
+                    'On Mac install it with "%s"\nAnd then set default version'
+                    'via "%s"' % (
+                        default_java_version, _JAVA_VERSION_FOR_ANDROID,
+                        _JAVA8_INSTALL_COMMAND_FOR_MAC, _SET_JAVA8_AS_DEFAULT_ON_MAC)]
+        return True, default_java_version, ['Correct Java version %s is installed' % default_java_version], []
 
-    def _ensure_sdkmanager_is_installed(self):
-        if not self._get_sdk_manager_path():
-            print_error_and_exit('sdkamanger not found, is Android SDK installed?')
+    def _check_sdkmanager_is_installed(self) -> (bool, Optional[str], [str], [str]):
+        sdk_manager = self._get_sdk_manager_path()
+        if not sdk_manager:
+            return False, None, [], ['sdkamanger not found, is Android SDK installed?']
+        return True, sdk_manager, [], []
 
-    def _accept_all_licenses(self):
-        cmd = 'yes | %s --licenses' % self._get_sdk_manager_path()
-        return_code, stdout, stderr = PlatformHelper.execute_cmd(cmd)
+    def _accept_licenses_with_sdk_manager(self) -> None:
+        cmd = [self._get_sdk_manager_path(), '--licenses']
+        return_code, stdout, _ = PlatformHelper.execute_cmd(cmd, stdin_text=_SDK_MANAGER_ANSWERS)
         if return_code != 0:
             print_error_and_exit('Failed to accept licenses, return code: %d' % return_code)
         license_regex = '([0-9]*) of ([0-9]*) SDK package licenses not accepted'
@@ -275,103 +837,102 @@ class AndroidEnhanced:
         else:
             print_message('%d of %d licenses accepted' % (int(result.group(1)), int(result.group(2))))
 
-    @staticmethod
-    def _get_default_java_version() -> Optional[str]:
-        return_code, stdout, stderr = PlatformHelper.execute_cmd('java -version')
-        if return_code != 0:
-            print_error('Failed to get java version')
-            return None
-        # TODO(ashishb): Do I need two different regex for Mac and Linux like _get_all_java_versions here?
-        java_version_regex = r'"([0-9]+\.[0-9]+)\..*"'
-        version = re.search(java_version_regex, stderr)
-        if version is None:
-            return None
-        print_verbose('version object is %s' % version)
-        return version.group(1)
+    def _get_package_sizes(self) -> {str: int}:
+        """
+        :return: package path -> size in bytes of the installed packages
+        """
+        packages = [package for package in self._get_installed_sdk_packages() if package.location]
+        sizes = DiskUsageHelper.get_sizes(AndroidSdkHelper.get_android_sdk_root(),
+                                          [package.location for package in packages])
+        return {package.path: sizes.get(package.location, 0) for package in self._get_installed_sdk_packages()}
 
     @staticmethod
-    def _get_all_java_versions() -> [str]:
-        if PlatformHelper.on_linux():
-            return_code, stdout, stderr = PlatformHelper.execute_cmd(_GET_ALL_JAVA_VERSIONS_ON_LINUX)
-            java_version_regex = 'java-([0-9]+.*?)/'
-        elif PlatformHelper.on_mac():
-            java_version_regex = r'"([0-9]+\.[0-9]+)\..*"'
-            return_code, stdout, stderr = PlatformHelper.execute_cmd(_GET_ALL_JAVA_VERSIONS_ON_MAC)
-        else:
-            print_error('Unsupported operating system')
-            return []
+    def _get_packages_used_by_avds() -> {str: [str]}:
+        """
+        :return: package path -> names of the AVDs which use the system image
+        """
+        used_packages = {}
+        for avd in AvdHelper.list_avds():
+            for image_dir in avd.get_system_image_dirs():
+                # e.g. system-images/android-28/default/x86 -> system-images;android-28;default;x86
+                package_path = ';'.join(part for part in image_dir.split(os.sep) if part)
+                used_packages.setdefault(package_path, []).append(avd.name)
+        return used_packages
+
+    def _get_installed_package_xml_paths(self) -> [str]:
+        """
+        :return: package.xml files of the installed packages, these contain the texts of their licenses
+        """
+        package_xml_paths = []
+        for package in self._get_installed_sdk_packages():
+            if package.location and os.path.isfile(os.path.join(package.location, _PACKAGE_XML)):
+                package_xml_paths.append(os.path.join(package.location, _PACKAGE_XML))
+        return package_xml_paths
 
-        if return_code != 0:
-            print_error('Failed to list java versions')
-            return []
-        output = ''
-        output += stdout
-        output += stderr
-        versions = re.findall(java_version_regex, output)
-        versions = set(versions)
-        print_verbose('Versions are %s' % versions)
-        return versions
-    
     def _get_installed_packages(self) -> [str]:
-        cmd = '%s --verbose --list --include_obsolete' % self._get_sdk_manager_path()
-        return_code, stdout, stderr = PlatformHelper.execute_cmd(cmd)
-        if return_code != 0:
-            print_error('Failed to list packages')
-            return None
-
-        start_line = 'Installed packages:'.lower()
-        end_line = 'Available Packages:'.lower()
-        lines = stdout.split('\n')
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            if line.lower().find(start_line) != -1:
-                i += 1
-                break
-            else:
-                i += 1
-        installed_packages = set()
-        for j in range(i, len(lines)):
-            line = lines[j]
-            if line.lower().find(end_line) != -1:
-                break
-            line = line.strip()
-            if not line:
-                continue
+        """
+        :return: sorted list of the paths of the installed packages
+        """
+        return [package.path for package in self._get_installed_sdk_packages()]
 
-            if line.startswith('----'):
-                continue
-            if line.startswith('Description:'):
-                continue
-            if line.startswith('Version:'):
-                continue
-            if line.startswith('Installed Location:'):
-                continue
-            if line.startswith('Installed Obsolete Packages:'):
-                continue
-            if line.find('|') > 0:
-                line = line[:line.find('|')]
-            installed_packages.add(line)
-        return sorted(installed_packages)
+    def _get_installed_sdk_packages(self) -> [SdkPackage]:
+        """
+        :return: installed packages sorted by path, found by scanning the SDK root and falling back to sdkmanager
+        when the SDK root is not known.
+        """
+        with self._sdk_state_lock:
+            if self._installed_packages is not None:
+                return self._installed_packages
+            installed_packages = self._scan_installed_packages(AndroidSdkHelper.get_android_sdk_root())
+            if not installed_packages:
+                print_verbose('No packages found in the SDK root, using sdkmanager')
+                installed_packages = self._get_catalog().get_installed_packages()
+            self._installed_packages = installed_packages
+            return installed_packages
+
+    def _scan_installed_packages(self, sdk_root) -> [SdkPackage]:
+        """
+        The scanned packages are cached on the disk till the SDK directory tree changes, like the catalog.
+        """
+        fingerprint = self._get_sdk_fingerprint()
+        if fingerprint is None:
+            return SdkScanner.get_installed_packages(sdk_root)
+        cache_key = CacheHelper.get_key(sdk_root)
+        if not self._refresh_cache:
+            cached_packages = CacheHelper.read(_INSTALLED_PACKAGES_CACHE, cache_key, fingerprint=fingerprint)
+            if cached_packages is not None:
+                return [SdkPackage.from_list(values) for values in cached_packages]
+        installed_packages = SdkScanner.get_installed_packages(sdk_root)
+        CacheHelper.write(_INSTALLED_PACKAGES_CACHE, cache_key, [package.to_list() for package in installed_packages],
+                          fingerprint=fingerprint)
+        return installed_packages
+
+    def _get_sdk_fingerprint(self) -> Optional[str]:
+        """
+        :return: fingerprint of the SDK directory tree, it is computed once till the SDK state is cleared
+        """
+        with self._sdk_state_lock:
+            if self._sdk_fingerprint is None:
+                self._sdk_fingerprint = CacheHelper.get_sdk_fingerprint(AndroidSdkHelper.get_android_sdk_root())
+            return self._sdk_fingerprint
 
     def _get_build_tools(self) -> [str]:
         """
         :return: List of build tools packages, sorted by version number, latest package comes last
         """
-        cmd = '%s --verbose --list --include_obsolete' % self._get_sdk_manager_path()
-        return_code, stdout, stderr = PlatformHelper.execute_cmd(cmd)
-        if return_code != 0:
-            print_error_and_exit('Failed to list build tools, stdout: %s, stderr: %s' % (stdout, stderr))
-        build_tools = re.findall(_BUILD_TOOLS_REGEX, stdout)
-        build_tools = sorted(set(build_tools))
+        build_tools = [package.path for package in self._get_catalog().get_index().get_build_tools()]
         print_verbose('Build tools are %s' % build_tools)
         return build_tools
 
-    def _get_basic_packages(self) -> [str]:
-        build_tools = self._get_build_tools()
-        if not build_tools:
-            print_error_and_exit('Build tools list is empty, this is unexpected')
-        latest_build_package = build_tools[-1]
+    def _get_basic_packages(self, latest_build_package=None) -> [str]:
+        """
+        :param latest_build_package: build tools package to use, the latest available one if None
+        """
+        if latest_build_package is None:
+            latest_build_tools = self._get_catalog().get_index().get_latest_build_tools()
+            if latest_build_tools is None:
+                print_error_and_exit('Build tools list is empty, this is unexpected')
+            latest_build_package = latest_build_tools.path
         print_verbose('Latest build package is \"%s\"' % latest_build_package)
         packages_to_install = [
             latest_build_package,
@@ -439,22 +1000,184 @@ class AndroidEnhanced:
         return 'system-images;android-%s;%s;%s' % (version, api_type, arch)
 
     def _install_sdk_packages(self, package_names) -> bool:
-        for package_name in package_names:
-            exists = self._does_package_exist(package_name)
-            if not exists:
-                print_message('Package \"%s\" not found' % package_name)
-                return False
+        package_names = self._get_packages_to_install(package_names)
+        if not package_names:
+            return True
 
-        print_message('Installing packages [%s]...' % ', '.join(package_names))
-        package_names_str = '\"' + '\" \"'.join(package_names) + '\"'
-        cmd = 'yes | %s --verbose %s' % (self._get_sdk_manager_path(), package_names_str)
-        return_code, stdout, stderr = PlatformHelper.execute_cmd(cmd)
-        if return_code != 0:
-            print_error('Failed to install packages \"%s\"' % ' '.join(package_names))
-            print_error('Stderr is \n%s' % stderr)
+        # Fail fast on typos, instead of letting sdkmanager fail after fetching all the remote repositories.
+        missing_packages = [package_name for package_name in package_names
+                            if not self._does_package_exist(package_name)]
+        for package_name in missing_packages:
+            similar_packages = self._get_similar_packages(package_name)
+            if similar_packages:
+                print_message('Package \"%s\" not found, did you mean \"%s\"?' % (
+                    package_name, '\" or \"'.join(similar_packages)))
+            else:
+                print_message('Package \"%s\" not found' % package_name)
+        if missing_packages:
             return False
+
+        # Concurrent installs into the same SDK run one after another. The packages installed by the process which
+        # held the lock are not downloaded again.
+        with SdkLock(AndroidSdkHelper.get_android_sdk_root(), package_names, self._lock_timeout) as lock:
+            if lock.waited:
+                self.clear_sdk_state()
+                package_names = self._get_packages_to_install(package_names)
+                if not package_names:
+                    return True
+            print_message('Installing packages [%s]...' % ', '.join(package_names))
+            return self._run_sdk_manager_install(package_names)
+
+    def _get_packages_to_install(self, package_names) -> [str]:
+        """
+        :return: the packages which are not installed yet
+        """
+        # Installed packages don't need sdkmanager, this avoids starting the JVM when everything is in place.
+        installed_packages = set(self._get_installed_packages())
+        already_installed_packages = [package_name for package_name in package_names
+                                      if package_name in installed_packages]
+        if already_installed_packages:
+            print_message('Packages [%s] are already installed' % ', '.join(already_installed_packages))
+            package_names = [package_name for package_name in package_names
+                             if package_name not in installed_packages]
+        return package_names
+
+    def _run_sdk_manager_install(self, package_names, versions=None) -> bool:
+        """
+        Installs the packages, or updates them if they are already installed, the licenses are accepted on the way.
+        If the SDK root was added to the shared store, see "roots", the packages in the store are linked from it and
+        the newly installed packages are added to it afterwards. The rest are installed from the local mirror if it
+        has all of them, see "mirror".
+        :param versions: package name -> version, for the packages which must be installed at a particular version
+        """
+        sdk_root = AndroidSdkHelper.get_android_sdk_root()
+        uses_store = bool(sdk_root) and PackageStoreHelper.is_root(sdk_root)
+        previous_packages = set((package.path, package.version) for package in self._get_installed_sdk_packages())
+        if uses_store:
+            package_names = self._link_stored_packages(sdk_root, package_names, versions)
+        if package_names:
+            env = MirrorHelper.get_sdk_manager_env(package_names, versions)
+            if env is not None:
+                print_message('Installing from the local mirror')
+            cmd = [self._get_sdk_manager_path(), '--verbose'] + list(package_names)
+            return_code, stdout, stderr = PlatformHelper.execute_cmd(cmd, env=env, stdin_text=_SDK_MANAGER_ANSWERS)
+            if return_code != 0:
+                self._invalidate_sdk_manager_listing()
+                print_error('Failed to install packages \"%s\"' % ' '.join(package_names))
+                print_error('Stderr is \n%s' % stderr)
+                return False
+        self._invalidate_sdk_manager_listing()
+        if uses_store:
+            new_packages = [package for package in self._get_installed_sdk_packages()
+                            if (package.path, package.version) not in previous_packages and package.location and
+                            _is_inside_directory(package.location, sdk_root)]
+            PackageStoreHelper.add_packages(sdk_root, new_packages)
+            # No SDK root may use the previous revisions of the updated packages any more.
+            self._prune_package_store()
         return True
 
+    def _link_stored_packages(self, sdk_root, package_names, versions) -> [str]:
+        """
+        Links the packages which are in the shared store at the required revision into the SDK root, along with their
+        dependencies which are in the store as well.
+        :param versions: package name -> version, the latest available version is linked for the other packages
+        :return: the packages which sdkmanager still has to install, including the dependencies of the linked ones
+        """
+        installed_packages = set(self._get_installed_packages())
+        linked_package_names = []
+        remaining_package_names = []
+        pending_package_names = list(package_names)
+        while pending_package_names:
+            package_name = pending_package_names.pop(0)
+            revision = None
+            # The catalog is not needed if the store has no revision of the package.
+            if PackageStoreHelper.is_stored(package_name):
+                package = self._get_catalog().get(package_name)
+                revision = (versions or {}).get(package_name, None) or \
+                    (package.available_version or package.version if package is not None else None)
+            if not revision or not PackageStoreHelper.link_package(sdk_root, package_name, revision):
+                remaining_package_names.append(package_name)
+                continue
+            print_message('Linked %s %s from the shared store' % (package_name, revision))
+            linked_package_names.append(package_name)
+            for dependency in PackageStoreHelper.get_dependencies(package_name, revision):
+                if dependency not in installed_packages and dependency not in linked_package_names and \
+                        dependency not in remaining_package_names and dependency not in pending_package_names:
+                    pending_package_names.append(dependency)
+        if linked_package_names:
+            self.clear_sdk_state()
+            # sdkmanager would have accepted these on the way.
+            licenses = LicenseHelper.get_licenses(
+                os.path.join(sdk_root, *package_name.split(';'), _PACKAGE_XML) for package_name in linked_package_names)
+            LicenseHelper.accept(sdk_root, LicenseHelper.get_unaccepted_licenses(sdk_root, licenses))
+        return remaining_package_names
+
+    def _get_catalog(self) -> SdkCatalog:
+        """
+        Lists all the packages via sdkmanager. The parsed catalog is cached on the disk, keyed on the SDK root and the
+        sdkmanager path, it is reused till it expires or the SDK directory tree changes.
+        :return: catalog of all the installed and available packages
+        """
+        with self._sdk_state_lock:
+            if self._catalog is None:
+                self._catalog = self._load_catalog()
+            return self._catalog
+
+    def _load_catalog(self) -> SdkCatalog:
+        sdk_manager = self._get_sdk_manager_path()
+        sdk_root = AndroidSdkHelper.get_android_sdk_root()
+        cache_key = CacheHelper.get_key(sdk_root, sdk_manager)
+        if self._offline:
+            catalog = self._read_cached_catalog()
+            if catalog is None:
+                print_error_and_exit('No cached package list found, run once without --offline')
+            return catalog
+
+        fingerprint = self._get_sdk_fingerprint()
+        if not self._refresh_cache:
+            cached_catalog = CacheHelper.read(_SDK_MANAGER_LIST_CACHE, cache_key, fingerprint=fingerprint)
+            if cached_catalog is not None:
+                return SdkCatalog.from_dict(cached_catalog)
+
+        with profile_span('package catalog', 'parse') as span:
+            # The listing is parsed while sdkmanager is still writing it.
+            parser = SdkCatalogParser()
+            cmd = [sdk_manager, '--verbose', '--list', '--include_obsolete']
+            return_code, _, stderr = PlatformHelper.execute_cmd(cmd, stdout_callback=parser.feed_line)
+            if return_code != 0:
+                print_error_and_exit('Failed to list packages, return code: %d, stderr: %s' % (return_code, stderr))
+            catalog = parser.finish()
+            span.args['packages'] = len(catalog)
+        print_verbose('Found %d packages' % len(catalog))
+        CacheHelper.write(_SDK_MANAGER_LIST_CACHE, cache_key, catalog.to_dict(), fingerprint=fingerprint)
+        return catalog
+
+    def _read_cached_catalog(self) -> Optional[SdkCatalog]:
+        """
+        :return: the catalog which is already loaded or the cached one, even if it is stale, None if there is none
+        """
+        with self._sdk_state_lock:
+            if self._catalog is not None:
+                return self._catalog
+        cache_key = CacheHelper.get_key(AndroidSdkHelper.get_android_sdk_root(), self._get_sdk_manager_path())
+        cached_catalog = CacheHelper.read(_SDK_MANAGER_LIST_CACHE, cache_key, ttl=None)
+        return SdkCatalog.from_dict(cached_catalog) if cached_catalog is not None else None
+
+    def _invalidate_sdk_manager_listing(self) -> None:
+        self.clear_sdk_state()
+        cache_key = CacheHelper.get_key(AndroidSdkHelper.get_android_sdk_root(), self._get_sdk_manager_path())
+        CacheHelper.delete(_SDK_MANAGER_LIST_CACHE, cache_key)
+
+    def _get_adb_path(self) -> Optional[str]:
+        """
+        :return: path to adb binary, caches the result for the future use.
+        """
+        if not self._adb:
+            self._adb = AndroidSdkHelper.get_adb_path_uncached()
+            print_verbose('adb is located at %s' % self._adb)
+        # Return the cached value
+        return self._adb
+
     def _get_avd_manager_path(self) -> Optional[str]:
         """
         :return: path to avdmanager binary, caches the result for the future use.
@@ -486,7 +1209,70 @@ class AndroidEnhanced:
         # Return the cached value
         return self._emulator
 
-    # TODO(ashishb): Implement this in the future to check whether a package is available or not.
-    #pylint: disable=W0613
-    def _does_package_exist(self, package_name):
-        return True
+    def _does_package_exist(self, package_name) -> bool:
+        return package_name in self._get_catalog()
+
+    def _get_similar_packages(self, package_name) -> [str]:
+        """
+        :return: up to _MAX_SIMILAR_PACKAGES packages with a name similar to package_name, most similar first
+        """
+        import difflib
+        catalog = self._get_catalog()
+        parts = package_name.split(';')
+        similar_packages = []
+        if parts[0] == 'system-images' and len(parts) == 4:
+            # Same API version and architecture but a different API type, for example, google_apis instead of
+            # google_apis_playstore which _get_system_images_package prefers.
+            similar_packages = [package.path for package in catalog.get_packages('%s;%s;' % (parts[0], parts[1]))
+                                if package.path.endswith(';' + parts[3])]
+        # Only packages of the same type are considered, comparing with every package is slow.
+        candidates = [package.path for package in catalog.get_packages(parts[0])]
+        for similar_package in difflib.get_close_matches(package_name, candidates, n=_MAX_SIMILAR_PACKAGES):
+            if similar_package not in similar_packages:
+                similar_packages.append(similar_package)
+        return similar_packages[:_MAX_SIMILAR_PACKAGES]
+
+
+def _print_records(records, output_format) -> None:
+    """
+    Prints the records of a list command for other programs. ndjson prints a JSON object per line as soon as the record
+    is produced, json prints a single JSON array of all the records.
+    """
+    if output_format == 'ndjson':
+        for record in records:
+            print(json.dumps(record), flush=True)
+    else:
+        print(json.dumps(list(records), indent=2))
+
+
+def _get_human_readable_size(size) -> str:
+    if size is None:
+        return 'unknown'
+    if size < 1024:
+        return '%d bytes' % size
+    for unit in ['KB', 'MB', 'GB']:
+        size /= 1024.0
+        if size < 1024 or unit == 'GB':
+            return '%.1f %s' % (size, unit)
+
+
+def _remove_empty_parent_directories(path, root_dir) -> None:
+    """
+    Removes the parent directories of the path which are empty now, e.g. system-images/android-28/default, up to the
+    root directory.
+    """
+    directory = os.path.dirname(os.path.realpath(path))
+    root_dir = os.path.realpath(root_dir)
+    while _is_inside_directory(directory, root_dir):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # Not empty
+            return
+        directory = os.path.dirname(directory)
+
+
+def _is_inside_directory(path, directory) -> bool:
+    path = os.path.realpath(path)
+    directory = os.path.realpath(directory)
+    return path != directory and os.path.commonpath([path, directory]) == directory
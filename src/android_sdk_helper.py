@@ -3,21 +3,37 @@ from typing import Optional
 
 try:
     # This works when the code is executed directly.
-    from platform_helper import PlatformHelper
+    from cache_helper import CacheHelper
     from output_helper import print_error, print_error_and_exit, print_verbose
 except ImportError:
     # This fails when the code is executed directly and not as a part of python package installation,
     # I definitely need a better way to handle this.
-    from androide.platform_helper import PlatformHelper
+    from androide.cache_helper import CacheHelper
     from androide.output_helper import print_error, print_error_and_exit, print_verbose
 
+_BINARIES_CACHE = 'binaries'
+# Directory containing the command-line tools, inside the "cmdline-tools/<version>" directory.
+_CMDLINE_TOOLS_DIR = 'cmdline-tools'
+_CMDLINE_TOOLS_LATEST = 'latest'
+
+# Binaries resolved by this process, binary name -> path
+_resolved_binaries = {}
+
 
 class AndroidSdkHelper:
 
     @staticmethod
     def get_avd_manager_path_uncached() -> Optional[str]:
         binary_name = 'avdmanager'
-        binary_paths = [os.path.join('tools', 'bin', 'avdmanager')]
+        binary_paths = AndroidSdkHelper._get_cmdline_tools_paths(binary_name) + [
+            os.path.join('tools', 'bin', 'avdmanager')  # Old path
+        ]
+        return AndroidSdkHelper._get_binary(binary_name, binary_paths)
+
+    @staticmethod
+    def get_adb_path_uncached() -> Optional[str]:
+        binary_name = 'adb'
+        binary_paths = [os.path.join('platform-tools', 'adb')]
         return AndroidSdkHelper._get_binary(binary_name, binary_paths)
 
     @staticmethod
@@ -32,32 +48,99 @@ class AndroidSdkHelper:
     @staticmethod
     def get_sdk_manager_path_uncached() -> Optional[str]:
         binary_name = 'sdkmanager'
-        binary_paths = [os.path.join('tools', 'bin', 'sdkmanager')]
+        binary_paths = AndroidSdkHelper._get_cmdline_tools_paths(binary_name) + [
+            os.path.join('tools', 'bin', 'sdkmanager')  # Old path
+        ]
         return AndroidSdkHelper._get_binary(binary_name, binary_paths)
 
+    @staticmethod
+    def get_android_sdk_root() -> Optional[str]:
+        return AndroidSdkHelper._get_location_of_android_sdk()
+
+    @staticmethod
+    def _get_cmdline_tools_paths(binary_name) -> [str]:
+        """
+        :return: paths of the binary in "cmdline-tools/latest" and then in the versioned "cmdline-tools/<version>"
+        directories, newest version first.
+        """
+        versions = [_CMDLINE_TOOLS_LATEST]
+        sdk_location = AndroidSdkHelper._get_location_of_android_sdk()
+        if sdk_location:
+            try:
+                with os.scandir(os.path.join(sdk_location, _CMDLINE_TOOLS_DIR)) as entries:
+                    other_versions = [entry.name for entry in entries
+                                      if entry.name != _CMDLINE_TOOLS_LATEST and entry.is_dir()]
+                versions.extend(sorted(other_versions, key=_get_version_sort_key, reverse=True))
+            except OSError:
+                pass
+        return [os.path.join(_CMDLINE_TOOLS_DIR, version, 'bin', binary_name) for version in versions]
+
     @staticmethod
     def _get_binary(binary_name, binary_paths_relative_to_android_sdk) -> str:
+        """
+        Looks for the binary in the SDK root and then in the PATH. The result is cached on the disk and revalidated
+        with a single stat() call in the future runs.
+        """
+        if binary_name in _resolved_binaries:
+            return _resolved_binaries[binary_name]
+
         sdk_location = AndroidSdkHelper._get_location_of_android_sdk()
+        cache_key = CacheHelper.get_key(binary_name, sdk_location, os.environ.get('PATH', ''))
+        # A newer layout, like "cmdline-tools/latest", being installed changes the mtime of these directories.
+        layout_mtimes = [_get_mtime(sdk_location), _get_mtime(os.path.join(sdk_location, _CMDLINE_TOOLS_DIR))] \
+            if sdk_location else []
+        cached_binary = CacheHelper.read(_BINARIES_CACHE, cache_key, ttl=None)
+        if cached_binary is not None and _get_mtime(cached_binary['path']) == cached_binary.get('mtime') and \
+                cached_binary.get('layout_mtimes') == layout_mtimes:
+            print_verbose('\"%s\" found at \"%s\" (cached)' % (binary_name, cached_binary['path']))
+            _resolved_binaries[binary_name] = cached_binary['path']
+            return cached_binary['path']
+
+        binary_path = AndroidSdkHelper._find_binary(binary_name, binary_paths_relative_to_android_sdk, sdk_location)
+        if binary_path is None:
+            print_error_and_exit('Set ANDROID_SDK_ROOT environment variable to point to Android SDK root')
+        CacheHelper.write(_BINARIES_CACHE, cache_key, {
+            'path': binary_path,
+            'mtime': _get_mtime(binary_path),
+            'layout_mtimes': layout_mtimes,
+        })
+        _resolved_binaries[binary_name] = binary_path
+        return binary_path
+
+    @staticmethod
+    def _find_binary(binary_name, binary_paths_relative_to_android_sdk, sdk_location) -> Optional[str]:
         if not sdk_location:
             print_verbose('ANDROID_SDK_ROOT not defined')
         else:
             for relative_path in binary_paths_relative_to_android_sdk:
                 binary_path = os.path.join(sdk_location, relative_path)
                 if os.path.exists(binary_path):
-                    print_error('\"%s\" found at \"%s\"' % (binary_name, binary_path))
+                    print_verbose('\"%s\" found at \"%s\"' % (binary_name, binary_path))
                     return binary_path
                 else:
-                    print_error('\"%s\" not found at \"%s\"' % (binary_name, binary_path))
+                    print_verbose('\"%s\" not found at \"%s\"' % (binary_name, binary_path))
 
-        # Only works on Mac and GNU/Linux
-        if PlatformHelper.on_linux() or PlatformHelper.on_mac():
-            return_code, stdout, stderr = PlatformHelper.execute_cmd('command -v %s' % binary_name)
-            if return_code == 0:
-                return stdout.strip()
-            else:
-                print_error('\"%s\" not in path' % binary_name)
-        print_error_and_exit('Set ANDROID_SDK_ROOT environment variable to point to Android SDK root')
+        import shutil
+        binary_path = shutil.which(binary_name)
+        if binary_path is not None:
+            print_verbose('\"%s\" found in path at \"%s\"' % (binary_name, binary_path))
+            return binary_path
+        print_error('\"%s\" not in path' % binary_name)
+        return None
 
     @staticmethod
     def _get_location_of_android_sdk() -> Optional[str]:
-        return os.environ.get('ANDROID_SDK_ROOT', None)
+        # ANDROID_HOME is deprecated but still widely used.
+        return os.environ.get('ANDROID_SDK_ROOT', None) or os.environ.get('ANDROID_HOME', None)
+
+
+def _get_mtime(path) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _get_version_sort_key(version) -> [int]:
+    # "2.1" -> [2, 1], non-numeric directory names sort first.
+    return [int(part) if part.isdigit() else -1 for part in version.split('.')]
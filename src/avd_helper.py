@@ -0,0 +1,262 @@
+import os
+import re
+import sys
+from typing import Optional
+
+try:
+    # This works when the code is executed directly.
+    from output_helper import print_error_and_exit, print_verbose
+    from profile_helper import profile_span
+except ImportError:
+    # This fails when the code is executed directly and not as a part of python package installation,
+    # I definitely need a better way to handle this.
+    from androide.output_helper import print_error_and_exit, print_verbose
+    from androide.profile_helper import profile_span
+
+_AVD_INI_EXTENSION = '.ini'
+_AVD_DIR_EXTENSION = '.avd'
+_CONFIG_INI = 'config.ini'
+_SNAPSHOTS_DIR = 'snapshots'
+_GPU_MODES = ('auto', 'host', 'swiftshader_indirect', 'angle_indirect', 'guest', 'off')
+# e.g. "6G" or "800M", in bytes without a suffix
+_DATA_PARTITION_SIZE_PATTERN = r'^\d+[KMG]?$'
+# The emulator gets half of the host cores and a quarter of its memory, so that a few of them can run side by side.
+_MAX_DEFAULT_CORES = 4
+_MIN_DEFAULT_RAM_SIZE_IN_MB = 1536
+_MAX_DEFAULT_RAM_SIZE_IN_MB = 4096
+
+
+class AvdInfo:
+    """
+    An Android Virtual Device, as described by <avd home>/<name>.ini and its config.ini.
+    """
+    __slots__ = ('name', 'target', 'abi', 'tag', 'path', 'disk_size', 'config')
+
+    def __init__(self, name) -> None:
+        self.name = name
+        # e.g. "android-28"
+        self.target = None
+        # e.g. "x86"
+        self.abi = None
+        # e.g. "google_apis"
+        self.tag = None
+        self.path = None
+        # Size of all the files of the AVD in bytes, None if it was not computed.
+        self.disk_size = None
+        # Contents of config.ini
+        self.config = {}
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'path': self.path,
+            'target': self.target,
+            'tag': self.tag,
+            'abi': self.abi,
+            'disk_size': self.disk_size,
+        }
+
+    def get_system_image_dirs(self) -> [str]:
+        """
+        :return: system image directories relative to the SDK root, e.g. "system-images/android-28/default/x86"
+        """
+        image_dirs = []
+        for i in range(1, 10):
+            image_dir = self.config.get('image.sysdir.%d' % i, None)
+            if image_dir is None:
+                break
+            image_dirs.append(os.path.normpath(image_dir.replace('/', os.sep)))
+        return image_dirs
+
+    def get_snapshot_names(self) -> [str]:
+        """
+        :return: names of the snapshots saved in the AVD, including "default_boot" of quick boot
+        """
+        try:
+            with os.scandir(os.path.join(self.path, _SNAPSHOTS_DIR)) as entries:
+                return sorted(entry.name for entry in entries if entry.is_dir())
+        except OSError:
+            return []
+
+
+class AvdHelper:
+    """
+    Reads the AVDs directly from the AVD home directory instead of starting the avdmanager JVM.
+    """
+
+    @staticmethod
+    def get_avd_home() -> str:
+        if os.environ.get('ANDROID_AVD_HOME', None):
+            return os.environ['ANDROID_AVD_HOME']
+        if os.environ.get('ANDROID_EMULATOR_HOME', None):
+            return os.path.join(os.environ['ANDROID_EMULATOR_HOME'], 'avd')
+        if os.environ.get('ANDROID_SDK_HOME', None):
+            return os.path.join(os.environ['ANDROID_SDK_HOME'], '.android', 'avd')
+        return os.path.join(os.path.expanduser('~'), '.android', 'avd')
+
+    @staticmethod
+    def list_avds(with_disk_size=False) -> [AvdInfo]:
+        """
+        :param with_disk_size: compute the disk size of each AVD, this requires walking all the AVD directories
+        :return: AVDs sorted by name
+        """
+        avd_home = AvdHelper.get_avd_home()
+        try:
+            with os.scandir(avd_home) as entries:
+                avd_names = [entry.name[:-len(_AVD_INI_EXTENSION)] for entry in entries
+                             if entry.name.endswith(_AVD_INI_EXTENSION) and entry.is_file()]
+        except OSError:
+            print_verbose('AVD home \"%s\" not found' % avd_home)
+            return []
+        with profile_span('read avds', 'parse', avds=len(avd_names)):
+            # The files are small, a thread pool takes longer to import than reading them one by one.
+            avds = [AvdHelper._read_avd(avd_home, avd_name, with_disk_size) for avd_name in sorted(avd_names)]
+        return avds
+
+    @staticmethod
+    def get_avd(avd_name) -> Optional[AvdInfo]:
+        avd_home = AvdHelper.get_avd_home()
+        if not os.path.isfile(os.path.join(avd_home, avd_name + _AVD_INI_EXTENSION)):
+            return None
+        return AvdHelper._read_avd(avd_home, avd_name, False)
+
+    @staticmethod
+    def read_ini_file(path) -> dict:
+        """
+        :return: key-value pairs of the ini file, empty dict if the file can't be read
+        """
+        values = {}
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as fh:
+                for line in fh:
+                    line = line.strip()
+                    if not line or line.startswith('#') or line.find('=') == -1:
+                        continue
+                    key, value = line.split('=', 1)
+                    values[key.strip()] = value.strip()
+        except OSError as e:
+            print_verbose('Failed to read \"%s\": %s' % (path, e))
+        return values
+
+    @staticmethod
+    def get_directory_size(directory) -> int:
+        size = 0
+        directories = [directory]
+        while directories:
+            try:
+                with os.scandir(directories.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+                        else:
+                            size += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+        return size
+
+    @staticmethod
+    def get_hardware_config(cores=None, ram_size=None, heap_size=None, gpu_mode=None, data_partition_size=None,
+                            quick_boot=True) -> {str: str}:
+        """
+        :param ram_size: RAM in MB, the defaults of cores, RAM, heap and GPU mode are sized from the host
+        :param data_partition_size: e.g. "6G", the size chosen by avdmanager if None
+        :param quick_boot: save a snapshot on exit and boot from it, instead of cold booting every time
+        :return: config.ini values of the AVD hardware
+        """
+        config = {}
+        if cores is None:
+            cores = min(_MAX_DEFAULT_CORES, max(1, (os.cpu_count() or 1) // 2))
+        config['hw.cpu.ncore'] = str(_get_positive_number('cores', cores))
+        if ram_size is None:
+            ram_size = _get_default_ram_size()
+        if ram_size is not None:
+            ram_size = _get_positive_number('ram_size', ram_size)
+            config['hw.ramSize'] = str(ram_size)
+            if heap_size is None:
+                heap_size = 512 if ram_size >= 3072 else 256
+        if heap_size is not None:
+            config['vm.heapSize'] = str(_get_positive_number('heap_size', heap_size))
+        if gpu_mode is None:
+            # The host GPU is not usable without a display.
+            gpu_mode = 'swiftshader_indirect' if _is_headless_host() else 'auto'
+        if gpu_mode not in _GPU_MODES:
+            print_error_and_exit('Unknown GPU mode "%s", it must be one of %s' % (gpu_mode, ', '.join(_GPU_MODES)))
+        config['hw.gpu.enabled'] = 'no' if gpu_mode == 'off' else 'yes'
+        config['hw.gpu.mode'] = gpu_mode
+        if data_partition_size is not None:
+            data_partition_size = str(data_partition_size).upper()
+            if not re.match(_DATA_PARTITION_SIZE_PATTERN, data_partition_size):
+                print_error_and_exit('Invalid data partition size "%s", e.g. "6G" or "800M"' %
+                                     data_partition_size)
+            config['disk.dataPartition.size'] = data_partition_size
+        config['fastboot.forceColdBoot'] = 'no' if quick_boot else 'yes'
+        config['fastboot.forceFastBoot'] = 'yes' if quick_boot else 'no'
+        return config
+
+    @staticmethod
+    def update_config(avd, values) -> None:
+        """
+        Sets the values in the config.ini of the AVD, the other lines are kept as they are.
+        """
+        config_path = os.path.join(avd.path, _CONFIG_INI)
+        lines = []
+        try:
+            with open(config_path, 'r', encoding='utf-8', errors='replace') as fh:
+                lines = fh.read().splitlines()
+        except OSError as e:
+            print_verbose('Failed to read "%s": %s' % (config_path, e))
+        remaining_values = dict(values)
+        for (i, line) in enumerate(lines):
+            key = line.split('=', 1)[0].strip()
+            if line.find('=') != -1 and key in remaining_values:
+                lines[i] = '%s=%s' % (key, remaining_values.pop(key))
+        lines.extend('%s=%s' % (key, value) for (key, value) in remaining_values.items())
+        try:
+            with open(config_path, 'w', encoding='utf-8') as fh:
+                fh.write('\n'.join(lines) + '\n')
+        except OSError as e:
+            print_error_and_exit('Failed to write "%s": %s' % (config_path, e))
+        avd.config.update(values)
+
+    @staticmethod
+    def _read_avd(avd_home, avd_name, with_disk_size) -> AvdInfo:
+        avd = AvdInfo(avd_name)
+        avd_ini = AvdHelper.read_ini_file(os.path.join(avd_home, avd_name + _AVD_INI_EXTENSION))
+        avd.target = avd_ini.get('target', None)
+        avd.path = avd_ini.get('path', None)
+        if not avd.path or not os.path.isdir(avd.path):
+            # The AVD directory was moved along with the AVD home.
+            avd.path = os.path.join(avd_home, avd_name + _AVD_DIR_EXTENSION)
+        avd.config = AvdHelper.read_ini_file(os.path.join(avd.path, _CONFIG_INI))
+        avd.abi = avd.config.get('abi.type', None)
+        avd.tag = avd.config.get('tag.id', None)
+        if with_disk_size:
+            avd.disk_size = AvdHelper.get_directory_size(avd.path)
+        return avd
+
+
+def _get_positive_number(name, value) -> int:
+    if not str(value).isdigit() or int(value) < 1:
+        print_error_and_exit('%s must be a number greater than 0, not \"%s\"' % (name, value))
+    return int(value)
+
+
+def _get_default_ram_size() -> Optional[int]:
+    """
+    :return: a quarter of the host memory in MB, rounded down to 256 MB, None if it is not known
+    """
+    try:
+        host_memory_size = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        # os.sysconf() does not exist on Windows, the emulator default is used there.
+        print_verbose('Failed to read the size of the host memory')
+        return None
+    ram_size = host_memory_size // 4 // 256 * 256
+    return min(_MAX_DEFAULT_RAM_SIZE_IN_MB, max(_MIN_DEFAULT_RAM_SIZE_IN_MB, ram_size))
+
+
+def _is_headless_host() -> bool:
+    if not sys.platform.startswith('linux'):
+        # Windows and macOS always have a display.
+        return False
+    return not os.environ.get('DISPLAY', None) and not os.environ.get('WAYLAND_DISPLAY', None)
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+try:
+    # This works when the code is executed directly.
+    from platform_helper import PlatformHelper
+    from output_helper import print_verbose
+    from profile_helper import profile_span
+except ImportError:
+    # This fails when the code is executed directly and not as a part of python package installation,
+    # I definitely need a better way to handle this.
+    from androide.platform_helper import PlatformHelper
+    from androide.output_helper import print_verbose
+    from androide.profile_helper import profile_span
+
+_CACHE_DIR_NAME = 'androidtool'
+# The remote repositories do not change very often, a day old listing is good enough.
+_DEFAULT_TTL_IN_SECONDS = 24 * 60 * 60
+# system-images/android-28/google_apis/x86 is the deepest package directory in the SDK.
+_FINGERPRINT_MAX_DEPTH = 3
+
+
+class CacheHelper:
+
+    @staticmethod
+    def get_cache_dir() -> str:
+        """
+        :return: directory for androidtool's cached data, respects XDG_CACHE_HOME on GNU/Linux.
+        """
+        if PlatformHelper.on_mac():
+            base_dir = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+        else:
+            base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(base_dir, _CACHE_DIR_NAME)
+
+    @staticmethod
+    def get_key(*parts) -> str:
+        return hashlib.sha1('\0'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def get_sdk_fingerprint(sdk_root) -> Optional[str]:
+        """
+        :return: a digest of the directory mtimes in the top levels of the SDK tree, this changes whenever a
+        package is installed, updated or removed.
+        """
+        if not sdk_root or not os.path.isdir(sdk_root):
+            return None
+        with profile_span('sdk fingerprint', 'cache'):
+            return CacheHelper._get_directory_mtimes_digest(sdk_root)
+
+    @staticmethod
+    def _get_directory_mtimes_digest(sdk_root) -> str:
+        digest = hashlib.sha1()
+        directories = [(sdk_root, 0)]
+        while directories:
+            directory, depth = directories.pop()
+            try:
+                digest.update(('%s:%d\n' % (directory, os.stat(directory).st_mtime_ns)).encode('utf-8'))
+                if depth >= _FINGERPRINT_MAX_DEPTH:
+                    continue
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append((entry.path, depth + 1))
+            except OSError:
+                continue
+        return digest.hexdigest()
+
+    @staticmethod
+    def read(namespace, key, fingerprint=None, ttl=_DEFAULT_TTL_IN_SECONDS):
+        """
+        :param namespace: name of the cache, e.g. 'sdkmanager-list'
+        :param key: key returned by get_key
+        :param fingerprint: if not None, the cached entry is only valid if it was stored with the same fingerprint
+        :param ttl: maximum age of the entry in seconds, None to ignore the age
+        :return: the cached value or None
+        """
+        cache_file = CacheHelper._get_cache_file(namespace, key)
+        try:
+            with profile_span('read %s' % namespace, 'cache'):
+                with open(cache_file, 'r', encoding='utf-8') as fh:
+                    entry = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if fingerprint is not None and entry.get('fingerprint') != fingerprint:
+            print_verbose('Cache entry \"%s\" is stale' % cache_file)
+            return None
+        if ttl is not None and time.time() - entry.get('timestamp', 0) > ttl:
+            print_verbose('Cache entry \"%s\" has expired' % cache_file)
+            return None
+        print_verbose('Using cache entry \"%s\"' % cache_file)
+        return entry.get('value')
+
+    @staticmethod
+    def write(namespace, key, value, fingerprint=None) -> None:
+        cache_file = CacheHelper._get_cache_file(namespace, key)
+        entry = {
+            'timestamp': time.time(),
+            'fingerprint': fingerprint,
+            'value': value,
+        }
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            # Write and rename so that concurrent readers never see a partially written file.
+            tmp_file = '%s.%d.%d.tmp' % (cache_file, os.getpid(), threading.get_ident())
+            with profile_span('write %s' % namespace, 'cache'):
+                with open(tmp_file, 'w', encoding='utf-8') as fh:
+                    json.dump(entry, fh)
+                os.replace(tmp_file, cache_file)
+        except OSError as e:
+            print_verbose('Failed to write cache entry \"%s\": %s' % (cache_file, e))
+
+    @staticmethod
+    def delete(namespace, key) -> None:
+        try:
+            os.remove(CacheHelper._get_cache_file(namespace, key))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _get_cache_file(namespace, key) -> str:
+        return os.path.join(CacheHelper.get_cache_dir(), namespace, '%s.json' % key)
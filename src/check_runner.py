@@ -0,0 +1,117 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+try:
+    # This works when the code is executed directly.
+    from output_helper import print_verbose
+    from profile_helper import profile_span
+except ImportError:
+    # This fails when the code is executed directly and not as a part of python package installation,
+    # I definitely need a better way to handle this.
+    from androide.output_helper import print_verbose
+    from androide.profile_helper import profile_span
+
+
+class CheckResult:
+    __slots__ = ('name', 'title', 'success', 'skipped', 'value', 'messages', 'errors', 'duration')
+
+    def __init__(self, name, title) -> None:
+        self.name = name
+        self.title = title
+        self.success = False
+        self.skipped = False
+        # Value passed to the checks which depend on this one.
+        self.value = None
+        self.messages = []
+        self.errors = []
+        self.duration = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'success': self.success,
+            'skipped': self.skipped,
+            'duration': round(self.duration, 3),
+            'messages': self.messages,
+            'errors': self.errors,
+        }
+
+
+class CheckRunner:
+    """
+    Runs a graph of checks on a thread pool, a check starts as soon as all the checks it depends on have succeeded.
+    """
+
+    def __init__(self) -> None:
+        # Check name -> (title, function, dependencies), in the order in which they were added.
+        self._checks = {}
+
+    def add_check(self, name, function, dependencies=(), title=None) -> None:
+        """
+        :param name: unique name of the check
+        :param function: called with the values of the dependencies, returns (success, value, messages, errors)
+        :param dependencies: names of the checks which must succeed before this check runs
+        :param title: printed before the result of the check, None for the checks which only compute a value for
+        the other checks
+        """
+        for dependency in dependencies:
+            assert dependency in self._checks, 'Unknown dependency \"%s\" of \"%s\"' % (dependency, name)
+        self._checks[name] = (title, function, tuple(dependencies))
+
+    def run(self, on_result=None) -> [CheckResult]:
+        """
+        :param on_result: called with every result in the order in which the checks were added, as soon as the
+        result and all the results before it are available
+        :return: results in the order in which the checks were added
+        """
+        names = list(self._checks)
+        results = {}
+        num_reported = 0
+        pending = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(names))) as executor:
+            while len(results) < len(names):
+                for name in names:
+                    if name in results or name in pending.values():
+                        continue
+                    title, function, dependencies = self._checks[name]
+                    if any(dependency not in results for dependency in dependencies):
+                        continue
+                    failed_dependencies = [dependency for dependency in dependencies
+                                           if not results[dependency].success]
+                    if failed_dependencies:
+                        result = CheckResult(name, title)
+                        result.skipped = True
+                        result.errors.append('Skipped since \"%s\" failed' % ', '.join(failed_dependencies))
+                        results[name] = result
+                        continue
+                    values = [results[dependency].value for dependency in dependencies]
+                    pending[executor.submit(CheckRunner._run_check, name, title, function, values)] = name
+
+                if pending:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        results[result.name] = result
+                        del pending[future]
+                        print_verbose('Check \"%s\" finished in %.3f seconds' % (result.name, result.duration))
+
+                while num_reported < len(names) and names[num_reported] in results:
+                    if on_result is not None:
+                        on_result(results[names[num_reported]])
+                    num_reported += 1
+        return [results[name] for name in names]
+
+    @staticmethod
+    def _run_check(name, title, function, values) -> CheckResult:
+        result = CheckResult(name, title)
+        start_time = time.monotonic()
+        with profile_span(name, 'check') as span:
+            try:
+                result.success, result.value, result.messages, result.errors = function(*values)
+            except SystemExit:
+                # The helpers exit on fatal errors, which is a failure of this check only.
+                result.success = False
+                result.errors.append('Check \"%s\" failed' % name)
+            span.args['success'] = result.success
+        result.duration = time.monotonic() - start_time
+        return result
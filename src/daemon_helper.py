@@ -0,0 +1,372 @@
+import os
+import sys
+import time
+
+try:
+    # This works when the code is executed directly.
+    from output_helper import print_error, print_error_and_exit, print_message, print_verbose
+except ImportError:
+    # This fails when the code is executed directly and not as a part of python package installation,
+    # I definitely need a better way to handle this.
+    from androide.output_helper import print_error, print_error_and_exit, print_message, print_verbose
+
+# A client only uses a daemon which sees the same SDK, AVDs and Java as the client would, java and the SDK tools are
+# also looked up on the PATH.
+_SDK_ENVIRONMENT_VARIABLES = ('ANDROID_SDK_ROOT', 'ANDROID_HOME', 'ANDROID_AVD_HOME', 'ANDROID_EMULATOR_HOME',
+                              'ANDROID_SDK_HOME', 'JAVA_HOME', 'PATH', 'SDK_TEST_BASE_URL')
+# Sub-commands which change the SDK, the AVDs or the mirror, these run one at a time.
+_SDK_COMMANDS = ('install', 'update', 'create', 'mirror', 'accept', 'gc', 'roots')
+_MAX_PENDING_CONNECTIONS = 64
+# The output of a command is sent in batches, a message per printed line makes the short commands several times slower.
+_OUTPUT_FLUSH_INTERVAL_IN_SECONDS = 0.05
+_RECEIVE_SIZE = 64 * 1024
+
+# A message is a kind byte and the size of the payload, followed by the UTF-8 payload. JSON would be simpler but the
+# client takes longer to import json than the daemon takes to run most of the commands.
+_MESSAGE_HEADER_SIZE = 5
+# Client -> daemon, the message kinds of a request in order
+_ARGUMENT = b'a'
+_WORKING_DIRECTORY = b'c'
+# "NAME=value", only for the variables which are set
+_ENVIRONMENT_VARIABLE = b'v'
+# Only sent if the stdout of the client is a terminal
+_TERMINAL = b't'
+_RUN = b'r'
+# Daemon -> client
+_STDOUT = b'o'
+_STDERR = b'e'
+_EXIT_CODE = b'x'
+_REJECTED = b'n'
+
+
+class DaemonServer:
+    """
+    Serves the commands of thin clients over a Unix domain socket, so that a command runs against the warm state of
+    a long-lived process instead of rebuilding it from nothing. Every connection carries a single command, it is run
+    in its own thread and its output is streamed back to the client.
+    """
+
+    def __init__(self, socket_path, run_command) -> None:
+        """
+        :param run_command: called with (argv, cwd) to run a command, the command reports a failure by exiting
+        """
+        # The client does not need threading, it is only imported by the daemon.
+        import threading
+        self._socket_path = socket_path
+        self._run_command = run_command
+        self._sdk_lock = threading.Lock()
+        self._clients = set()
+        self._clients_lock = threading.Lock()
+        # The client of the request which the current thread is running, if any.
+        self._request = threading.local()
+
+    def serve_forever(self) -> None:
+        import signal
+        import socket
+        import threading
+        if not hasattr(socket, 'AF_UNIX'):
+            print_error_and_exit('The daemon needs Unix domain sockets, these are not available on this platform')
+        if os.path.exists(self._socket_path):
+            if _is_daemon_listening(self._socket_path):
+                print_error_and_exit('A daemon is already listening on \"%s\"' % self._socket_path)
+            # Left behind by a daemon which was killed.
+            os.remove(self._socket_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self._socket_path)), exist_ok=True)
+
+        # Stop on SIGTERM like on Ctrl-C, so that the socket is removed.
+        signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+        sys.stdout = _RequestStream(sys.stdout, _STDOUT, self._request)
+        sys.stderr = _RequestStream(sys.stderr, _STDERR, self._request)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            try:
+                server.bind(self._socket_path)
+            except OSError as e:
+                print_error_and_exit('Failed to listen on \"%s\": %s' % (self._socket_path, e))
+            try:
+                # Only this user may run commands in the daemon.
+                os.chmod(self._socket_path, 0o600)
+                server.listen(_MAX_PENDING_CONNECTIONS)
+                print_message('Serving androidtool commands on \"%s\", '
+                              'set ANDROIDTOOL_SOCKET to this path to use the daemon' % self._socket_path)
+                threading.Thread(target=self._flush_output_forever, daemon=True).start()
+                while True:
+                    connection, _ = server.accept()
+                    threading.Thread(target=self._handle_connection, args=(connection,), daemon=True).start()
+            except KeyboardInterrupt:
+                print_message('Daemon stopped')
+            finally:
+                os.remove(self._socket_path)
+
+    def _handle_connection(self, connection) -> None:
+        with connection:
+            argv = []
+            cwd = None
+            environment = {}
+            isatty = False
+            reader = _SocketReader(connection)
+            while True:
+                try:
+                    message = _read_message(reader)
+                except OSError as e:
+                    print_verbose('Failed to read the request: %s' % e)
+                    return
+                if message is None:
+                    print_verbose('Incomplete request')
+                    return
+                kind, payload = message
+                if kind == _RUN:
+                    break
+                if kind == _ARGUMENT:
+                    argv.append(payload)
+                elif kind == _WORKING_DIRECTORY:
+                    cwd = payload
+                elif kind == _ENVIRONMENT_VARIABLE:
+                    name, value = payload.split('=', 1)
+                    environment[name] = value
+                elif kind == _TERMINAL:
+                    isatty = True
+
+            client = _Client(connection, isatty)
+            mismatches = ['%s is \"%s\"' % (name, os.environ.get(name, '')) for name in _SDK_ENVIRONMENT_VARIABLES
+                          if environment.get(name) != os.environ.get(name)]
+            if mismatches:
+                client.send(_REJECTED, 'The daemon serves a different SDK, %s' % ', '.join(mismatches))
+                return
+            print_verbose('Running \"%s\"' % ' '.join(argv))
+            with self._clients_lock:
+                self._clients.add(client)
+            self._request.client = client
+            try:
+                exit_code = self._run(argv, cwd or os.getcwd())
+            finally:
+                self._request.client = None
+                with self._clients_lock:
+                    self._clients.remove(client)
+            client.flush()
+            client.send(_EXIT_CODE, str(exit_code))
+
+    def _flush_output_forever(self) -> None:
+        """
+        Sends the output of the long-running commands, like installs, while they are still running.
+        """
+        while True:
+            time.sleep(_OUTPUT_FLUSH_INTERVAL_IN_SECONDS)
+            with self._clients_lock:
+                clients = list(self._clients)
+            for client in clients:
+                client.flush()
+
+    def _run(self, argv, cwd) -> int:
+        """
+        :return: exit code of the command
+        """
+        sub_command = next((arg for arg in argv if not arg.startswith('-')), None)
+        try:
+            if sub_command not in _SDK_COMMANDS:
+                self._run_command(argv, cwd)
+            else:
+                if not self._sdk_lock.acquire(blocking=False):
+                    print_message('Waiting for the other install in the daemon to finish...')
+                    self._sdk_lock.acquire()
+                try:
+                    self._run_command(argv, cwd)
+                finally:
+                    self._sdk_lock.release()
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            # docopt exits with the usage message
+            print(e.code, file=sys.stderr)
+            return 1
+        except Exception:  # pylint: disable=broad-except
+            # A failing command must not take the daemon down with it.
+            import traceback
+            traceback.print_exc()
+            return 1
+        return 0
+
+
+def run_client(socket_path, argv):
+    """
+    Runs the command in the daemon listening on socket_path and prints its output as it arrives.
+    :return: exit code of the command, None if no daemon is listening or the daemon serves a different SDK, the
+    command should then run in this process.
+    """
+    # socket imports selectors and enum, which takes as long as starting the interpreter, _socket has all that the
+    # client needs.
+    import _socket
+    if not hasattr(_socket, 'AF_UNIX'):
+        return None
+    request = [_encode_message(_ARGUMENT, arg) for arg in argv]
+    request.append(_encode_message(_WORKING_DIRECTORY, os.getcwd()))
+    for name in _SDK_ENVIRONMENT_VARIABLES:
+        if name in os.environ:
+            request.append(_encode_message(_ENVIRONMENT_VARIABLE, '%s=%s' % (name, os.environ[name])))
+    if sys.stdout.isatty():
+        request.append(_encode_message(_TERMINAL))
+    request.append(_encode_message(_RUN))
+    client = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        try:
+            client.connect(socket_path)
+            client.sendall(b''.join(request))
+        except OSError as e:
+            print_verbose('Daemon not reachable at \"%s\": %s' % (socket_path, e))
+            return None
+        reader = _SocketReader(client)
+        while True:
+            try:
+                message = _read_message(reader)
+            except OSError as e:
+                print_verbose('Failed to read from the daemon: %s' % e)
+                break
+            if message is None:
+                break
+            kind, payload = message
+            if kind == _EXIT_CODE:
+                return int(payload)
+            if kind == _REJECTED:
+                print_verbose(payload)
+                return None
+            stream = sys.stderr if kind == _STDERR else sys.stdout
+            stream.write(payload)
+            stream.flush()
+    finally:
+        client.close()
+    # The command may have been partially run, running it again could do more harm than good.
+    print_error('Lost the connection to the daemon at \"%s\"' % socket_path)
+    return 1
+
+
+def _encode_message(kind, payload='') -> bytes:
+    data = payload.encode('utf-8')
+    return kind + len(data).to_bytes(_MESSAGE_HEADER_SIZE - 1, 'big') + data
+
+
+def _read_message(reader):
+    """
+    :return: (kind, payload), None if the connection was closed
+    """
+    header = reader.read(_MESSAGE_HEADER_SIZE)
+    if len(header) < _MESSAGE_HEADER_SIZE:
+        return None
+    size = int.from_bytes(header[1:], 'big')
+    data = reader.read(size)
+    if len(data) < size:
+        return None
+    return header[:1], data.decode('utf-8', errors='replace')
+
+
+def _is_daemon_listening(socket_path) -> bool:
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+            return True
+        except OSError:
+            return False
+
+
+class _SocketReader:
+    """
+    Reads a given number of bytes from a socket, _socket sockets have no makefile().
+    """
+
+    def __init__(self, sock) -> None:
+        self._socket = sock
+        self._buffer = bytearray()
+
+    def read(self, size) -> bytes:
+        """
+        :return: size bytes, fewer if the connection was closed
+        """
+        while len(self._buffer) < size:
+            data = self._socket.recv(_RECEIVE_SIZE)
+            if not data:
+                break
+            self._buffer += data
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class _Client:
+    """
+    The connection of a client. The output of its command is batched, it is sent when the command flushes its
+    output, when the command ends or by the flusher thread of the daemon.
+    """
+
+    def __init__(self, connection, isatty) -> None:
+        import threading
+        self._connection = connection
+        self._closed = False
+        self._pending_output = []
+        # Keeps the output in order when the flusher thread and the thread of the request flush at the same time.
+        self._lock = threading.RLock()
+        self.isatty = isatty
+
+    def write(self, kind, data) -> None:
+        with self._lock:
+            self._pending_output.append((kind, data))
+
+    def flush(self) -> None:
+        with self._lock:
+            messages = []
+            for (kind, data) in self._pending_output:
+                if messages and messages[-1][0] == kind:
+                    messages[-1][1].append(data)
+                else:
+                    messages.append((kind, [data]))
+            self._pending_output = []
+            for (kind, data) in messages:
+                self.send(kind, ''.join(data))
+
+    def send(self, kind, payload) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                self._connection.sendall(_encode_message(kind, payload))
+            except OSError as e:
+                # The command still runs to the end, stopping an install halfway leaves the SDK broken.
+                self._closed = True
+                print_verbose('Client disconnected: %s' % e)
+
+
+class _RequestStream:
+    """
+    Stands in for sys.stdout or sys.stderr in the daemon. What the thread of a request prints is sent to its client,
+    everything else goes to the stream of the daemon.
+    """
+
+    def __init__(self, stream, kind, request) -> None:
+        """
+        :param request: thread-local whose client attribute is the client of the request run by the current thread
+        """
+        self._stream = stream
+        self._kind = kind
+        self._request = request
+
+    def write(self, data) -> int:
+        client = getattr(self._request, 'client', None)
+        if client is None:
+            return self._stream.write(data)
+        if data:
+            client.write(self._kind, data)
+        return len(data)
+
+    def flush(self) -> None:
+        client = getattr(self._request, 'client', None)
+        if client is None:
+            self._stream.flush()
+        else:
+            client.flush()
+
+    def isatty(self) -> bool:
+        client = getattr(self._request, 'client', None)
+        if client is None:
+            return self._stream.isatty()
+        return client.isatty
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
@@ -0,0 +1,116 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    # This works when the code is executed directly.
+    from cache_helper import CacheHelper
+    from output_helper import print_verbose
+    from profile_helper import profile_span
+except ImportError:
+    # This fails when the code is executed directly and not as a part of python package installation,
+    # I definitely need a better way to handle this.
+    from androide.cache_helper import CacheHelper
+    from androide.output_helper import print_verbose
+    from androide.profile_helper import profile_span
+
+_DISK_USAGE_CACHE = 'disk-usage'
+_MAX_WORKERS = 8
+
+
+class DiskUsageHelper:
+    """
+    Measures the size of the package directories. The walk is incremental, the size of the files directly in every
+    directory is cached along with the mtime of the directory, which changes whenever an entry is added, removed or
+    renamed. A directory whose mtime did not change is not listed again, only its mtime is read. The packages are
+    never modified in place, so this misses nothing in practice.
+
+    The files with several hard links, e.g. the packages linked to the shared store, are counted once.
+    """
+
+    @staticmethod
+    def get_sizes(sdk_root, directories) -> {str: int}:
+        """
+        :return: directory -> size in bytes of all the files under it, a file which is linked into several of the
+        directories is only counted in the first of them, so that the sizes add up to the disk usage
+        """
+        cache_key = CacheHelper.get_key(sdk_root)
+        cached_entries = CacheHelper.read(_DISK_USAGE_CACHE, cache_key, ttl=None) or {}
+        entries = {}
+        sizes = {}
+        # (st_dev, st_ino) of the files with several links which are already counted
+        counted_files = set()
+        with profile_span('measure disk usage', 'parse', directories=len(directories)) as span:
+            with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
+                results = executor.map(lambda directory: _walk(directory, cached_entries), directories)
+                for (directory, (size, linked_files, directory_entries)) in zip(directories, results):
+                    for (file_id, file_size) in linked_files:
+                        if file_id not in counted_files:
+                            counted_files.add(file_id)
+                            size += file_size
+                    sizes[directory] = size
+                    entries.update(directory_entries)
+            span.args['listed_directories'] = sum(1 for (path, entry) in entries.items()
+                                                  if cached_entries.get(path, None) != entry)
+        print_verbose('Listed %d of %d directories, the rest were unchanged' % (
+            span.args.get('listed_directories', 0), len(entries)))
+        CacheHelper.write(_DISK_USAGE_CACHE, cache_key, entries)
+        return sizes
+
+    @staticmethod
+    def get_unshared_size(directory) -> int:
+        """
+        :return: size in bytes of the files under the directory which have no other links, this is the space which
+        removing the directory frees. The number of links is not cached, it changes without the directory changing.
+        """
+        size = 0
+        for (path, _, file_names) in os.walk(directory):
+            for file_name in file_names:
+                try:
+                    stat = os.lstat(os.path.join(path, file_name))
+                except OSError:
+                    continue
+                if stat.st_nlink <= 1:
+                    size += stat.st_size
+        return size
+
+
+def _walk(directory, cached_entries) -> (int, [((int, int), int)], {str: list}):
+    """
+    :param cached_entries: directory -> [mtime in ns, size of the files in the directory which have a single link,
+    names of the sub-directories, [inode, size] of the files in the directory which have several links]
+    :return: (size of the files with a single link in the directory tree, ((st_dev, st_ino), size) of the files with
+    several links, entries of the directories in the tree)
+    """
+    size = 0
+    linked_files = []
+    entries = {}
+    directories = [directory]
+    while directories:
+        path = directories.pop()
+        try:
+            stat = os.stat(path)
+            entry = cached_entries.get(path, None)
+            if entry is None or entry[0] != stat.st_mtime_ns:
+                files_size = 0
+                sub_directories = []
+                directory_linked_files = []
+                with os.scandir(path) as dir_entries:
+                    for dir_entry in dir_entries:
+                        if dir_entry.is_dir(follow_symlinks=False):
+                            sub_directories.append(dir_entry.name)
+                            continue
+                        file_stat = dir_entry.stat(follow_symlinks=False)
+                        if file_stat.st_nlink > 1:
+                            directory_linked_files.append([dir_entry.inode(), file_stat.st_size])
+                        else:
+                            files_size += file_stat.st_size
+                entry = [stat.st_mtime_ns, files_size, sub_directories, directory_linked_files]
+        except OSError as e:
+            print_verbose('Failed to measure \"%s\": %s' % (path, e))
+            continue
+        entries[path] = entry
+        size += entry[1]
+        # The files of a directory are on its device.
+        linked_files.extend(((stat.st_dev, inode), file_size) for (inode, file_size) in entry[3])
+        directories.extend(os.path.join(path, name) for name in entry[2])
+    return size, linked_files, entries
@@ -0,0 +1,144 @@
+import os
+import socket
+import subprocess
+import time
+from typing import Optional
+
+try:
+    # This works when the code is executed directly.
+    from platform_helper import PlatformHelper
+    from output_helper import print_verbose
+except ImportError:
+    # This fails when the code is executed directly and not as a part of python package installation,
+    # I definitely need a better way to handle this.
+    from androide.platform_helper import PlatformHelper
+    from androide.output_helper import print_verbose
+
+# The emulator accepts even console ports in this range, the adb port is always the console port + 1.
+_FIRST_CONSOLE_PORT = 5554
+_LAST_CONSOLE_PORT = 5682
+_BOOT_POLL_INTERVAL_IN_SECONDS = 2
+_ADB_TIMEOUT_IN_SECONDS = 30
+# Saving a snapshot writes all the RAM of the AVD to disk.
+_SNAPSHOT_TIMEOUT_IN_SECONDS = 300
+_SHUTDOWN_TIMEOUT_IN_SECONDS = 60
+
+
+class EmulatorHelper:
+
+    @staticmethod
+    def find_free_console_ports(count) -> [int]:
+        """
+        :return: count console ports such that both the console port and the adb port (console port + 1) are free
+        """
+        ports = []
+        for port in range(_FIRST_CONSOLE_PORT, _LAST_CONSOLE_PORT + 1, 2):
+            if len(ports) == count:
+                break
+            if EmulatorHelper._is_port_free(port) and EmulatorHelper._is_port_free(port + 1):
+                ports.append(port)
+        return ports
+
+    @staticmethod
+    def get_serial(console_port) -> str:
+        return 'emulator-%d' % console_port
+
+    @staticmethod
+    def launch(emulator_path, args, log_path) -> subprocess.Popen:
+        """
+        Starts the emulator in the background, it keeps running after androidtool exits.
+        :param args: arguments for the emulator binary
+        :param log_path: file to which the stdout and the stderr of the emulator are written
+        """
+        cmd = [emulator_path] + args
+        print_verbose('Starting emulator: \"%s\", log file: \"%s\"' % (' '.join(cmd), log_path))
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        with open(log_path, 'wb') as log_file:
+            # Older emulators look for their libraries relative to the working directory.
+            return subprocess.Popen(cmd, cwd=os.path.dirname(emulator_path), stdin=subprocess.DEVNULL,
+                                    stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
+
+    @staticmethod
+    def wait_for_boot(adb_path, console_port, process, timeout) -> Optional[float]:
+        """
+        Waits till the emulator reports sys.boot_completed.
+        :param process: emulator process, the wait stops early if it exits
+        :return: boot time in seconds, None if the emulator did not boot within the timeout
+        """
+        start_time = time.monotonic()
+        serial = EmulatorHelper.get_serial(console_port)
+        cmd = [adb_path, '-s', serial, 'shell', 'getprop', 'sys.boot_completed']
+        while time.monotonic() - start_time < timeout:
+            if process is not None and process.poll() is not None:
+                print_verbose('Emulator \"%s\" exited with return code %d' % (serial, process.returncode))
+                return None
+            return_code, stdout, _ = PlatformHelper.execute_cmd(cmd, timeout=_ADB_TIMEOUT_IN_SECONDS)
+            if return_code == 0 and stdout.strip() == '1':
+                return time.monotonic() - start_time
+            time.sleep(_BOOT_POLL_INTERVAL_IN_SECONDS)
+        return None
+
+    @staticmethod
+    def save_snapshot(adb_path, console_port, snapshot_name) -> bool:
+        return EmulatorHelper._run_console_command(adb_path, console_port, ['avd', 'snapshot', 'save', snapshot_name])
+
+    @staticmethod
+    def load_snapshot(adb_path, console_port, snapshot_name) -> bool:
+        return EmulatorHelper._run_console_command(adb_path, console_port, ['avd', 'snapshot', 'load', snapshot_name])
+
+    @staticmethod
+    def stop(adb_path, console_port, process) -> bool:
+        """
+        Shuts the emulator down cleanly, it is killed if it does not exit in time.
+        :return: True if the emulator exited by itself
+        """
+        EmulatorHelper._run_console_command(adb_path, console_port, ['kill'])
+        try:
+            process.wait(timeout=_SHUTDOWN_TIMEOUT_IN_SECONDS)
+            return True
+        except subprocess.TimeoutExpired:
+            print_verbose('Emulator \"%s\" did not exit, killing it' % EmulatorHelper.get_serial(console_port))
+            process.kill()
+            process.wait()
+            return False
+
+    @staticmethod
+    def get_running_avds(adb_path) -> {int: str}:
+        """
+        :return: console port -> AVD name of the emulators which adb sees
+        """
+        return_code, stdout, _ = PlatformHelper.execute_cmd([adb_path, 'devices'], timeout=_ADB_TIMEOUT_IN_SECONDS)
+        if return_code != 0:
+            return {}
+        running_avds = {}
+        for line in stdout.splitlines():
+            # e.g. "emulator-5554	device"
+            serial = line.split('\t', 1)[0].strip()
+            if not serial.startswith('emulator-') or not serial[len('emulator-'):].isdigit():
+                continue
+            return_code, stdout, _ = PlatformHelper.execute_cmd([adb_path, '-s', serial, 'emu', 'avd', 'name'],
+                                                                timeout=_ADB_TIMEOUT_IN_SECONDS)
+            # The console answers with the name followed by "OK".
+            if return_code == 0 and stdout.strip():
+                running_avds[int(serial[len('emulator-'):])] = stdout.strip().splitlines()[0].strip()
+        return running_avds
+
+    @staticmethod
+    def _run_console_command(adb_path, console_port, command) -> bool:
+        serial = EmulatorHelper.get_serial(console_port)
+        return_code, stdout, stderr = PlatformHelper.execute_cmd([adb_path, '-s', serial, 'emu'] + command,
+                                                                 timeout=_SNAPSHOT_TIMEOUT_IN_SECONDS)
+        # adb exits with 0 even if the console command fails, the console answers "KO: <reason>" then.
+        if return_code != 0 or stdout.lstrip().startswith('KO'):
+            print_verbose('\"%s\" failed on \"%s\": %s' % (' '.join(command), serial, (stdout + stderr).strip()))
+            return False
+        return True
+
+    @staticmethod
+    def _is_port_free(port) -> bool:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            try:
+                sock.bind(('127.0.0.1', port))
+                return True
+            except OSError:
+                return False
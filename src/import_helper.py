@@ -0,0 +1,36 @@
+import importlib
+
+
+def import_module(name):
+    """
+    Imports the module of androidtool by its name, e.g. "avd_helper", both when the code is executed directly and
+    when it is installed as the androide package.
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return importlib.import_module('androide.%s' % name)
+
+
+class LazyImport:
+    """
+    Stands in for a class of a module which is only imported when the class is first used, so that a command does
+    not pay for importing the modules that only the other commands need, e.g.
+    AvdHelper = LazyImport('avd_helper', 'AvdHelper')
+    """
+
+    def __init__(self, module_name, class_name) -> None:
+        self._module_name = module_name
+        self._class_name = class_name
+        self._class = None
+
+    def __getattr__(self, name):
+        return getattr(self._get_class(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._get_class()(*args, **kwargs)
+
+    def _get_class(self):
+        if self._class is None:
+            self._class = getattr(import_module(self._module_name), self._class_name)
+        return self._class
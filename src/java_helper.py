@@ -0,0 +1,163 @@
+import os
+import re
+import shutil
+from typing import Optional
+
+try:
+    # This works when the code is executed directly.
+    from cache_helper import CacheHelper
+    from platform_helper import PlatformHelper
+    from output_helper import print_error, print_verbose
+except ImportError:
+    # This fails when the code is executed directly and not as a part of python package installation,
+    # I definitely need a better way to handle this.
+    from androide.cache_helper import CacheHelper
+    from androide.platform_helper import PlatformHelper
+    from androide.output_helper import print_error, print_verbose
+
+_GET_ALL_JAVA_VERSIONS_ON_MAC = ['/usr/libexec/java_home', '-V']
+_GET_ALL_JAVA_VERSIONS_ON_LINUX = ['update-alternatives', '--display', 'java']
+_JVM_DIRS_ON_LINUX = ['/usr/lib/jvm', '/usr/java']
+_JVM_DIRS_ON_MAC = ['/Library/Java/JavaVirtualMachines',
+                    os.path.join(os.path.expanduser('~'), 'Library', 'Java', 'JavaVirtualMachines')]
+_JAVA_VERSION_CACHE = 'java-version'
+# JAVA_VERSION="1.8.0_292" in the "release" file of the JDK
+_RELEASE_FILE_VERSION_REGEX = re.compile(r'^JAVA_VERSION="?([^"\s]+)"?', re.MULTILINE)
+# openjdk version "1.8.0_292" in the output of "java -version"
+_JAVA_VERSION_OUTPUT_REGEX = re.compile(r'version "([^"]+)"')
+
+
+class JavaHelper:
+    """
+    Finds the Java versions by reading the "release" file of the JDKs, without starting a JVM.
+    """
+
+    @staticmethod
+    def get_default_java_version() -> Optional[str]:
+        """
+        :return: version of the default Java as "major.minor", e.g. "1.8" or "11.0", None if Java is not installed
+        """
+        java_home = os.environ.get('JAVA_HOME', None)
+        java_binary = shutil.which('java')
+        if java_binary is not None:
+            java_binary = os.path.realpath(java_binary)
+        cache_key = CacheHelper.get_key(java_home, java_binary)
+        stat_key = JavaHelper._get_stat_key(java_home, java_binary)
+        cached_version = CacheHelper.read(_JAVA_VERSION_CACHE, cache_key, fingerprint=stat_key, ttl=None)
+        if cached_version is not None:
+            return cached_version
+
+        version = None
+        if java_home:
+            version = JavaHelper._read_release_file(java_home)
+        if version is None and java_binary is not None:
+            # <java home>/bin/java or <java home>/jre/bin/java
+            bin_dir = os.path.dirname(java_binary)
+            for java_home_candidate in [os.path.dirname(bin_dir), os.path.dirname(os.path.dirname(bin_dir))]:
+                version = JavaHelper._read_release_file(java_home_candidate)
+                if version is not None:
+                    break
+        if version is None:
+            print_verbose('Java release file not found, running java to get its version')
+            version = JavaHelper._get_default_java_version_from_jvm()
+        if version is not None:
+            CacheHelper.write(_JAVA_VERSION_CACHE, cache_key, version, fingerprint=stat_key)
+        return version
+
+    @staticmethod
+    def get_all_java_versions() -> {str}:
+        """
+        :return: versions of all the installed JDKs, as returned by get_default_java_version
+        """
+        if PlatformHelper.on_linux():
+            java_homes = JavaHelper._list_directories(_JVM_DIRS_ON_LINUX)
+        elif PlatformHelper.on_mac():
+            java_homes = [os.path.join(directory, 'Contents', 'Home')
+                          for directory in JavaHelper._list_directories(_JVM_DIRS_ON_MAC)]
+        else:
+            print_error('Unsupported operating system')
+            return set()
+
+        versions = set()
+        for java_home in java_homes:
+            version = JavaHelper._read_release_file(java_home)
+            if version is not None:
+                versions.add(version)
+        if not versions:
+            print_verbose('No Java release files found, listing java versions via the system tools')
+            versions = JavaHelper._get_all_java_versions_from_system_tools()
+        print_verbose('Versions are %s' % versions)
+        return versions
+
+    @staticmethod
+    def _read_release_file(java_home) -> Optional[str]:
+        try:
+            with open(os.path.join(java_home, 'release'), 'r', encoding='utf-8', errors='replace') as fh:
+                match = _RELEASE_FILE_VERSION_REGEX.search(fh.read())
+        except OSError:
+            return None
+        if match is None:
+            return None
+        print_verbose('Java at \"%s\" is version %s' % (java_home, match.group(1)))
+        return _get_major_minor_version(match.group(1))
+
+    @staticmethod
+    def _get_stat_key(*paths) -> str:
+        # Installing or switching the JDK changes the inode or the mtime of the java binary or the java home.
+        stat_key = []
+        for path in paths:
+            try:
+                stat = os.stat(path) if path else None
+            except OSError:
+                stat = None
+            stat_key.append('%s:%s' % (stat.st_ino, stat.st_mtime_ns) if stat else '-')
+        return ','.join(stat_key)
+
+    @staticmethod
+    def _list_directories(parent_directories) -> [str]:
+        directories = []
+        for parent_directory in parent_directories:
+            try:
+                with os.scandir(parent_directory) as entries:
+                    directories.extend(entry.path for entry in entries if entry.is_dir())
+            except OSError:
+                continue
+        return directories
+
+    @staticmethod
+    def _get_default_java_version_from_jvm() -> Optional[str]:
+        return_code, stdout, stderr = PlatformHelper.execute_cmd(['java', '-version'])
+        if return_code != 0:
+            print_error('Failed to get java version')
+            return None
+        version = _JAVA_VERSION_OUTPUT_REGEX.search(stderr)
+        if version is None:
+            return None
+        print_verbose('version object is %s' % version)
+        return _get_major_minor_version(version.group(1))
+
+    @staticmethod
+    def _get_all_java_versions_from_system_tools() -> {str}:
+        if PlatformHelper.on_linux():
+            return_code, stdout, stderr = PlatformHelper.execute_cmd(_GET_ALL_JAVA_VERSIONS_ON_LINUX)
+            # /usr/lib/jvm/java-8-openjdk-amd64/jre/bin/java
+            java_version_regex = r'java-([0-9]+)[^/]*/'
+        else:
+            return_code, stdout, stderr = PlatformHelper.execute_cmd(_GET_ALL_JAVA_VERSIONS_ON_MAC)
+            java_version_regex = r'"?([0-9]+\.[0-9]+)\.[0-9]'
+        if return_code != 0:
+            # Doctor lists the versions speculatively, this is only an error if the default version is wrong.
+            print_verbose('Failed to list java versions')
+            return set()
+        return {_get_major_minor_version(version) for version in re.findall(java_version_regex, stdout + stderr)}
+
+
+def _get_major_minor_version(version) -> str:
+    """
+    :return: "1.8" for "1.8.0_292", "11.0" for "11.0.2", "1.8" for "8" and "17" for "17"
+    """
+    components = re.split(r'[._+-]', version)
+    if len(components) == 1 and components[0] == '8':
+        # Directory names like java-8-openjdk-amd64 use the new version scheme for Java 8 as well.
+        return '1.8'
+    return '.'.join(components[:2])
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import xml.etree.ElementTree as ElementTree
+
+try:
+    # This works when the code is executed directly.
+    from output_helper import print_verbose
+    from sdk_scanner import get_local_name
+except ImportError:
+    # This fails when the code is executed directly and not as a part of python package installation,
+    # I definitely need a better way to handle this.
+    from androide.output_helper import print_verbose
+    from androide.sdk_scanner import get_local_name
+
+_LICENSES_DIR_NAME = 'licenses'
+# License id -> SHA-1 hashes of the texts of the standard licenses, these are what CI scripts usually write into the
+# licenses directory of an empty SDK.
+_KNOWN_LICENSE_HASHES = {
+    'android-sdk-license': ('8933bad161af4178b1185d1a37fbf41ea5269c55', 'd56f5187479451eabf01fb78af6dfcb131a6481e',
+                            '24333f8a63b6825ea9c5514f83c2829b004d1fee'),
+    'android-sdk-preview-license': ('84831b9409646a918e30573bab4c9c91346d8abd',),
+    'android-googletv-license': ('601085b94cd77f0b54ff86406957099ebe79c4d6',),
+    'android-sdk-arm-dbt-license': ('859f317696f67ef3d7f30a50a5560e7834b43903',),
+    'google-gdk-license': ('33b6a2b64607f11b759f320ef9dff4ae5c47d97a',),
+    'intel-android-extra-license': ('d975f751698a77b662f1254ddbeed3901e976f5a',),
+    'mips-android-sysimage-license': ('e9acab5b5fbb560a72cfaecce8946896ff6aab9d',),
+}
+
+
+class LicenseHelper:
+    """
+    Reads and writes the accepted licenses in the licenses directory of the SDK root, like sdkmanager does. There is
+    a file per license, named by the license id, with the SHA-1 of every accepted text of the license on a line of
+    its own. The texts come with the packages, in their package.xml and in the repository XMLs.
+    """
+
+    @staticmethod
+    def get_licenses(xml_paths) -> {str: {str}}:
+        """
+        :param xml_paths: package.xml files of the installed packages or repository XMLs
+        :return: license id -> hashes of the license texts in the XMLs
+        """
+        licenses = {}
+        for xml_path in xml_paths:
+            try:
+                root = ElementTree.parse(xml_path).getroot()
+            except (OSError, ElementTree.ParseError) as e:
+                print_verbose('Failed to read the licenses in \"%s\": %s' % (xml_path, e))
+                continue
+            # Licenses are always top-level elements.
+            for element in root:
+                if get_local_name(element.tag) == 'license' and element.get('id') and element.text:
+                    licenses.setdefault(element.get('id'), set()).add(_get_license_hash(element.text))
+        return licenses
+
+    @staticmethod
+    def get_known_licenses() -> {str: {str}}:
+        """
+        :return: license id -> hashes of the texts of the standard licenses
+        """
+        return {license_id: set(hashes) for (license_id, hashes) in _KNOWN_LICENSE_HASHES.items()}
+
+    @staticmethod
+    def get_unaccepted_licenses(sdk_root, licenses) -> {str: {str}}:
+        """
+        :param licenses: license id -> hashes
+        :return: license id -> hashes of the licenses which are not accepted yet
+        """
+        unaccepted_licenses = {}
+        for (license_id, hashes) in licenses.items():
+            unaccepted_hashes = hashes - LicenseHelper._read_accepted_hashes(sdk_root, license_id)
+            if unaccepted_hashes:
+                unaccepted_licenses[license_id] = unaccepted_hashes
+        return unaccepted_licenses
+
+    @staticmethod
+    def accept(sdk_root, licenses) -> None:
+        """
+        :param licenses: license id -> hashes, the hashes are added to the ones which are already accepted
+        """
+        licenses_dir = os.path.join(sdk_root, _LICENSES_DIR_NAME)
+        os.makedirs(licenses_dir, exist_ok=True)
+        for (license_id, hashes) in licenses.items():
+            new_hashes = sorted(hashes - LicenseHelper._read_accepted_hashes(sdk_root, license_id))
+            if not new_hashes:
+                continue
+            # Same format as sdkmanager, which starts every hash with a new line.
+            with open(os.path.join(licenses_dir, license_id), 'a', encoding='utf-8') as fh:
+                fh.write(''.join('\n%s' % license_hash for license_hash in new_hashes))
+            print_verbose('Accepted %s of license \"%s\"' % (', '.join(new_hashes), license_id))
+
+    @staticmethod
+    def _read_accepted_hashes(sdk_root, license_id) -> {str}:
+        try:
+            with open(os.path.join(sdk_root, _LICENSES_DIR_NAME, license_id), 'r', encoding='utf-8') as fh:
+                return set(line.strip() for line in fh if line.strip())
+        except OSError:
+            return set()
+
+
+def _get_license_hash(text) -> str:
+    # sdkmanager hashes the text without the surrounding whitespace.
+    return hashlib.sha1(text.strip().encode('utf-8')).hexdigest()
@@ -0,0 +1,142 @@
+import os
+import time
+
+try:
+    # This works when the code is executed directly.
+    from output_helper import print_message, print_error_and_exit, print_verbose
+    from profile_helper import profile_span
+except ImportError:
+    # This fails when the code is executed directly and not as a part of python package installation,
+    # I definitely need a better way to handle this.
+    from androide.output_helper import print_message, print_error_and_exit, print_verbose
+    from androide.profile_helper import profile_span
+
+# In the SDK root, so that every process installing into the SDK uses the same lock, whatever its cache directory.
+_LOCK_FILE_NAME = '.androidtool.lock'
+_POLL_INTERVAL_IN_SECONDS = 0.1
+
+
+class SdkLock:
+    """
+    Lock on an SDK root shared by all the processes on the host, held while packages are installed so that the
+    concurrent installs don't write into the SDK at the same time. The holder records its pid and the packages it is
+    installing in the lock file, so that the waiting processes can tell what they are waiting for. The lock is
+    released by the OS if the holder dies. Nothing is locked if the SDK root is not known or the lock file can't be
+    created in it.
+
+    with SdkLock(sdk_root, ['platforms;android-28'], timeout=600) as lock:
+        if lock.waited:
+            ...  # The other process may have installed some of the packages meanwhile.
+    """
+
+    def __init__(self, sdk_root, package_names, timeout=None, action='installing') -> None:
+        """
+        :param package_names: packages which are installed, or changed by the action, while holding the lock
+        :param action: what is done to the packages, shown to the waiting processes
+        :param timeout: seconds to wait for the lock before exiting with an error, None to wait forever
+        """
+        self._path = os.path.join(sdk_root, _LOCK_FILE_NAME) if sdk_root else None
+        self._package_names = package_names
+        self._timeout = timeout
+        self._action = action
+        self._fh = None
+        self._acquire_time = None
+        self._hold_span = None
+        # True if another process held the lock when it was requested.
+        self.waited = False
+
+    def __enter__(self) -> 'SdkLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.release()
+
+    def acquire(self) -> None:
+        if self._path is None:
+            return
+        start_time = time.monotonic()
+        with profile_span('wait for sdk lock', 'lock', path=self._path) as span:
+            # Opened without truncating, the file holds the details of the current holder.
+            try:
+                self._fh = open(self._path, 'a+', encoding='utf-8')
+            except OSError as e:
+                # e.g. the SDK root is read-only or does not exist yet, sdkmanager reports the actual problem.
+                print_verbose('Not locking "%s", failed to open the lock file: %s' % (
+                    os.path.dirname(self._path), e))
+                span.args['skipped'] = True
+                return
+            holder = None
+            while not _try_lock(self._fh):
+                if not self.waited:
+                    self.waited = True
+                    holder = self._read_holder()
+                    print_message('Waiting for the lock of \"%s\", held by %s...' % (
+                        os.path.dirname(self._path), holder))
+                if self._timeout is not None and time.monotonic() - start_time > self._timeout:
+                    self._fh.close()
+                    self._fh = None
+                    print_error_and_exit('Timed out after %d seconds waiting for the lock held by %s' % (
+                        self._timeout, holder))
+                time.sleep(_POLL_INTERVAL_IN_SECONDS)
+            span.args['waited'] = self.waited
+        if self.waited:
+            print_message('Waited %.1f seconds for the lock' % (time.monotonic() - start_time))
+        self._fh.seek(0)
+        self._fh.truncate()
+        self._fh.write('process %d which is %s [%s]' % (os.getpid(), self._action, ', '.join(self._package_names)))
+        self._fh.flush()
+        self._acquire_time = time.monotonic()
+        # Ends when the lock is released.
+        self._hold_span = profile_span('hold sdk lock', 'lock', path=self._path,
+                                       packages=', '.join(self._package_names))
+        self._hold_span.__enter__()
+
+    def release(self) -> None:
+        if self._fh is None:
+            return
+        self._fh.seek(0)
+        self._fh.truncate()
+        _unlock(self._fh)
+        self._fh.close()
+        self._fh = None
+        self._hold_span.__exit__(None, None, None)
+        self._hold_span = None
+        print_verbose('Held the lock of \"%s\" for %.1f seconds' % (os.path.dirname(self._path),
+                                                                      time.monotonic() - self._acquire_time))
+
+    def _read_holder(self) -> str:
+        try:
+            with open(self._path, 'r', encoding='utf-8') as fh:
+                return fh.read().strip() or 'another process'
+        except OSError:
+            # Windows does not allow reading the locked region.
+            return 'another process'
+
+
+if os.name == 'nt':
+    def _try_lock(fh) -> bool:
+        import msvcrt  # pylint: disable=import-error
+        try:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(fh) -> None:
+        import msvcrt  # pylint: disable=import-error
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    def _try_lock(fh) -> bool:
+        import fcntl
+        try:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _unlock(fh) -> None:
+        import fcntl
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
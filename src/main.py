@@ -2,9 +2,6 @@
 
 import sys
 import os
-from typing import Optional
-
-import docopt
 
 
 def _using_python2():
@@ -16,47 +13,101 @@ assert not _using_python2(), 'You are using Python 2 which is not supported. Use
 
 try:
     # This works when the code is executed directly.
-    import android_enhanced
     import output_helper
+    from import_helper import import_module
 except ImportError:
     # This fails when the code is executed directly and not as a part of python package installation,
     # I definitely need a better way to handle this.
-    from androide import android_enhanced
     from androide import output_helper
+    from androide.import_helper import import_module
 
 _VERSION_FILE_NAME = 'version.txt'
+_DAEMON_SOCKET_ENVIRONMENT_VARIABLE = 'ANDROIDTOOL_SOCKET'
+_DEFAULT_DAEMON_SOCKET_NAME = 'daemon.sock'
+_MAX_CACHED_DAEMON_COMMANDS = 256
+_OUTPUT_FORMATS = ('text', 'json', 'ndjson')
+_USAGE_PATTERN_PREFIX = '    androidtool [options] '
 _USAGE_STRING = """
 A better version of the command-line android tool with a more intuitive command-line interface.
 
 Usage:
-    androidtool [options] doctor
+    androidtool [options] doctor [--json]
     androidtool [options] list build tools
     androidtool [options] list installed packages
-    androidtool [options] list api versions [--x86_64 | --x86 | --arm] [--google-apis | --no-google-apis | --android-tv | --android-wear] 
+    androidtool [options] list api versions [--x86_64 | --x86 | --arm] [--google-apis | --no-google-apis | --android-tv | --android-wear] [--min=<api-version>] [--max=<api-version>]
     androidtool [options] list other packages
     androidtool [options] install basic packages
     androidtool [options] install version <android-api-version> [--x86_64 | --x86 | --arm] [--google-apis | --no-google-apis | --android-tv | --android-wear]
     androidtool [options] update all
+    androidtool [options] accept licenses [--seed]
+    androidtool [options] du
+    androidtool [options] gc --keep-latest=<n> [--dry-run]
+    androidtool [options] mirror [<package>...] [--repository=<url>]
+    androidtool [options] roots [--add]
     androidtool [options] list avds
-    androidtool [options] create avd <avd-name> <android-api-version> [--x86_64 | --x86 | --arm] [--google-apis | --no-google-apis | --android-tv | --android-wear]
-    androidtool [options] start avd <avd-name> [--headless]
+    androidtool [options] create avd <avd-name> <android-api-version> [--x86_64 | --x86 | --arm] [--google-apis | --no-google-apis | --android-tv | --android-wear] [--cores=<n>] [--ram=<mb>] [--heap=<mb>] [--gpu=<mode>] [--data-partition=<size>] [--no-quick-boot] [--prebake] [--boot-timeout=<s>]
+    androidtool [options] create avds --from=<manifest>
+    androidtool [options] start avd <avd-name> [--headless] [--instances=<n>] [--wipe-to-snapshot] [--boot-timeout=<s>]
+    androidtool [options] start avds <avd-name>... [--headless] [--boot-timeout=<s>]
+    androidtool [options] daemon
 
 Options:
     -v, --verbose       Verbose mode
+    --refresh           Ignore the cached list of SDK packages and fetch it again
+    --offline           Always use the cached list of SDK packages, even if it is stale
+    --json              Print the doctor report as JSON
+    --format=<format>   Output format of doctor, du, roots and the list commands, text, json or ndjson (a JSON object
+                        per line) [default: text]
+    --min=<api-version> Oldest API version to list
+    --max=<api-version> Newest API version to list
+    --instances=<n>     Number of emulators to start for the AVD [default: 1]
+    --boot-timeout=<s>  Seconds to wait for the emulators to boot [default: 600]
+    --lock-timeout=<s>  Seconds to wait for the other androidtool processes installing into the same SDK
+                        [default: 3600]
+    --from=<manifest>   JSON file listing the AVDs to create
+    --cores=<n>         CPU cores of the AVD, defaults to half of the host cores, at most 4
+    --ram=<mb>          RAM of the AVD in MB, defaults to a quarter of the host memory, between 1536 and 4096
+    --heap=<mb>         VM heap size of the AVD in MB, defaults to 512 with 3072 MB of RAM or more and 256 otherwise
+    --gpu=<mode>        GPU mode of the AVD, auto, host, swiftshader_indirect, angle_indirect, guest or off, defaults
+                        to swiftshader_indirect on a Linux host without a display and auto otherwise
+    --data-partition=<size>
+                        Size of the data partition of the AVD, e.g. 6G, chosen by avdmanager by default
+    --no-quick-boot     Cold boot the AVD every time instead of booting from the snapshot saved on exit
+    --prebake           Boot the new AVD once headless and save a snapshot, start avd then boots from it in seconds
+    --wipe-to-snapshot  Reset the running emulators of the AVD to the snapshot saved by --prebake instead of starting
+                        a new one, starts the AVD if none is running
+    --profile           Print the time spent in every subprocess, parsing step and doctor check at exit
+    --trace-out=<file>  Write the timings in the Chrome trace format, see chrome://tracing
+    --keep-latest=<n>   Number of the latest build tools, platforms and system images of every tag and ABI to keep
+    --dry-run           Only print what would be removed
+    --add               Add the packages of the SDK root to the shared store, their files become links to the store
+    --seed              Accept the standard licenses as well, even if no package uses them yet
+    --repository=<url>  Repository to mirror, a URL or a directory, defaults to $SDK_TEST_BASE_URL or the Google
+                        repository
+    --socket=<path>     Unix socket of the daemon, defaults to $ANDROIDTOOL_SOCKET. The commands but start avd are run
+                        by the daemon if one is listening on it.
     
     
 Sub-command description:
-    doctor - ensures that you have right version of Java. In the future, it will check Android SDK installation as well.
+    doctor - ensures that you have right version of Java, sdkmanager and the basic packages. The checks run concurrently.
     list build tools - lists available build tools
-    list api versions - lists different SDK versions available to install
+    list api versions - lists different SDK versions available to install, optionally only the ones between --min and --max
     list other packages - lists packages apart from build tools and api versions
     list installed packages - lists installed packages
     list avds - lists setup AVDs
     install basic tools - installs a basic set of tools. Highly recommended to run it the first time.
     install version - installs a particular API version
     update all - updates all installed packages to the latest versions.
-    create avd - creates a new AVD. It will install the package, if required. By default, Google API build with X86_64 (on 64-bit) and X86 on 32-bit will be created.
-    start avd - Starts an existing AVD.
+    accept licenses - accepts the licenses of the installed and the mirrored packages, without starting sdkmanager.
+    du - lists the disk usage of every installed package, largest first.
+    gc - removes the older build tools, platforms and system images, the system images used by the AVDs are kept.
+    mirror - keeps the packages and their dependencies in a local mirror, installs of these packages then use the mirror instead of downloading them again. Without packages, updates the mirrored packages.
+    roots - lists the SDK roots which share the package store and verifies that their packages are still the stored ones. The packages installed into the SDK roots added with --add are kept in the store once per revision and linked into every such SDK root, so installing a stored package into another of them only takes seconds. The other SDK roots never use the store.
+    create avd - creates a new AVD. It will install the package, if required. By default, Google API build with X86_64 (on 64-bit) and X86 on 32-bit will be created. The CPU cores, RAM, heap, GPU and data partition are written into its config.ini. With --prebake, it is booted once and a snapshot is saved.
+    create avds - creates all the AVDs in a JSON manifest concurrently, skips the ones which already exist. The manifest can set the hardware of the AVDs, like the options of create avd.
+    start avd - Starts an existing AVD, from its pre-baked snapshot if it has one. With --instances, starts multiple emulators of the AVD in the background.
+    start avds - Starts multiple existing AVDs concurrently in the background and waits for all of them to boot.
+    daemon - keeps the SDK state in memory and runs the commands sent to its socket, installs run one at a time.
     
 androidtool relies on using ANDROID_SDK_ROOT environment variable to find the Android SDK or expects sdkamanger, 
 avdmanager, and emulator commands to be in the path.
@@ -64,17 +115,131 @@ avdmanager, and emulator commands to be in the path.
 
 
 def main():
-    args = docopt.docopt(_USAGE_STRING, version=_get_version())
+    # Wrapper scripts call androidtool a lot, these don't need the usage to be parsed.
+    argv = sys.argv[1:]
+    if '-h' in argv or '--help' in argv:
+        print(_USAGE_STRING.strip('\n'))
+        return
+    if '--version' in argv:
+        print(_get_version())
+        return
+    output_helper.set_verbose('-v' in argv or '--verbose' in argv)
+    # The thin client does not parse the command, the daemon does. Profiling is about this process, it runs here.
+    # So does start avd, which can run the emulator in the foreground of the terminal.
+    socket_path = _get_daemon_socket(argv)
+    if socket_path is not None and _get_words(argv)[:1] != ['daemon'] and _get_words(argv)[:2] != ['start', 'avd'] \
+            and '--profile' not in argv and not any(arg.startswith('--trace-out') for arg in argv):
+        daemon_helper = import_module('daemon_helper')
+        exit_code = daemon_helper.run_client(socket_path, argv)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    args = _parse_args(argv)
     verbose_mode = args['--verbose']
-    output_helper.set_verbose(verbose_mode)
-    androide = android_enhanced.AndroidEnhanced()
+    if args['daemon']:
+        _run_daemon(args)
+        return
+    if not args['--profile'] and args['--trace-out'] is None:
+        _run_command(_get_android_enhanced(args), args, verbose_mode)
+        return
+
+    profile_helper = import_module('profile_helper')
+    profile_helper.set_profiling(True)
+    try:
+        with profile_helper.profile_span(' '.join(sys.argv[1:]), 'command'):
+            _run_command(_get_android_enhanced(args), args, verbose_mode)
+    finally:
+        if args['--profile']:
+            profile_helper.print_profile_summary()
+        if args['--trace-out'] is not None:
+            profile_helper.write_chrome_trace(args['--trace-out'])
+
+
+def _parse_args(argv):
+    # Importing these takes longer than printing the help or the version, or sending the command to the daemon.
+    from collections import defaultdict
+    import docopt
+    # The other sub-commands are not in the parsed usage, their keys are missing from args.
+    args = defaultdict(bool, docopt.docopt(_get_usage_for_command(argv), argv=argv, help=False))
+    if isinstance(args['<avd-name>'], str):
+        # It is only a list when the parsed usage has "start avds <avd-name>...".
+        args['<avd-name>'] = [args['<avd-name>']]
+    return args
+
+
+def _get_android_enhanced(args):
+    android_enhanced = import_module('android_enhanced')
+    return android_enhanced.AndroidEnhanced(refresh_cache=args['--refresh'], offline=args['--offline'],
+                                            lock_timeout=_get_lock_timeout(args))
+
+
+def _get_lock_timeout(args):
+    # 0 fails right away if another process holds the lock.
+    return _get_number_option(args, '--lock-timeout', minimum=0) if args['--lock-timeout'] else None
+
+
+def _run_daemon(args):
+    """
+    Runs the commands of the clients against an AndroidEnhanced which keeps the binary paths, the package catalog and
+    the installed packages in memory across the commands.
+    """
+    import functools
+    from collections import defaultdict
+    daemon_helper = import_module('daemon_helper')
+    androide = import_module('android_enhanced').AndroidEnhanced(lock_timeout=_get_lock_timeout(args))
+    # Parsing the usage takes longer than most of the commands take to run in the daemon.
+    parse_args = functools.lru_cache(maxsize=_MAX_CACHED_DAEMON_COMMANDS)(lambda argv: _parse_args(list(argv)))
+
+    def run_request(argv, cwd):
+        # The verbosity of the daemon itself is process-wide, every request has the verbosity of its client.
+        output_helper.set_thread_verbose('-v' in argv or '--verbose' in argv)
+        try:
+            run_parsed_request(defaultdict(bool, parse_args(tuple(argv))), cwd)
+        finally:
+            output_helper.set_thread_verbose(None)
+
+    def run_parsed_request(request_args, cwd):
+        if request_args['daemon']:
+            output_helper.print_error_and_exit('The daemon is already running')
+        if request_args['start'] and request_args['avd'] and _get_number_option(request_args, '--instances') == 1:
+            output_helper.print_error_and_exit('The daemon cannot run an emulator in the foreground, '
+                                               'run start avd without --socket')
+        # Relative to the working directory of the client
+        if request_args['--from']:
+            request_args['--from'] = os.path.join(cwd, request_args['--from'])
+        if request_args['--repository'] and request_args['--repository'].find('://') == -1:
+            request_args['--repository'] = os.path.join(cwd, request_args['--repository'])
+        if not request_args['--refresh'] and not request_args['--offline']:
+            androide.revalidate_sdk_state()
+            _run_command(androide, request_args, request_args['--verbose'])
+            return
+        try:
+            _run_command(_get_android_enhanced(request_args), request_args, request_args['--verbose'])
+        finally:
+            # The package list might have been fetched again.
+            androide.clear_sdk_state()
+
+    socket_path = args['--socket'] or os.environ.get(_DAEMON_SOCKET_ENVIRONMENT_VARIABLE)
+    if not socket_path:
+        cache_helper = import_module('cache_helper')
+        socket_path = os.path.join(cache_helper.CacheHelper.get_cache_dir(), _DEFAULT_DAEMON_SOCKET_NAME)
+    output_helper.enable_thread_verbosity()
+    daemon_helper.DaemonServer(socket_path, run_request).serve_forever()
+
+
+def _run_command(androide, args, verbose_mode):
+    output_format = args['--format'] or 'text'
+    if output_format not in _OUTPUT_FORMATS:
+        output_helper.print_error_and_exit('Unknown format "%s", use one of %s' % (
+            output_format, ', '.join(_OUTPUT_FORMATS)))
 
     if args['doctor']:
-        androide.run_doctor()
+        androide.run_doctor('json' if args['--json'] else output_format)
     elif args['list'] and args['api'] and args['versions']:
         arch = get_architecture(args)
         api_type = get_api_type(args)
-        androide.list_packages(arch, api_type)
+        androide.list_packages(arch, api_type, output_format, _get_api_version_option(args, '--min'),
+                               _get_api_version_option(args, '--max'))
     elif args['install'] and args['version']:
         arch = get_architecture(args)
         api_type = get_api_type(args)
@@ -85,33 +250,136 @@ def main():
         version = args['<android-api-version>']
         androide.install_api_version(version, arch, api_type)
     elif args['list'] and args['build'] and args['tools']:
-        androide.list_build_tools()
+        androide.list_build_tools(output_format)
     elif args['list'] and args['other'] and args['packages']:
-        androide.list_others()
+        androide.list_others(output_format)
     elif args['list'] and args['installed'] and args['packages']:
-        androide.list_installed_packages()
+        androide.list_installed_packages(output_format)
     elif args['update'] and args['all']:
         androide.update_all()
+    elif args['accept'] and args['licenses']:
+        androide.accept_licenses(args['--seed'])
+    elif args['du']:
+        androide.print_disk_usage(output_format)
+    elif args['gc']:
+        androide.collect_garbage(_get_number_option(args, '--keep-latest'), args['--dry-run'])
+    elif args['roots']:
+        androide.print_sdk_roots(output_format, args['--add'])
+    elif args['mirror']:
+        androide.mirror_packages(args['<package>'], args['--repository'])
     elif args['install'] and args['basic'] and args['packages']:
         androide.install_basic_packages()
     elif args['list'] and args['avds']:
-        androide.list_avds()
+        androide.list_avds(output_format)
     elif args['create'] and args['avd']:
-        name = args['<avd-name>']
+        name = args['<avd-name>'][0]
         api_version = args['<android-api-version>']
         api_type = get_api_type(args)
         arch = get_architecture(args)
-        androide.create_avd(name, api_version, arch, api_type)
+        androide.create_avd(name, api_version, arch, api_type, _get_avd_hardware(args), args['--prebake'],
+                            _get_number_option(args, '--boot-timeout'))
+    elif args['create'] and args['avds']:
+        androide.create_avds(args['--from'])
     elif args['start'] and args['avd']:
-        # To be implemented
-        name = args['<avd-name>']
+        name = args['<avd-name>'][0]
         headless_mode = args['--headless']
-        androide.start_avd(name, headless_mode, verbose_mode)
+        instances = _get_number_option(args, '--instances')
+        if args['--wipe-to-snapshot'] and androide.reset_avd_to_snapshot(name):
+            # The running emulators were reset, there is nothing to start.
+            return
+        if instances == 1:
+            androide.start_avd(name, headless_mode, verbose_mode)
+        else:
+            androide.start_avds([name], instances, headless_mode, verbose_mode,
+                                _get_number_option(args, '--boot-timeout'))
+    elif args['start'] and args['avds']:
+        names = args['<avd-name>']
+        headless_mode = args['--headless']
+        androide.start_avds(names, 1, headless_mode, verbose_mode, _get_number_option(args, '--boot-timeout'))
     else:
         output_helper.print_error_and_exit('Not implemented: "%s"' % ' '.join(sys.argv))
 
 
-def get_api_type(args) -> Optional[str]:
+def _get_usage_for_command(argv):
+    """
+    :return: the usage string with only the usage patterns of the sub-command in argv, or the complete usage string
+    if there are none. docopt takes longer to parse all the patterns than the cached commands take to run.
+    """
+    words = _get_words(argv)
+    lines = _USAGE_STRING.split('\n')
+    patterns = []
+    for line in lines:
+        if not line.startswith(_USAGE_PATTERN_PREFIX):
+            continue
+        # e.g. "create avd" for "create avd <avd-name> <android-api-version> [--x86_64 | --x86 | --arm]"
+        sub_command = []
+        for token in line[len(_USAGE_PATTERN_PREFIX):].split():
+            if token[0] in '[(<-':
+                break
+            sub_command.append(token)
+        if words[:len(sub_command)] == sub_command:
+            patterns.append(line)
+    if not patterns:
+        return _USAGE_STRING
+    # The options which only the other sub-commands take are left out as well, docopt takes longer the more options
+    # there are. The options which are in no usage pattern are the ones which every sub-command takes.
+    other_options = set(option for line in lines if line.startswith(_USAGE_PATTERN_PREFIX)
+                        for option in _get_long_options(line))
+    other_options.difference_update(option for line in patterns for option in _get_long_options(line))
+    usage_lines = []
+    skipped_option = False
+    for line in lines:
+        if line.startswith(_USAGE_PATTERN_PREFIX):
+            if line in patterns:
+                usage_lines.append(line)
+            continue
+        if line.startswith('    -'):
+            skipped_option = not other_options.isdisjoint(_get_long_options(line.strip().split('  ', 1)[0]))
+        elif not line.startswith('     '):
+            skipped_option = False
+        # The description of an option can continue on the next lines.
+        if not skipped_option:
+            usage_lines.append(line)
+    return '\n'.join(usage_lines)
+
+
+def _get_long_options(text):
+    """
+    :return: the long options in a usage pattern or an option description, e.g. "--min" for "[--min=<api-version>]"
+    """
+    return [token.strip('[]()|.').split('=', 1)[0] for token in text.split() if token.strip('[(').startswith('--')]
+
+
+def _get_words(argv):
+    """
+    :return: the sub-command and the positional arguments in argv, without the options and their values
+    """
+    words = []
+    skip_value = False
+    for arg in argv:
+        if skip_value:
+            skip_value = False
+        elif arg.startswith('-'):
+            # e.g. "--from manifest.json", the value is only a separate argument if the option has no "="
+            skip_value = arg.find('=') == -1 and _USAGE_STRING.find('    %s=<' % arg) != -1
+        else:
+            words.append(arg)
+    return words
+
+
+def _get_daemon_socket(argv):
+    """
+    :return: the path given by --socket or ANDROIDTOOL_SOCKET, None if there is none
+    """
+    for (i, arg) in enumerate(argv):
+        if arg.startswith('--socket='):
+            return arg[len('--socket='):]
+        if arg == '--socket' and i + 1 < len(argv):
+            return argv[i + 1]
+    return os.environ.get(_DAEMON_SOCKET_ENVIRONMENT_VARIABLE) or None
+
+
+def get_api_type(args):
     api_type = None  # default
     if args['--no-google-apis']:
         api_type = 'default'
@@ -124,7 +392,7 @@ def get_api_type(args) -> Optional[str]:
     return api_type
 
 
-def get_architecture(args) -> Optional[str]:
+def get_architecture(args):
     arch = None  # default
     if args['--x86']:
         arch = 'x86'
@@ -135,6 +403,33 @@ def get_architecture(args) -> Optional[str]:
     return arch
 
 
+def _get_api_version_option(args, option):
+    if args[option] is None:
+        return None
+    if not args[option].isdigit():
+        output_helper.print_error_and_exit('%s must be an API version like 28, not "%s"' % (option, args[option]))
+    return int(args[option])
+
+
+def _get_number_option(args, option, minimum=1):
+    if not args[option].isdigit() or int(args[option]) < minimum:
+        output_helper.print_error_and_exit('%s must be a number not less than %d, not "%s"' % (
+            option, minimum, args[option]))
+    return int(args[option])
+
+
+def _get_avd_hardware(args):
+    """
+    :return: the hardware options of create avd, as arguments of AvdHelper.get_hardware_config()
+    """
+    hardware = {'quick_boot': not args['--no-quick-boot']}
+    for (option, key) in (('--cores', 'cores'), ('--ram', 'ram_size'), ('--heap', 'heap_size'), ('--gpu', 'gpu_mode'),
+                          ('--data-partition', 'data_partition_size')):
+        if args[option] is not None:
+            hardware[key] = args[option]
+    return hardware
+
+
 def _get_version():
     dir_of_this_script = os.path.split(__file__)[0]
     version_file_path = os.path.join(dir_of_this_script, _VERSION_FILE_NAME)
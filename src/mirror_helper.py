@@ -0,0 +1,365 @@
+import hashlib
+import json
+import os
+import platform
+import xml.etree.ElementTree as ElementTree
+from typing import Optional
+
+try:
+    # This works when the code is executed directly.
+    from cache_helper import CacheHelper
+    from platform_helper import PlatformHelper
+    from output_helper import print_message, print_error, print_verbose
+    from profile_helper import profile_span
+    from sdk_scanner import get_local_name, get_revision
+except ImportError:
+    # This fails when the code is executed directly and not as a part of python package installation,
+    # I definitely need a better way to handle this.
+    from androide.cache_helper import CacheHelper
+    from androide.platform_helper import PlatformHelper
+    from androide.output_helper import print_message, print_error, print_verbose
+    from androide.profile_helper import profile_span
+    from androide.sdk_scanner import get_local_name, get_revision
+
+# sdkmanager fetches the packages from this repository instead of the Google one, if it is set.
+_REPOSITORY_URL_ENVIRONMENT_VARIABLE = 'SDK_TEST_BASE_URL'
+_DEFAULT_REPOSITORY_URL = 'https://dl.google.com/android/repository/'
+# Lists the packages of the main repository, the add-ons list points to the other repositories like the system images.
+_REPOSITORY_XML = 'repository2-3.xml'
+_ADDONS_LIST_XML = 'addons_list-5.xml'
+_MIRROR_DIR_NAME = 'mirror'
+# Content-addressed files, named by their checksum, so the same archive is only ever downloaded once.
+_OBJECTS_DIR_NAME = 'objects'
+# Laid out like the remote repository, its files are hard links to the objects. This is what sdkmanager reads.
+_REPOSITORY_DIR_NAME = 'repository'
+_INDEX_FILE_NAME = 'packages.json'
+# platform.machine() -> host-arch of the repository XML
+_HOST_ARCHS = {'x86_64': 'x64', 'amd64': 'x64', 'arm64': 'aarch64', 'aarch64': 'aarch64', 'i386': 'x86',
+               'i686': 'x86', 'x86': 'x86'}
+# Checksum types of the repository XML -> hashlib algorithms
+_CHECKSUM_ALGORITHMS = {'sha1': 'sha1', 'sha-256': 'sha256', 'sha256': 'sha256'}
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+_DOWNLOAD_TIMEOUT_IN_SECONDS = 60
+
+
+class MirrorHelper:
+    """
+    A local mirror of the remote repository of the SDK packages. The repository XMLs and the archives of the mirrored
+    packages are kept in a content-addressed store in the cache directory, and installs of the mirrored packages
+    point sdkmanager to the mirror instead of downloading the archives again.
+    """
+
+    @staticmethod
+    def mirror(package_names, repository_url=None) -> bool:
+        """
+        Mirrors the packages and their dependencies. The packages mirrored before are updated as well, so that the
+        archives in the mirror always match its repository XMLs.
+        :param repository_url: repository to mirror, defaults to $SDK_TEST_BASE_URL or the Google repository
+        :return: True if all the packages were mirrored
+        """
+        repository_url = MirrorHelper._get_remote_repository_url(repository_url)
+        mirror_dir = MirrorHelper.get_mirror_dir()
+        mirrored_package_names = [name for name in MirrorHelper._read_index() if name not in package_names]
+        if not package_names and not mirrored_package_names:
+            print_error('No packages to mirror')
+            return False
+
+        print_message('Fetching the repository from \"%s\"...' % repository_url)
+        repository_files = {}
+        xml_paths = MirrorHelper._get_repository_xml_paths(repository_url, repository_files)
+        if xml_paths is None:
+            return False
+        remote_packages = {}
+        for xml_path in xml_paths:
+            root = ElementTree.fromstring(_read_object(repository_files[xml_path]))
+            remote_packages.update(_get_remote_packages(root, os.path.dirname(xml_path)))
+        print_verbose('Found %d packages in the repository' % len(remote_packages))
+
+        for package_name in mirrored_package_names:
+            if package_name not in remote_packages:
+                print_message('Package \"%s\" is no longer in the repository, it is dropped from the mirror' %
+                              package_name)
+        missing_packages = [package_name for package_name in package_names
+                            if remote_packages.get(package_name, None) is None or
+                            remote_packages[package_name].archive is None]
+        for package_name in missing_packages:
+            print_error('Package \"%s\" not found in the repository' % package_name)
+        if missing_packages:
+            return False
+        packages_to_mirror = {}
+        pending_package_names = [package_name for package_name in reversed(list(package_names) +
+                                                                           mirrored_package_names)
+                                 if package_name in remote_packages]
+        while pending_package_names:
+            package = remote_packages.get(pending_package_names.pop(), None)
+            if package is None or package.archive is None or package.path in packages_to_mirror:
+                continue
+            packages_to_mirror[package.path] = package
+            pending_package_names.extend(reversed(package.dependencies))
+        packages_to_mirror = list(packages_to_mirror.values())
+
+        for package in packages_to_mirror:
+            object_path = _get_object_path(mirror_dir, package.checksum_type, package.checksum)
+            if os.path.exists(object_path):
+                print_message('%s %s is already mirrored' % (package.path, package.revision))
+            else:
+                print_message('Downloading %s %s (%.1f MB)...' % (package.path, package.revision,
+                                                                 (package.size or 0) / (1024 * 1024)))
+                if not _download(repository_url + package.archive, mirror_dir,
+                                 package.checksum_type, package.checksum):
+                    return False
+            repository_files[package.archive] = object_path
+
+        # The repository XMLs go in last, they must never list the archives which are not in the mirror yet.
+        for (relative_path, object_path) in sorted(repository_files.items(),
+                                                    key=lambda item: item[0].endswith('.xml')):
+            _link(object_path, os.path.join(mirror_dir, _REPOSITORY_DIR_NAME, *relative_path.split('/')))
+        index = {package.path: {'revision': package.revision, 'archive': package.archive,
+                                'dependencies': package.dependencies} for package in packages_to_mirror}
+        _write_json(os.path.join(mirror_dir, _INDEX_FILE_NAME), index)
+        print_message('Mirrored %d packages in \"%s\"' % (len(packages_to_mirror), mirror_dir))
+        return True
+
+    @staticmethod
+    def get_sdk_manager_env(package_names, versions=None) -> Optional[dict]:
+        """
+        :param versions: package name -> version, for the packages which must be installed at a particular version
+        :return: environment variables which point sdkmanager to the mirror if it has all the packages, None otherwise
+        """
+        if not package_names:
+            return None
+        index = MirrorHelper._read_index()
+        repository_dir = os.path.join(MirrorHelper.get_mirror_dir(), _REPOSITORY_DIR_NAME)
+        for package_name in package_names:
+            package = index.get(package_name, None)
+            if package is None:
+                print_verbose('Package \"%s\" is not mirrored' % package_name)
+                return None
+            if versions and versions.get(package_name, package['revision']) != package['revision']:
+                print_verbose('Package \"%s\" is mirrored at a different version' % package_name)
+                return None
+            if not os.path.exists(os.path.join(repository_dir, *package['archive'].split('/'))):
+                print_verbose('Archive of \"%s\" is missing from the mirror' % package_name)
+                return None
+        import pathlib
+        return {_REPOSITORY_URL_ENVIRONMENT_VARIABLE: pathlib.Path(repository_dir).as_uri() + '/'}
+
+    @staticmethod
+    def get_mirrored_xml_paths() -> [str]:
+        """
+        :return: paths of the repository XMLs in the mirror
+        """
+        xml_paths = []
+        for (directory, _, file_names) in os.walk(os.path.join(MirrorHelper.get_mirror_dir(), _REPOSITORY_DIR_NAME)):
+            xml_paths.extend(os.path.join(directory, file_name) for file_name in file_names
+                             if file_name.endswith('.xml'))
+        return sorted(xml_paths)
+
+    @staticmethod
+    def get_mirror_dir() -> str:
+        return os.path.join(CacheHelper.get_cache_dir(), _MIRROR_DIR_NAME)
+
+    @staticmethod
+    def _get_remote_repository_url(repository_url) -> str:
+        repository_url = repository_url or os.environ.get(_REPOSITORY_URL_ENVIRONMENT_VARIABLE) or \
+            _DEFAULT_REPOSITORY_URL
+        if repository_url.find('://') == -1:
+            # A local directory
+            import pathlib
+            repository_url = pathlib.Path(os.path.abspath(repository_url)).as_uri()
+        if not repository_url.endswith('/'):
+            repository_url += '/'
+        return repository_url
+
+    @staticmethod
+    def _get_repository_xml_paths(repository_url, repository_files) -> [str]:
+        """
+        Downloads the repository XMLs into the store.
+        :param repository_files: filled with path relative to the repository -> object path
+        :return: relative paths of the XMLs which list packages, None if the repository could not be fetched
+        """
+        mirror_dir = MirrorHelper.get_mirror_dir()
+        xml_paths = [_REPOSITORY_XML]
+        for xml_path in (_REPOSITORY_XML, _ADDONS_LIST_XML):
+            object_path = _download(repository_url + xml_path, mirror_dir)
+            if object_path is None:
+                if xml_path == _ADDONS_LIST_XML:
+                    # The add-ons are optional.
+                    continue
+                return None
+            repository_files[xml_path] = object_path
+        if _ADDONS_LIST_XML in repository_files:
+            root = ElementTree.fromstring(_read_object(repository_files[_ADDONS_LIST_XML]))
+            for element in root.iter():
+                if get_local_name(element.tag) != 'url':
+                    continue
+                xml_path = (element.text or '').strip()
+                if not xml_path or xml_path.find('://') != -1:
+                    # Third-party repositories are not mirrored.
+                    continue
+                object_path = _download(repository_url + xml_path, mirror_dir)
+                if object_path is not None:
+                    repository_files[xml_path] = object_path
+                    xml_paths.append(xml_path)
+        return xml_paths
+
+    @staticmethod
+    def _read_index() -> dict:
+        """
+        :return: package name -> {'revision', 'archive', 'dependencies'} of the mirrored packages
+        """
+        try:
+            with open(os.path.join(MirrorHelper.get_mirror_dir(), _INDEX_FILE_NAME), 'r', encoding='utf-8') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+
+class _RemotePackage:
+    __slots__ = ('path', 'revision', 'archive', 'checksum_type', 'checksum', 'size', 'dependencies')
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.revision = None
+        # Path of the archive for this host, relative to the repository, None if there is none.
+        self.archive = None
+        self.checksum_type = None
+        self.checksum = None
+        self.size = None
+        self.dependencies = []
+
+
+def _get_remote_packages(root, xml_dir) -> {str: _RemotePackage}:
+    """
+    :param xml_dir: directory of the repository XML relative to the repository, the archives are relative to it
+    """
+    # <remotePackage path="build-tools;28.0.3">
+    #   <revision><major>28</major><minor>0</minor><micro>3</micro></revision>
+    #   <dependencies><dependency path="tools"/></dependencies>
+    #   <archives><archive>
+    #     <complete><size>57610954</size><checksum type="sha1">...</checksum><url>build-tools_r28.0.3-linux.zip</url>
+    #     </complete><host-os>linux</host-os><host-arch>x64</host-arch>
+    #   </archive></archives>
+    # </remotePackage>
+    if PlatformHelper.on_linux():
+        host_os = 'linux'
+    elif PlatformHelper.on_mac():
+        host_os = 'macosx'
+    else:
+        host_os = 'windows'
+    machine = platform.machine().lower()
+    host_arch = _HOST_ARCHS.get(machine, machine)
+    packages = {}
+    for element in root.iter():
+        if get_local_name(element.tag) != 'remotePackage':
+            continue
+        package = _RemotePackage(element.get('path'))
+        for child in element:
+            name = get_local_name(child.tag)
+            if name == 'revision':
+                package.revision = get_revision(child)
+            elif name == 'dependencies':
+                package.dependencies = [dependency.get('path') for dependency in child if dependency.get('path')]
+            elif name == 'archives':
+                for archive in child:
+                    _set_archive(package, archive, host_os, host_arch, xml_dir)
+        packages[package.path] = package
+    return packages
+
+
+def _set_archive(package, archive, host_os, host_arch, xml_dir) -> None:
+    values = {}
+    for child in archive:
+        name = get_local_name(child.tag)
+        if name == 'complete':
+            for complete_child in child:
+                values[get_local_name(complete_child.tag)] = complete_child
+        else:
+            values[name] = child
+    if 'host-os' in values and values['host-os'].text.strip() != host_os:
+        return
+    # The archives without a host-arch are for every architecture.
+    if 'host-arch' in values and values['host-arch'].text.strip() != host_arch:
+        return
+    if 'url' not in values or 'checksum' not in values:
+        return
+    url = values['url'].text.strip()
+    checksum_type = values['checksum'].get('type', 'sha1')
+    if url.find('://') != -1 or checksum_type not in _CHECKSUM_ALGORITHMS:
+        return
+    package.archive = '/'.join(part for part in (xml_dir, url) if part)
+    package.checksum_type = _CHECKSUM_ALGORITHMS[checksum_type]
+    package.checksum = values['checksum'].text.strip().lower()
+    package.size = int(values['size'].text) if 'size' in values else None
+
+
+def _download(url, mirror_dir, checksum_type='sha1', checksum=None) -> Optional[str]:
+    """
+    Downloads the file into the store, verifying its checksum if it is known.
+    :return: path of the stored object, None if the download failed
+    """
+    import tempfile
+    import urllib.request
+    objects_dir = os.path.join(mirror_dir, _OBJECTS_DIR_NAME)
+    os.makedirs(objects_dir, exist_ok=True)
+    digest = hashlib.new(checksum_type)
+    with profile_span('download %s' % url.rsplit('/', 1)[-1], 'download', url=url) as span:
+        # Downloaded next to the store, so that moving it in is atomic.
+        fd, temp_path = tempfile.mkstemp(dir=objects_dir, suffix='.download')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                with urllib.request.urlopen(url, timeout=_DOWNLOAD_TIMEOUT_IN_SECONDS) as response:
+                    while True:
+                        data = response.read(_DOWNLOAD_CHUNK_SIZE)
+                        if not data:
+                            break
+                        digest.update(data)
+                        fh.write(data)
+                span.args['bytes'] = fh.tell()
+            if checksum is not None and digest.hexdigest() != checksum:
+                print_error('Checksum of \"%s\" does not match, expected %s but got %s' % (
+                    url, checksum, digest.hexdigest()))
+                return None
+            object_path = _get_object_path(mirror_dir, checksum_type, digest.hexdigest())
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.replace(temp_path, object_path)
+            return object_path
+        except (OSError, ValueError) as e:
+            print_error('Failed to download \"%s\": %s' % (url, e))
+            return None
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def _get_object_path(mirror_dir, checksum_type, checksum) -> str:
+    return os.path.join(mirror_dir, _OBJECTS_DIR_NAME, checksum_type, checksum[:2], checksum)
+
+
+def _read_object(object_path) -> bytes:
+    with open(object_path, 'rb') as fh:
+        return fh.read()
+
+
+def _link(object_path, path) -> None:
+    if os.path.exists(path) and os.path.samefile(object_path, path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Replaced atomically, sdkmanager may be reading the mirror right now.
+    temp_path = path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        os.link(object_path, temp_path)
+    except OSError:
+        # Hard links are not supported by every file system.
+        import shutil
+        shutil.copyfile(object_path, temp_path)
+    os.replace(temp_path, path)
+
+
+def _write_json(path, value) -> None:
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as fh:
+        json.dump(value, fh, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
@@ -1,6 +1,9 @@
 import sys
 
 _verbose = False
+# Verbosity of the command run by the current thread, only the daemon sets it, it runs the commands of several clients
+# at once.
+_thread_verbose = None
 
 
 def set_verbose(enabled):
@@ -8,6 +11,23 @@ def set_verbose(enabled):
     _verbose = enabled
 
 
+def enable_thread_verbosity():
+    """
+    Lets every thread set its own verbosity via set_thread_verbose(), the threads which don't set it use the
+    process-wide one. Only the daemon calls this, before it starts any thread.
+    """
+    global _thread_verbose
+    import threading
+    _thread_verbose = threading.local()
+
+
+def set_thread_verbose(enabled):
+    """
+    :param enabled: None to use the process-wide verbosity in the current thread
+    """
+    _thread_verbose.enabled = enabled
+
+
 def print_message(message):
     print(message)
 
@@ -24,13 +44,17 @@ def print_error(error_string):
 
 
 def print_verbose(message):
-    global _verbose
-    if _verbose:
+    if _is_verbose():
         if _is_interactive_terminal():
             message = '%s%s%s' % (BashColors.WARNING, message, BashColors.ENDC)
         print(message)
 
 
+def _is_verbose():
+    enabled = getattr(_thread_verbose, 'enabled', None)
+    return _verbose if enabled is None else enabled
+
+
 def _is_interactive_terminal():
     return sys.stdout.isatty()
 
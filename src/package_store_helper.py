@@ -0,0 +1,289 @@
+import filecmp
+import json
+import os
+import shutil
+import xml.etree.ElementTree as ElementTree
+
+try:
+    # This works when the code is executed directly.
+    from cache_helper import CacheHelper
+    from output_helper import print_verbose
+    from profile_helper import profile_span
+    from sdk_scanner import SdkScanner, get_local_name
+except ImportError:
+    # This fails when the code is executed directly and not as a part of python package installation,
+    # I definitely need a better way to handle this.
+    from androide.cache_helper import CacheHelper
+    from androide.output_helper import print_verbose
+    from androide.profile_helper import profile_span
+    from androide.sdk_scanner import SdkScanner, get_local_name
+
+_STORE_DIR_NAME = 'store'
+# <package path, a directory per ";" separated part>/<revision>/<the files of the package>
+_PACKAGES_DIR_NAME = 'packages'
+_ROOTS_FILE_NAME = 'roots.json'
+_PACKAGE_XML = 'package.xml'
+# Describes the old packages which don't have a package.xml
+_SOURCE_PROPERTIES = 'source.properties'
+# Linux ioctl which makes the target file share the extents of the source file, on btrfs and XFS.
+_FICLONE = 0x40049409
+
+
+class PackageStoreHelper:
+    """
+    A store of the installed packages shared by all the SDK roots, keyed on the package path and revision. The files of
+    the packages in the SDK roots are hard links to the files in the store, so a revision of a package takes the disk
+    space of a single copy however many SDK roots have it, and installing it into another SDK root is only creating
+    the links. Reflinks or copies are made instead if the SDK root and the store are on different file systems.
+
+    The packages are never modified in place, sdkmanager replaces the whole directory of a package when it updates
+    it, so the SDK roots don't see the changes of each other.
+
+    Only the SDK roots which were added with "roots --add" use the store.
+    """
+
+    @staticmethod
+    def is_stored(package_name) -> bool:
+        """
+        :return: True if the store has any revision of the package
+        """
+        return os.path.isdir(PackageStoreHelper._get_package_dir(package_name))
+
+    @staticmethod
+    def get_dependencies(package_name, revision) -> [str]:
+        """
+        :return: paths of the packages which the stored package depends on, from its package.xml
+        """
+        xml_path = os.path.join(PackageStoreHelper._get_revision_dir(package_name, revision), _PACKAGE_XML)
+        try:
+            root = ElementTree.parse(xml_path).getroot()
+        except (OSError, ElementTree.ParseError) as e:
+            print_verbose('Failed to read the dependencies in \"%s\": %s' % (xml_path, e))
+            return []
+        return [element.get('path') for element in root.iter()
+                if get_local_name(element.tag) == 'dependency' and element.get('path')]
+
+    @staticmethod
+    def link_package(sdk_root, package_name, revision) -> bool:
+        """
+        Installs the stored revision of the package into the SDK root.
+        :return: False if the package is not stored or if it is already in the SDK root
+        """
+        revision_dir = PackageStoreHelper._get_revision_dir(package_name, revision)
+        package_dir = os.path.join(sdk_root, *package_name.split(';'))
+        if not os.path.isdir(revision_dir) or os.path.exists(package_dir):
+            return False
+        with profile_span('link %s' % package_name, 'store', revision=revision):
+            _copy_tree(revision_dir, package_dir)
+        return True
+
+    @staticmethod
+    def add_packages(sdk_root, packages) -> int:
+        """
+        Stores the packages of the SDK root which are not stored yet, by linking their files into the store. The files
+        of the packages which are already stored are replaced by links to the stored ones if they are the same.
+        :param packages: installed SdkPackages of the SDK root
+        :return: number of bytes which the SDK root no longer takes
+        """
+        saved_size = 0
+        for package in packages:
+            if not package.location or not package.version or not os.path.isdir(package.location):
+                continue
+            revision_dir = PackageStoreHelper._get_revision_dir(package.path, package.version)
+            with profile_span('store %s' % package.path, 'store', revision=package.version):
+                if os.path.isdir(revision_dir):
+                    saved_size += _link_same_files(revision_dir, package.location)
+                else:
+                    _copy_tree(package.location, revision_dir)
+        PackageStoreHelper.add_root(sdk_root)
+        return saved_size
+
+    @staticmethod
+    def verify_package(package) -> str:
+        """
+        :param package: installed SdkPackage
+        :return: "linked" if all its files are links to the store, "copied" if some are copies of the stored ones,
+        "modified" if some files are missing or differ and "not stored" if its revision is not in the store
+        """
+        revision_dir = PackageStoreHelper._get_revision_dir(package.path, package.version or '')
+        if not package.location or not package.version or not os.path.isdir(revision_dir):
+            return 'not stored'
+        status = 'linked'
+        for (stored_path, relative_path) in _walk_files(revision_dir):
+            path = os.path.join(package.location, relative_path)
+            try:
+                if os.path.islink(stored_path):
+                    if os.readlink(stored_path) != os.readlink(path):
+                        return 'modified'
+                elif not os.path.samefile(stored_path, path):
+                    if os.path.islink(path) or not filecmp.cmp(stored_path, path, shallow=False):
+                        return 'modified'
+                    status = 'copied'
+            except OSError:
+                return 'modified'
+        return status
+
+    @staticmethod
+    def prune() -> int:
+        """
+        Removes the stored revisions which none of the SDK roots has installed any more. The links can't tell this,
+        the files are copies if the SDK root is on another file system.
+        :return: number of bytes freed
+        """
+        used_revision_dirs = set()
+        for sdk_root in PackageStoreHelper.get_roots():
+            if os.path.isdir(sdk_root):
+                used_revision_dirs.update(PackageStoreHelper._get_revision_dir(package.path, package.version)
+                                          for package in SdkScanner.get_installed_packages(sdk_root)
+                                          if package.path and package.version)
+        freed_size = 0
+        packages_dir = os.path.join(PackageStoreHelper.get_store_dir(), _PACKAGES_DIR_NAME)
+        for revision_dir in _find_revision_dirs(packages_dir):
+            if revision_dir in used_revision_dirs:
+                continue
+            print_verbose('Removing \"%s\" from the store, no SDK root uses it' % revision_dir)
+            for (path, _) in _walk_files(revision_dir):
+                try:
+                    stat = os.lstat(path)
+                except OSError:
+                    continue
+                # The files which are still linked from elsewhere take the same space after the removal.
+                if stat.st_nlink <= 1:
+                    freed_size += stat.st_size
+            shutil.rmtree(revision_dir, ignore_errors=True)
+            # The directories of the package path, if this was its last revision.
+            directory = os.path.dirname(revision_dir)
+            while directory != packages_dir and not os.listdir(directory):
+                os.rmdir(directory)
+                directory = os.path.dirname(directory)
+        return freed_size
+
+    @staticmethod
+    def get_roots() -> [str]:
+        """
+        :return: the SDK roots which have packages from the store, in the order they were added
+        """
+        try:
+            with open(os.path.join(PackageStoreHelper.get_store_dir(), _ROOTS_FILE_NAME), 'r', encoding='utf-8') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return []
+
+    @staticmethod
+    def is_root(sdk_root) -> bool:
+        """
+        :return: True if the SDK root was added to the store
+        """
+        return os.path.abspath(sdk_root) in PackageStoreHelper.get_roots()
+
+    @staticmethod
+    def add_root(sdk_root) -> None:
+        sdk_root = os.path.abspath(sdk_root)
+        roots = PackageStoreHelper.get_roots()
+        if sdk_root in roots:
+            return
+        roots.append(sdk_root)
+        os.makedirs(PackageStoreHelper.get_store_dir(), exist_ok=True)
+        roots_path = os.path.join(PackageStoreHelper.get_store_dir(), _ROOTS_FILE_NAME)
+        temp_path = '%s.%d.tmp' % (roots_path, os.getpid())
+        with open(temp_path, 'w', encoding='utf-8') as fh:
+            json.dump(roots, fh, indent=2)
+        os.replace(temp_path, roots_path)
+
+    @staticmethod
+    def get_store_dir() -> str:
+        return os.path.join(CacheHelper.get_cache_dir(), _STORE_DIR_NAME)
+
+    @staticmethod
+    def _get_package_dir(package_name) -> str:
+        return os.path.join(PackageStoreHelper.get_store_dir(), _PACKAGES_DIR_NAME, *package_name.split(';'))
+
+    @staticmethod
+    def _get_revision_dir(package_name, revision) -> str:
+        # e.g. "34.0.0 rc1"
+        return os.path.join(PackageStoreHelper._get_package_dir(package_name), revision.replace(' ', '-'))
+
+
+def _find_revision_dirs(packages_dir) -> [str]:
+    """
+    :return: the stored revisions, these are the directories which contain a package.xml or a source.properties
+    """
+    revision_dirs = []
+    for (directory, dir_names, file_names) in os.walk(packages_dir):
+        if _PACKAGE_XML in file_names or _SOURCE_PROPERTIES in file_names:
+            revision_dirs.append(directory)
+            # The files of the package
+            dir_names.clear()
+    return revision_dirs
+
+
+def _walk_files(directory) -> [(str, str)]:
+    """
+    :return: (path, path relative to the directory) of the files and the symbolic links under the directory
+    """
+    files = []
+    for (path, dir_names, file_names) in os.walk(directory):
+        for name in file_names + [dir_name for dir_name in dir_names if os.path.islink(os.path.join(path, dir_name))]:
+            files.append((os.path.join(path, name), os.path.relpath(os.path.join(path, name), directory)))
+    return files
+
+
+def _copy_tree(source_dir, target_dir) -> None:
+    """
+    Links the files of source_dir into target_dir, which must not exist. The tree is created next to target_dir and
+    renamed, so that no other process sees a partial package.
+    """
+    temp_dir = '%s.%d.tmp' % (target_dir, os.getpid())
+    for (source_path, relative_path) in _walk_files(source_dir):
+        target_path = os.path.join(temp_dir, relative_path)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        if os.path.islink(source_path):
+            os.symlink(os.readlink(source_path), target_path)
+        else:
+            _link_file(source_path, target_path)
+    os.makedirs(temp_dir, exist_ok=True)
+    try:
+        os.rename(temp_dir, target_dir)
+    except OSError:
+        # Another process stored the same package meanwhile.
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _link_same_files(stored_dir, package_dir) -> int:
+    """
+    Replaces the files of the package which are the same as the stored ones by links to them.
+    :return: number of bytes which the package no longer takes
+    """
+    saved_size = 0
+    for (stored_path, relative_path) in _walk_files(stored_dir):
+        path = os.path.join(package_dir, relative_path)
+        if os.path.islink(stored_path) or os.path.islink(path) or not os.path.isfile(path) or \
+                os.path.samefile(stored_path, path) or not filecmp.cmp(stored_path, path, shallow=False):
+            continue
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        _link_file(stored_path, temp_path)
+        os.replace(temp_path, path)
+        saved_size += os.path.getsize(path)
+    return saved_size
+
+
+def _link_file(source_path, target_path) -> None:
+    try:
+        os.link(source_path, target_path)
+        return
+    except OSError as e:
+        # Hard links don't work across file systems.
+        print_verbose('Failed to link \"%s\": %s' % (source_path, e))
+    if os.name == 'nt' or not _reflink_file(source_path, target_path):
+        shutil.copyfile(source_path, target_path)
+    shutil.copymode(source_path, target_path)
+
+
+def _reflink_file(source_path, target_path) -> bool:
+    import fcntl
+    try:
+        with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+            fcntl.ioctl(target.fileno(), _FICLONE, source.fileno())
+        return True
+    except OSError:
+        return False
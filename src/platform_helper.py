@@ -1,67 +1,251 @@
 import os
-import platform
-import subprocess
+import sys
+import time
+from typing import Optional
 
 try:
     # This works when the code is executed directly.
     from output_helper import print_verbose
+    from profile_helper import is_profiling, profile_span
 except ImportError:
     # This fails when the code is executed directly and not as a part of python package installation,
     # I definitely need a better way to handle this.
     from androide.output_helper import print_verbose
+    from androide.profile_helper import is_profiling, profile_span
+
+
+# Size of a single read from the pipes of a child process.
+_READ_CHUNK_SIZE = 64 * 1024
+_COMMAND_NOT_FOUND_RETURN_CODE = 127
 
 
 class PlatformHelper:
     @staticmethod
-    def execute_cmd(cmd, cwd=None) -> (int, str, str):
+    def execute_cmd(cmd, cwd=None, timeout=None, stdout_callback=None, stderr_callback=None,
+                    env=None, stdin_text=None) -> (int, str, str):
         """
-        :param cmd: Command to be executed
+        Executes the command and reads its stdout and stderr as they are written, so the lines are reported live and
+        only the lines which are not passed to a callback are kept in memory.
+        :param cmd: Command to be executed, a string is executed via shell, a list is executed directly
         :param cwd: working directory for the command
+        :param timeout: time in seconds after which the command is killed, None to wait forever
+        :param stdout_callback: if not None, called with every non-empty stdout line as soon as it is read, the
+        returned stdout is then empty
+        :param stderr_callback: if not None, called with every non-empty stderr line as soon as it is read, the
+        returned stderr is then empty
+        :param env: if not None, environment variables which are set for the command on top of the current ones
+        :param stdin_text: if not None, written to the stdin of the command, e.g. the answers to its prompts,
+        otherwise the command gets an empty stdin
         :return: (returncode, stdout, stderr)
         """
-        if cwd:
-            print_verbose('Executing command: \"%s\" using working directory: \"%s\"' % (cmd, cwd))
+        # The cached commands never run a subprocess, subprocess is slow to import.
+        import subprocess
+        cmd_env = os.environ.copy()
+        if env:
+            cmd_env.update(env)
+        with profile_span(_get_span_name(cmd), 'subprocess', argv=cmd) as span:
+            if cwd:
+                print_verbose('Executing command: \"%s\" using working directory: \"%s\"' % (cmd, cwd))
+            else:
+                print_verbose('Executing command: \"%s\"' % cmd)
+            if os.name == 'nt':
+                group_args = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+            else:
+                group_args = {'start_new_session': True}
+            stdin = subprocess.DEVNULL if stdin_text is None else subprocess.PIPE
+            try:
+                # In a process group of its own, so that the children of the command are killed along with it.
+                process = subprocess.Popen(
+                    cmd, shell=isinstance(cmd, str), stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    env=cmd_env, cwd=cwd, **group_args)
+            except OSError as e:
+                # Same as the return code of the shell when the command is not found.
+                print_verbose('Failed to execute \"%s\": %s' % (cmd, e))
+                span.args['exit_code'] = _COMMAND_NOT_FOUND_RETURN_CODE
+                return _COMMAND_NOT_FOUND_RETURN_CODE, '', str(e)
+
+            stdout_reader = _LineReader(stdout_callback)
+            stderr_reader = _LineReader(stderr_callback)
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            timed_out = False
+            stdin_data = stdin_text.encode('utf-8') if stdin_text is not None else None
+            try:
+                if os.name == 'nt':
+                    # Pipes can't be polled on Windows.
+                    try:
+                        stdout_data, stderr_data = process.communicate(input=stdin_data, timeout=timeout)
+                    except subprocess.TimeoutExpired:
+                        _kill_process_group(process)
+                        stdout_data, stderr_data = process.communicate()
+                        timed_out = True
+                    stdout_reader.feed(stdout_data)
+                    stderr_reader.feed(stderr_data)
+                else:
+                    if stdin_data is not None:
+                        _write_stdin(process, stdin_data)
+                    timed_out = PlatformHelper._read_pipes(
+                        process, {process.stdout: stdout_reader, process.stderr: stderr_reader}, deadline)
+                stdout_reader.close()
+                stderr_reader.close()
+                span.child_cpu_time = PlatformHelper._wait(process)
+            except BaseException:
+                # e.g. Ctrl+C, which does not reach the process group of the command.
+                _kill_process_group(process)
+                raise
+            span.args.update({'exit_code': process.returncode, 'stdout_bytes': stdout_reader.num_bytes,
+                              'stderr_bytes': stderr_reader.num_bytes, 'timed_out': timed_out})
+            if timed_out:
+                print_verbose('Command \"%s\" timed out after %s seconds' % (cmd, timeout))
+            return process.returncode, stdout_reader.get_output(), stderr_reader.get_output()
+
+    @staticmethod
+    def _read_pipes(process, readers, deadline) -> bool:
+        """
+        Reads all the pipes till they are closed, without deadlocking on either of them being full.
+        :return: True if the deadline expired and the process was killed
+        """
+        import selectors
+        with selectors.DefaultSelector() as selector:
+            for (pipe, reader) in readers.items():
+                selector.register(pipe, selectors.EVENT_READ, reader)
+            while selector.get_map():
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        _kill_process_group(process)
+                        for pipe in readers:
+                            pipe.close()
+                        return True
+                for (key, _) in selector.select(remaining):
+                    data = os.read(key.fd, _READ_CHUNK_SIZE)
+                    if data:
+                        key.data.feed(data)
+                    else:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+        return False
+
+    @staticmethod
+    def _wait(process) -> Optional[float]:
+        """
+        Waits for the process to exit, the CPU time of the process is only collected when profiling.
+        :return: CPU time of the process and its waited-for children in seconds, None if it is not known
+        """
+        if not is_profiling() or not hasattr(os, 'wait4'):
+            process.wait()
+            return None
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            process.wait()
+            return None
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
         else:
-            print_verbose('Executing command: \"%s\"' % cmd)
-        process = subprocess.Popen(
-            cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=os.environ.copy(), cwd=cwd)
-
-        stdout = ''
-        stderr = ''
-
-        # Disabled for now, since we lose stdout data due to this indeterministically.
-        # while process.poll() is None:
-        #     line1 = process.stdout.readline()
-        #     line1 = line1.decode('utf-8').strip()
-        #     if line1:
-        #         stdout += (line1 + '\n')
-        #         print_verbose(line1)
-
-        leftover_stdout, leftover_stderr = process.communicate()
-        leftover_stdout = leftover_stdout.decode('utf-8').strip()
-        leftover_stderr = leftover_stderr.decode('utf-8').strip()
-        for line in leftover_stdout.split('\n'):
-            line = line.strip()
-            if line:
-                print_verbose(line)
-                stdout += (line + '\n')
-
-        for line in leftover_stderr.split('\n'):
-            line = line.strip()
-            if line:
-                print_verbose(line)
-                stderr += (line + '\n')
-
-        return process.returncode, stdout, stderr
+            process.returncode = os.WEXITSTATUS(status)
+        return rusage.ru_utime + rusage.ru_stime
 
     @staticmethod
     def on_linux():
-        return platform.system() == 'Linux'
+        return sys.platform.startswith('linux')
 
     @staticmethod
     def on_mac():
-        return platform.system() == 'Darwin'
+        return sys.platform == 'darwin'
 
     @staticmethod
     def is_64bit_architecture():
-        return platform.architecture()[0] == '64bit'
+        # Same as platform.architecture(), without importing the platform module.
+        return sys.maxsize > 2 ** 32
+
+
+def _write_stdin(process, data) -> None:
+    """
+    Writes all the data at once, it is only ever a few answers to the prompts, so it fits in the pipe buffer.
+    """
+    try:
+        process.stdin.write(data)
+        process.stdin.close()
+    except OSError as e:
+        # The command exited without reading all of its input.
+        print_verbose('Failed to write to the stdin of the command: %s' % e)
+
+
+def _kill_process_group(process) -> None:
+    """
+    Kills the process and its children, e.g. the JVM started by the sdkmanager script.
+    """
+    if process.poll() is not None:
+        return
+    if os.name == 'nt':
+        import subprocess
+        subprocess.call(['taskkill', '/F', '/T', '/PID', str(process.pid)], stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL)
+        return
+    import signal
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError as e:
+        print_verbose('Failed to kill the process group %d: %s' % (process.pid, e))
+        process.kill()
+
+
+def _get_span_name(cmd) -> str:
+    if isinstance(cmd, str):
+        return cmd
+    return ' '.join([os.path.basename(cmd[0])] + list(cmd[1:]))
+
+
+class _LineReader:
+    """
+    Splits the bytes read from a pipe into lines, ended by "\n" or by the "\r" of a redrawn progress bar, and collects
+    the non-empty lines unless they are passed to a callback.
+    """
+
+    def __init__(self, callback) -> None:
+        self._callback = callback
+        # The partial last line.
+        self._buffer = bytearray()
+        self._lines = []
+        self.num_bytes = 0
+
+    def feed(self, data) -> None:
+        self.num_bytes += len(data)
+        # Only the new bytes are searched for the line ends.
+        position = len(self._buffer)
+        self._buffer += data
+        line_start = 0
+        newline = self._buffer.find(b'\n', position)
+        carriage_return = self._buffer.find(b'\r', position)
+        while newline != -1 or carriage_return != -1:
+            if carriage_return == -1 or newline != -1 and newline < carriage_return:
+                end = newline
+                newline = self._buffer.find(b'\n', end + 1)
+            else:
+                end = carriage_return
+                carriage_return = self._buffer.find(b'\r', end + 1)
+            self._add_line(self._buffer[line_start:end])
+            line_start = end + 1
+        del self._buffer[:line_start]
+
+    def close(self) -> None:
+        if self._buffer:
+            self._add_line(self._buffer)
+            self._buffer = bytearray()
+
+    def get_output(self) -> str:
+        """
+        :return: the lines which were not passed to the callback
+        """
+        return ''.join(self._lines)
+
+    def _add_line(self, line) -> None:
+        line = line.decode('utf-8', errors='replace').strip()
+        if not line:
+            return
+        print_verbose(line)
+        if self._callback is not None:
+            self._callback(line)
+        else:
+            self._lines.append(line + '\n')
@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_profiling = False
+_spans = []
+_spans_lock = threading.Lock()
+# Chrome trace timestamps are relative to this.
+_start_time = time.perf_counter()
+_MAX_NAME_LENGTH = 60
+
+
+def set_profiling(enabled):
+    global _profiling
+    _profiling = enabled
+
+
+def is_profiling():
+    return _profiling
+
+
+class Span:
+    """
+    A timed part of the command, e.g. a subprocess, a parsing step or a doctor check.
+    """
+    __slots__ = ('name', 'category', 'start', 'duration', 'cpu_time', 'child_cpu_time', 'thread_id', 'thread_name',
+                 'args')
+
+    def __init__(self, name, category, args) -> None:
+        self.name = name
+        self.category = category
+        self.start = 0.0
+        self.duration = 0.0
+        # CPU time of the thread which ran the span.
+        self.cpu_time = 0.0
+        # CPU time of the child process for subprocess spans, None if it is not known.
+        self.child_cpu_time = None
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+        # Details shown in the trace, e.g. the argv and the exit code of a subprocess.
+        self.args = args
+
+
+@contextmanager
+def profile_span(name, category, **args):
+    """
+    Records the wall time and the CPU time of the block when profiling is enabled.
+    The span is yielded so that the block can add details to span.args.
+    """
+    span = Span(name, category, args)
+    if not _profiling:
+        yield span
+        return
+    span.start = time.perf_counter()
+    start_cpu_time = time.thread_time()
+    try:
+        yield span
+    finally:
+        span.duration = time.perf_counter() - span.start
+        span.cpu_time = time.thread_time() - start_cpu_time
+        with _spans_lock:
+            _spans.append(span)
+
+
+def get_spans() -> [Span]:
+    with _spans_lock:
+        return sorted(_spans, key=lambda span: span.start)
+
+
+def print_profile_summary():
+    """
+    Prints the total time spent in each kind of span to stderr, so that it does not mix with the output of the
+    command.
+    """
+    totals = {}
+    for span in get_spans():
+        key = (span.category, span.name)
+        count, wall_time, cpu_time = totals.get(key, (0, 0.0, 0.0))
+        totals[key] = (count + 1, wall_time + span.duration,
+                       cpu_time + span.cpu_time + (span.child_cpu_time or 0.0))
+    lines = ['', 'Profile:', '%-10s %-*s %5s %9s %9s' % ('Category', _MAX_NAME_LENGTH, 'Name', 'Count', 'Wall (s)',
+                                                           'CPU (s)')]
+    for ((category, name), (count, wall_time, cpu_time)) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        if len(name) > _MAX_NAME_LENGTH:
+            name = name[:_MAX_NAME_LENGTH - 3] + '...'
+        lines.append('%-10s %-*s %5d %9.3f %9.3f' % (category, _MAX_NAME_LENGTH, name, count, wall_time, cpu_time))
+    print('\n'.join(lines), file=sys.stderr)
+
+
+def write_chrome_trace(file_path):
+    """
+    Writes the spans in the Chrome trace event format, it can be opened in chrome://tracing or ui.perfetto.dev.
+    """
+    pid = os.getpid()
+    events = []
+    thread_names = {}
+    for span in get_spans():
+        thread_names[span.thread_id] = span.thread_name
+        args = dict(span.args)
+        args['cpu_ms'] = round(span.cpu_time * 1000, 3)
+        if span.child_cpu_time is not None:
+            args['child_cpu_ms'] = round(span.child_cpu_time * 1000, 3)
+        events.append({
+            'name': span.name,
+            'cat': span.category,
+            'ph': 'X',
+            'ts': round((span.start - _start_time) * 1000000, 1),
+            'dur': round(span.duration * 1000000, 1),
+            'pid': pid,
+            'tid': span.thread_id,
+            'args': args,
+        })
+    for (thread_id, thread_name) in thread_names.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                       'args': {'name': thread_name}})
+    with open(file_path, 'w', encoding='utf-8') as fh:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fh)
@@ -0,0 +1,401 @@
+import re
+from typing import Optional
+
+# Attributes of a package in the output of "sdkmanager --verbose --list".
+# The names of the version attributes in "Available Updates" section differ across sdkmanager versions.
+_ATTRIBUTE_REGEX = re.compile(
+    r'^(Description|Version|Installed Location|Installed Version|Local Version|Available Version|Remote Version|'
+    r'Dependencies):\s*(.*)$')
+# A package name is always followed by one of these attributes.
+_FIRST_ATTRIBUTES = ('Description', 'Installed Version', 'Local Version')
+# Revisions look like "28.0.3", "1" or "30.0.0 rc1", the preview is written as "-rc1" by some packages.
+# Compiled by re on the first use, the commands which don't compare the revisions don't pay for it.
+_REVISION_PATTERN = r'^(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:[\s-]*rc(\d+))?'
+
+
+class SdkPackage:
+    """
+    A single package of the Android SDK, e.g. "build-tools;28.0.3".
+    """
+    __slots__ = ('path', 'description', 'version', 'available_version', 'location', 'installed', 'available',
+                 'obsolete', 'update_version')
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.description = None
+        # Installed version for the installed packages, available version for the rest.
+        self.version = None
+        self.available_version = None
+        self.location = None
+        self.installed = False
+        self.available = False
+        self.obsolete = False
+        # Version that the installed package can be updated to, None if it is already up-to-date.
+        self.update_version = None
+
+    def is_updatable(self) -> bool:
+        return self.update_version is not None
+
+    def to_dict(self) -> dict:
+        return {
+            'path': self.path,
+            'description': self.description,
+            'version': self.version,
+            'available_version': self.available_version,
+            'location': self.location,
+            'installed': self.installed,
+            'available': self.available,
+            'obsolete': self.obsolete,
+            'update_version': self.update_version,
+        }
+
+    def to_list(self) -> list:
+        """
+        :return: the attributes in the order of __slots__, a more compact form than to_dict for the caches
+        """
+        return [getattr(self, name) for name in SdkPackage.__slots__]
+
+    @staticmethod
+    def from_list(values) -> 'SdkPackage':
+        package = SdkPackage(None)
+        (package.path, package.description, package.version, package.available_version, package.location,
+         package.installed, package.available, package.obsolete, package.update_version) = values
+        return package
+
+    def __repr__(self) -> str:
+        return 'SdkPackage(%s, %s)' % (self.path, self.version)
+
+
+class SdkCatalog:
+    """
+    All the installed and available packages, parsed from the output of
+    "sdkmanager --verbose --list --include_obsolete".
+    """
+
+    def __init__(self, packages=None, sections=None) -> None:
+        # Package path -> SdkPackage, in the order of appearance in the listing.
+        self._packages = packages if packages is not None else {}
+        # List of (section name, [package path]).
+        self._sections = sections if sections is not None else []
+        self._index = None
+
+    @staticmethod
+    def parse(sdk_manager_output) -> 'SdkCatalog':
+        parser = SdkCatalogParser()
+        for line in sdk_manager_output.split('\n'):
+            parser.feed_line(line)
+        return parser.finish()
+
+    def get(self, path) -> Optional[SdkPackage]:
+        return self._packages.get(path, None)
+
+    def __contains__(self, path) -> bool:
+        return path in self._packages
+
+    def __len__(self) -> int:
+        return len(self._packages)
+
+    def get_packages(self, prefix=None) -> [SdkPackage]:
+        """
+        :param prefix: if not None, only the packages whose path starts with this prefix are returned
+        :return: packages in the order of their appearance in the listing
+        """
+        if prefix is None:
+            return list(self._packages.values())
+        return [package for package in self._packages.values() if package.path.startswith(prefix)]
+
+    def get_installed_packages(self) -> [SdkPackage]:
+        return sorted((package for package in self._packages.values() if package.installed),
+                      key=lambda package: package.path)
+
+    def get_updates(self, installed_packages) -> [(SdkPackage, str)]:
+        """
+        :param installed_packages: packages with their installed version, e.g. found by scanning the SDK root
+        :return: (installed package, newer version) for every installed package which has a newer revision available
+        """
+        updates = []
+        for installed_package in installed_packages:
+            package = self._packages.get(installed_package.path, None)
+            if package is None:
+                continue
+            new_version = package.update_version or package.available_version
+            if not new_version or not installed_package.version:
+                continue
+            new_revision = _get_revision_key(new_version)
+            installed_revision = _get_revision_key(installed_package.version)
+            if new_revision is None or installed_revision is None:
+                # Only trust sdkmanager for the revisions which can't be compared.
+                if package.update_version is not None and package.update_version != installed_package.version:
+                    updates.append((installed_package, package.update_version))
+            elif new_revision > installed_revision:
+                updates.append((installed_package, new_version))
+        return updates
+
+    def get_index(self) -> 'SdkPackageIndex':
+        """
+        :return: index of the packages, built on the first call
+        """
+        if self._index is None:
+            self._index = SdkPackageIndex(self._packages.values())
+        return self._index
+
+    def get_sections(self) -> [(str, [SdkPackage])]:
+        return [(name, [self._packages[path] for path in paths]) for (name, paths) in self._sections]
+
+    def to_dict(self) -> dict:
+        """
+        :return: JSON serializable form of the catalog, loading it with from_dict is much faster than parsing
+        """
+        return {
+            'packages': [package.to_list() for package in self._packages.values()],
+            'sections': [[name, paths] for (name, paths) in self._sections],
+        }
+
+    @staticmethod
+    def from_dict(values) -> 'SdkCatalog':
+        packages = {}
+        for package_values in values['packages']:
+            package = SdkPackage.from_list(package_values)
+            packages[package.path] = package
+        return SdkCatalog(packages, [(name, paths) for (name, paths) in values['sections']])
+
+    def add_section(self, name) -> None:
+        self._sections.append((name, []))
+
+    def add_package(self, path) -> SdkPackage:
+        """
+        Adds the package to the last section, a package can be listed in multiple sections.
+        :return: the new package or the existing package with the same path
+        """
+        package = self._packages.get(path, None)
+        if package is None:
+            package = SdkPackage(path)
+            self._packages[path] = package
+            self._index = None
+        self._sections[-1][1].append(path)
+        return package
+
+
+class SdkPackageIndex:
+    """
+    The build tools ordered by their revision, the platforms ordered by their API level and the system images ordered
+    by their API level, tag and ABI, so that the latest build tools and the system images in a range of API levels are
+    found by a binary search instead of scanning all the packages.
+    """
+
+    def __init__(self, packages) -> None:
+        self._packages = list(packages)
+        # Each kind of packages is sorted on its first use, most commands only need one of them.
+        self._build_tools = None
+        self._stable_build_tools = None
+        self._platforms = None
+        self._system_image_keys = None
+        self._system_images = None
+
+    def _index_build_tools(self) -> None:
+        if self._build_tools is not None:
+            return
+        build_tools = []
+        for package in self._packages:
+            if not package.path.startswith('build-tools;'):
+                continue
+            parts = package.path.split(';')
+            if len(parts) == 2:
+                # e.g. build-tools;30.0.0-rc4, the version of some packages is missing from the listing.
+                revision = _get_revision_key(parts[1]) or _get_revision_key(package.version or '')
+                if revision is not None:
+                    build_tools.append((revision, package))
+        build_tools.sort(key=lambda item: (item[0], item[1].path))
+        # Previews are older than the release of the same revision but can be newer than the latest release.
+        self._stable_build_tools = [package for (revision, package) in build_tools if not _is_preview(revision)]
+        # Set last, the daemon can index the same kind of packages in two threads at once.
+        self._build_tools = [package for (_, package) in build_tools]
+
+    def _index_platforms_and_system_images(self) -> None:
+        if self._platforms is not None:
+            return
+        platforms = []
+        system_images = []
+        for package in self._packages:
+            parts = package.path.split(';')
+            if parts[0] == 'platforms' and len(parts) == 2:
+                api_level = parts[1][len('android-'):]
+                if parts[1].startswith('android-') and api_level.isdigit():
+                    platforms.append((int(api_level), package))
+            elif parts[0] == 'system-images' and len(parts) == 4:
+                # e.g. system-images;android-28;google_apis;x86, previews like android-R have no API level.
+                api_level = parts[1][len('android-'):]
+                if parts[1].startswith('android-') and api_level.isdigit():
+                    system_images.append(((int(api_level), parts[2], parts[3]), package))
+        platforms.sort(key=lambda item: item[0])
+        system_images.sort(key=lambda item: item[0])
+        self._system_image_keys = [key for (key, _) in system_images]
+        self._system_images = [package for (_, package) in system_images]
+        self._platforms = [package for (_, package) in platforms]
+
+    def get_build_tools(self) -> [SdkPackage]:
+        """
+        :return: build tools sorted by revision, the latest come last
+        """
+        self._index_build_tools()
+        return list(self._build_tools)
+
+    def get_latest_build_tools(self, stable=True) -> Optional[SdkPackage]:
+        """
+        :param stable: skip the previews
+        """
+        self._index_build_tools()
+        build_tools = self._stable_build_tools if stable else self._build_tools
+        return build_tools[-1] if build_tools else None
+
+    def get_system_images(self, min_api_level=None, max_api_level=None, tag=None,
+                          abi_prefix=None) -> [(SdkPackage, int, str, str)]:
+        """
+        :param tag: e.g. "google_apis", None matches all of them
+        :param abi_prefix: e.g. "x86" which matches "x86" and "x86_64", None matches all of them
+        :return: (package, API level, tag, ABI) of the system images in the range of API levels, both inclusive,
+        sorted by API level, tag and ABI
+        """
+        import bisect
+        self._index_platforms_and_system_images()
+        start = 0 if min_api_level is None else bisect.bisect_left(self._system_image_keys, (min_api_level,))
+        end = len(self._system_image_keys) if max_api_level is None else \
+            bisect.bisect_left(self._system_image_keys, (max_api_level + 1,))
+        system_images = []
+        for i in range(start, end):
+            api_level, image_tag, abi = self._system_image_keys[i]
+            if tag is not None and image_tag != tag:
+                continue
+            if abi_prefix is not None and not abi.startswith(abi_prefix):
+                continue
+            system_images.append((self._system_images[i], api_level, image_tag, abi))
+        return system_images
+
+    def get_outdated_packages(self, keep_latest) -> [SdkPackage]:
+        """
+        :param keep_latest: number of the latest packages of every kind which are not outdated
+        :return: the build tools and the platforms except the keep_latest latest ones, and the system images except
+        the keep_latest latest API levels of every tag and ABI. The previews of the platforms and the system images,
+        which have no API level, are never outdated.
+        """
+        self._index_build_tools()
+        self._index_platforms_and_system_images()
+        outdated_packages = self._build_tools[:max(len(self._build_tools) - keep_latest, 0)]
+        outdated_packages.extend(self._platforms[:max(len(self._platforms) - keep_latest, 0)])
+        # Newest first, so that the first keep_latest images of every tag and ABI are kept.
+        num_kept_images = {}
+        for i in reversed(range(len(self._system_images))):
+            _, tag, abi = self._system_image_keys[i]
+            num_kept_images[(tag, abi)] = num_kept_images.get((tag, abi), 0) + 1
+            if num_kept_images[(tag, abi)] > keep_latest:
+                outdated_packages.append(self._system_images[i])
+        return outdated_packages
+
+
+def _get_revision_key(version) -> Optional[tuple]:
+    """
+    :return: key which orders the revisions, a preview is older than the release of the same revision. None if the
+    version is not a revision.
+    """
+    result = re.match(_REVISION_PATTERN, version.strip())
+    if result is None:
+        return None
+    major, minor, micro, preview = result.groups()
+    if preview is None:
+        return int(major), int(minor or 0), int(micro or 0), 1, 0
+    return int(major), int(minor or 0), int(micro or 0), 0, int(preview)
+
+
+def _is_preview(revision_key) -> bool:
+    return revision_key[3] == 0
+
+
+class SdkCatalogParser:
+    """
+    Incremental parser for the output of "sdkmanager --verbose --list", the lines can be fed as they are read.
+    A package name is recognized by the attribute on the line right after it, so the parser does not depend on the
+    indentation or the empty lines in the output.
+    """
+
+    def __init__(self) -> None:
+        self._catalog = SdkCatalog()
+        self._section = None
+        self._installed = False
+        self._obsolete = False
+        self._updates = False
+        self._package = None
+        self._pending_line = None
+
+    def feed_line(self, line) -> None:
+        # Progress bars are redrawn with carriage returns, only the last redraw matters.
+        line = line.rsplit('\r', 1)[-1].strip()
+        if not line:
+            return
+        if self._pending_line is not None:
+            self._process_line(self._pending_line, line)
+        self._pending_line = line
+
+    def finish(self) -> SdkCatalog:
+        if self._pending_line is not None:
+            self._process_line(self._pending_line, None)
+            self._pending_line = None
+        return self._catalog
+
+    def _process_line(self, line, next_line) -> None:
+        if line.startswith('---'):
+            return
+        if next_line is not None and next_line.startswith('---') and line.endswith(':'):
+            self._start_section(line[:-1])
+            return
+
+        match = _ATTRIBUTE_REGEX.match(line)
+        if match is not None:
+            if self._package is not None:
+                self._set_attribute(match.group(1), match.group(2).strip())
+            return
+
+        next_match = _ATTRIBUTE_REGEX.match(next_line) if next_line is not None else None
+        if self._section is not None and next_match is not None and next_match.group(1) in _FIRST_ATTRIBUTES:
+            self._start_package(line)
+        # Everything else is a dependency, an info line or a progress bar.
+
+    def _start_section(self, name) -> None:
+        lower_name = name.lower()
+        self._section = name
+        self._installed = lower_name.startswith('installed')
+        self._obsolete = lower_name.find('obsolete') != -1
+        self._updates = lower_name.find('updates') != -1
+        self._package = None
+        self._catalog.add_section(name)
+
+    def _start_package(self, line) -> None:
+        # Non-verbose output is a table, the package path is the first column.
+        package = self._catalog.add_package(line.split('|', 1)[0].strip())
+        if self._updates:
+            package.installed = True
+        elif self._installed:
+            package.installed = True
+            package.obsolete = package.obsolete or self._obsolete
+        else:
+            package.available = True
+            package.obsolete = package.obsolete or self._obsolete
+        self._package = package
+
+    def _set_attribute(self, name, value) -> None:
+        package = self._package
+        if name == 'Description':
+            package.description = value
+        elif name == 'Version':
+            if self._installed:
+                package.version = value
+            else:
+                package.available_version = value
+                if not package.installed:
+                    package.version = value
+        elif name == 'Installed Location':
+            package.location = value
+        elif name in ('Installed Version', 'Local Version'):
+            package.version = value
+        elif name in ('Available Version', 'Remote Version'):
+            package.update_version = value
+            package.available_version = value
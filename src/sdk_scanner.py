@@ -0,0 +1,151 @@
+import os
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+try:
+    # This works when the code is executed directly.
+    from output_helper import print_verbose
+    from sdk_catalog import SdkPackage
+    from profile_helper import profile_span
+except ImportError:
+    # This fails when the code is executed directly and not as a part of python package installation,
+    # I definitely need a better way to handle this.
+    from androide.output_helper import print_verbose
+    from androide.sdk_catalog import SdkPackage
+    from androide.profile_helper import profile_span
+
+_PACKAGE_XML = 'package.xml'
+_SOURCE_PROPERTIES = 'source.properties'
+# system-images/android-28/google_apis/x86 is the deepest package directory in the SDK.
+_MAX_DEPTH = 4
+# Directories in the SDK root which never contain packages.
+_SKIPPED_DIRECTORIES = ('licenses', 'temp', '.temp', '.downloadIntermediates')
+_MAX_WORKERS = 8
+
+
+class SdkScanner:
+    """
+    Finds the installed packages by reading the package.xml or source.properties files in the SDK root,
+    this is what sdkmanager does as well but without starting a JVM or fetching the remote repositories.
+    """
+
+    @staticmethod
+    def get_installed_packages(sdk_root) -> [SdkPackage]:
+        """
+        :return: installed packages sorted by path, empty list if the SDK root does not exist
+        """
+        if not sdk_root or not os.path.isdir(sdk_root):
+            return []
+        with profile_span('scan sdk root', 'parse') as span:
+            package_files = SdkScanner._find_package_files(sdk_root)
+            print_verbose('Found %d package files in \"%s\"' % (len(package_files), sdk_root))
+            with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
+                packages = executor.map(lambda package_file: SdkScanner._parse_package_file(sdk_root, package_file),
+                                        package_files)
+                packages = [package for package in packages if package is not None]
+            span.args['packages'] = len(packages)
+        return sorted(packages, key=lambda package: package.path)
+
+    @staticmethod
+    def _find_package_files(sdk_root) -> [str]:
+        package_files = []
+        directories = [(sdk_root, 0)]
+        while directories:
+            directory, depth = directories.pop()
+            sub_directories = []
+            package_file = None
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.name == _PACKAGE_XML:
+                            package_file = entry.path
+                        elif entry.name == _SOURCE_PROPERTIES and package_file is None:
+                            package_file = entry.path
+                        elif depth < _MAX_DEPTH and entry.name not in _SKIPPED_DIRECTORIES and \
+                                entry.is_dir(follow_symlinks=False):
+                            sub_directories.append(entry.path)
+            except OSError as e:
+                print_verbose('Failed to scan \"%s\": %s' % (directory, e))
+                continue
+            # Packages are never nested inside other packages.
+            if package_file is not None and directory != sdk_root:
+                package_files.append(package_file)
+            else:
+                directories.extend((sub_directory, depth + 1) for sub_directory in sub_directories)
+        return package_files
+
+    @staticmethod
+    def _parse_package_file(sdk_root, package_file) -> Optional[SdkPackage]:
+        location = os.path.dirname(package_file)
+        try:
+            if os.path.basename(package_file) == _PACKAGE_XML:
+                package = SdkScanner._parse_package_xml(package_file)
+            else:
+                package = SdkScanner._parse_source_properties(package_file)
+        except (OSError, ElementTree.ParseError) as e:
+            print_verbose('Failed to parse \"%s\": %s' % (package_file, e))
+            return None
+        if package is None:
+            return None
+        if not package.path:
+            # Old packages don't record their path, it is same as their location relative to the SDK root.
+            package.path = os.path.relpath(location, sdk_root).replace(os.sep, ';')
+        package.location = location
+        package.installed = True
+        return package
+
+    @staticmethod
+    def _parse_package_xml(package_file) -> Optional[SdkPackage]:
+        # <localPackage path="build-tools;28.0.3" obsolete="false">
+        #   <revision><major>28</major><minor>0</minor><micro>3</micro></revision>
+        #   <display-name>Android SDK Build-Tools 28.0.3</display-name>
+        root = ElementTree.parse(package_file).getroot()
+        for element in root.iter():
+            if get_local_name(element.tag) != 'localPackage':
+                continue
+            package = SdkPackage(element.get('path'))
+            package.obsolete = element.get('obsolete') == 'true'
+            for child in element:
+                name = get_local_name(child.tag)
+                if name == 'revision':
+                    package.version = get_revision(child)
+                elif name == 'display-name':
+                    package.description = (child.text or '').strip()
+            return package
+        return None
+
+    @staticmethod
+    def _parse_source_properties(package_file) -> SdkPackage:
+        properties = {}
+        with open(package_file, 'r', encoding='utf-8', errors='replace') as fh:
+            for line in fh:
+                line = line.strip()
+                if not line or line.startswith('#') or line.find('=') == -1:
+                    continue
+                key, value = line.split('=', 1)
+                # Properties files escape ':' and '=' in the values.
+                properties[key.strip()] = value.strip().replace('\\:', ':').replace('\\=', '=')
+        package = SdkPackage(properties.get('Pkg.Path', None))
+        package.version = properties.get('Pkg.Revision', None)
+        package.description = properties.get('Pkg.Desc', None)
+        package.obsolete = properties.get('Pkg.Obsolete', 'false') == 'true'
+        return package
+
+
+def get_local_name(tag) -> str:
+    """
+    :return: the tag of an XML element without its namespace, if any
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def get_revision(element) -> str:
+    """
+    :return: the version in a <revision> element of a package XML, e.g. "28.0.3" or "30.0.0 rc1"
+    """
+    components = {get_local_name(child.tag): (child.text or '').strip() for child in element}
+    version = '.'.join(components[name] for name in ('major', 'minor', 'micro') if components.get(name))
+    if components.get('preview'):
+        version = '%s rc%s' % (version, components['preview'])
+    return version
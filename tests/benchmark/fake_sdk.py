@@ -0,0 +1,334 @@
+import hashlib
+import os
+import stat
+
+# Installed and available package lists which are large enough to show the cost of parsing and scanning.
+_API_LEVELS = range(10, 35)
+_SYSTEM_IMAGE_TAGS = ('default', 'google_apis', 'google_apis_playstore', 'android-tv', 'android-wear')
+_SYSTEM_IMAGE_ABIS = ('x86', 'x86_64', 'armeabi-v7a', 'arm64-v8a')
+_BUILD_TOOLS_VERSIONS = ['%d.0.%d' % (major, micro) for major in range(17, 35) for micro in range(4)]
+# Always installed, "install basic packages" and "create avd" then run without sdkmanager.
+_BASIC_PACKAGES = [
+    'build-tools;34.0.3',
+    'cmdline-tools;latest',
+    'emulator',
+    'tools',
+    'platform-tools',
+    'extras;android;m2repository',
+    'extras;google;m2repository',
+    'patcher;v4',
+    'platforms;android-28',
+    'sources;android-28',
+    'system-images;android-28;default;x86',
+    'system-images;android-28;google_apis;x86_64',
+    'system-images;android-28;google_apis_playstore;x86_64',
+]
+# By default, every n-th of the other packages is installed as well.
+_INSTALLED_PACKAGE_INTERVAL = 5
+# Every n-th of the installed packages has an update.
+_UPDATABLE_PACKAGE_INTERVAL = 7
+_JAVA_VERSION = '1.8.0_292'
+_AVD_FILE_SIZE = 64 * 1024
+_AVD_FILES = ('userdata-qemu.img', 'cache.img', 'sdcard.img')
+# (repository XML, package, dependencies) of the stand-in remote repository, the system images are in a repository of
+# their own, listed by the add-ons list, like in the Google repository.
+_REPOSITORY_PACKAGES = [
+    ('repository2-3.xml', 'build-tools;34.0.3', []),
+    ('repository2-3.xml', 'emulator', ['patcher;v4']),
+    ('repository2-3.xml', 'patcher;v4', []),
+    ('repository2-3.xml', 'platforms;android-28', []),
+    ('sys-img/google_apis/sys-img2-3.xml', 'system-images;android-28;google_apis;x86_64', ['emulator']),
+]
+_REPOSITORY_ARCHIVE_SIZE = 1024 * 1024
+
+_REMOTE_PACKAGE_XML_TEMPLATE = (
+    '<remotePackage path="%s"><revision><major>%s</major><minor>%s</minor><micro>%s</micro></revision>'
+    '<display-name>%s</display-name><dependencies>%s</dependencies><archives><archive><complete>'
+    '<size>%d</size><checksum type="sha1">%s</checksum><url>%s</url></complete></archive></archives>'
+    '</remotePackage>')
+_LICENSE_TEXT = 'license'
+_PACKAGE_XML_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<ns2:repository xmlns:ns2="http://schemas.android.com/repository/android/common/01">'
+    '<license id="android-sdk-license" type="text">' + _LICENSE_TEXT + '</license>'
+    '<localPackage path="%s" obsolete="%s">'
+    '<revision><major>%s</major><minor>%s</minor><micro>%s</micro></revision>'
+    '<display-name>%s</display-name><uses-license ref="android-sdk-license"/>'
+    '</localPackage></ns2:repository>')
+
+# The stubs print the recorded output and log their arguments, one line per call.
+_SDK_MANAGER_STUB = """#!/bin/sh
+echo "sdkmanager $*" >> "%(calls_log)s"
+case "$*" in
+    *--list*) cat "%(listing)s" ;;
+    *--licenses*) echo "All SDK package licenses accepted." ;;
+    *--update*) echo "done" ;;
+    *)
+        # Installs the new revision of the updatable packages, the other packages are left as they are. Only shell
+        # builtins run per package, like sdkmanager runs in a single JVM.
+        parent_dirs=""
+        for package in "$@"; do
+            [ -f "%(updates_dir)s/$package" ] || continue
+            { IFS= read -r package_dir; IFS= read -r package_xml; } < "%(updates_dir)s/$package"
+            printf '%%s' "$package_xml" > "$package_dir/package.xml"
+            parent_dirs="$parent_dirs ${package_dir%%/*}"
+        done
+        # sdkmanager replaces the directory of the package, which changes the mtime of its parent.
+        [ -z "$parent_dirs" ] || touch $parent_dirs
+        echo "[=======================================] 100%% Unzipping..."
+        echo "done" ;;
+esac
+"""
+_AVD_MANAGER_STUB = """#!/bin/sh
+echo "avdmanager $*" >> "%(calls_log)s"
+# avdmanager --verbose create avd --name <name> --package <package>
+cat > /dev/null
+mkdir -p "%(avd_home)s/$5.avd"
+printf 'path=%(avd_home)s/%%s.avd\\ntarget=android-28\\n' "$5" > "%(avd_home)s/$5.ini"
+printf 'image.sysdir.1=%%s/\\n' "$(echo "$7" | tr ';' '/')" > "%(avd_home)s/$5.avd/config.ini"
+"""
+_EMULATOR_STUB = """#!/bin/sh
+echo "emulator $*" >> "%(calls_log)s"
+# The emulator keeps running till the AVD is shut down.
+sleep 1
+"""
+_ADB_STUB = """#!/bin/sh
+echo "adb $*" >> "%(calls_log)s"
+echo 1
+"""
+_JAVA_STUB = """#!/bin/sh
+echo "java $*" >> "%(calls_log)s"
+echo 'openjdk version "%(java_version)s"' >&2
+"""
+
+
+class FakeSdk:
+    """
+    A synthetic Android SDK for the benchmarks. The SDK root, the AVD home, a JDK and the caches are all created
+    under one directory, and sdkmanager, avdmanager, emulator, adb and java are replaced by stubs which print
+    recorded output, so the benchmarks need neither a real SDK nor the network.
+    """
+
+    def __init__(self, root_dir, num_packages, num_avds,
+                 installed_package_interval=_INSTALLED_PACKAGE_INTERVAL) -> None:
+        self.root_dir = root_dir
+        self.sdk_root = os.path.join(root_dir, 'sdk')
+        self.avd_home = os.path.join(root_dir, 'avd')
+        self.java_home = os.path.join(root_dir, 'jdk')
+        self.cache_dir = os.path.join(root_dir, 'cache')
+        self.listing_path = os.path.join(root_dir, 'sdkmanager-list.txt')
+        # Stand-in for the remote repository, for "mirror"
+        self.repository_dir = os.path.join(root_dir, 'repository')
+        self.calls_log = os.path.join(root_dir, 'calls.log')
+        # <package>: the package directory and the package.xml of its update, which the sdkmanager stub installs
+        self.updates_dir = os.path.join(root_dir, 'updates')
+        self.num_packages = num_packages
+        self.num_avds = num_avds
+        self.installed_package_interval = installed_package_interval
+        self.installed_packages = []
+
+    def create(self) -> None:
+        packages = _get_packages(self.num_packages)
+        others = [package for package in packages if package not in _BASIC_PACKAGES]
+        self.installed_packages = sorted(_BASIC_PACKAGES + others[::self.installed_package_interval])
+        for package in self.installed_packages:
+            self._write_package_xml(package)
+        # The license is accepted, like after "sdkmanager --licenses".
+        os.makedirs(os.path.join(self.sdk_root, 'licenses'), exist_ok=True)
+        with open(os.path.join(self.sdk_root, 'licenses', 'android-sdk-license'), 'w', encoding='utf-8') as fh:
+            fh.write('\n%s' % hashlib.sha1(_LICENSE_TEXT.encode('utf-8')).hexdigest())
+        with open(self.listing_path, 'w', encoding='utf-8') as fh:
+            fh.write(self._get_listing(packages))
+        self._write_updates()
+        self._write_repository()
+
+        self._write_stub(os.path.join(self.sdk_root, 'cmdline-tools', 'latest', 'bin', 'sdkmanager'),
+                         _SDK_MANAGER_STUB)
+        self._write_stub(os.path.join(self.sdk_root, 'cmdline-tools', 'latest', 'bin', 'avdmanager'),
+                         _AVD_MANAGER_STUB)
+        self._write_stub(os.path.join(self.sdk_root, 'emulator', 'emulator'), _EMULATOR_STUB)
+        self._write_stub(os.path.join(self.sdk_root, 'platform-tools', 'adb'), _ADB_STUB)
+        self._write_stub(os.path.join(self.java_home, 'bin', 'java'), _JAVA_STUB)
+        with open(os.path.join(self.java_home, 'release'), 'w', encoding='utf-8') as fh:
+            fh.write('JAVA_VERSION="%s"\n' % _JAVA_VERSION)
+
+        for i in range(self.num_avds):
+            self.create_avd('bench_avd_%d' % i)
+
+    def create_avd(self, avd_name) -> None:
+        avd_dir = os.path.join(self.avd_home, avd_name + '.avd')
+        os.makedirs(avd_dir, exist_ok=True)
+        with open(os.path.join(self.avd_home, avd_name + '.ini'), 'w', encoding='utf-8') as fh:
+            fh.write('avd.ini.encoding=UTF-8\npath=%s\ntarget=android-28\n' % avd_dir)
+        with open(os.path.join(avd_dir, 'config.ini'), 'w', encoding='utf-8') as fh:
+            fh.write('abi.type=x86_64\ntag.id=google_apis\nhw.ramSize=1536\n'
+                     'image.sysdir.1=system-images/android-28/google_apis/x86_64/\n')
+        for file_name in _AVD_FILES:
+            with open(os.path.join(avd_dir, file_name), 'wb') as fh:
+                fh.write(b'\0' * _AVD_FILE_SIZE)
+
+    def get_env(self) -> dict:
+        """
+        :return: environment in which androidtool only sees the fake SDK
+        """
+        env = dict(os.environ)
+        for name in ('ANDROID_HOME', 'ANDROID_EMULATOR_HOME', 'ANDROID_SDK_HOME', 'XDG_CACHE_HOME'):
+            env.pop(name, None)
+        env['ANDROID_SDK_ROOT'] = self.sdk_root
+        env['ANDROID_AVD_HOME'] = self.avd_home
+        env['JAVA_HOME'] = self.java_home
+        env['HOME'] = self.root_dir
+        env['XDG_CACHE_HOME'] = self.cache_dir
+        env['PATH'] = os.path.join(self.java_home, 'bin') + os.pathsep + env.get('PATH', '')
+        return env
+
+    def read_calls(self) -> [str]:
+        try:
+            with open(self.calls_log, 'r', encoding='utf-8') as fh:
+                return fh.read().splitlines()
+        except OSError:
+            return []
+
+    def clear_calls(self) -> None:
+        with open(self.calls_log, 'w', encoding='utf-8'):
+            pass
+
+    def _get_listing(self, packages) -> str:
+        """
+        :return: output of "sdkmanager --verbose --list --include_obsolete" for the fake SDK
+        """
+        lines = ['Info: Parsing %s' % os.path.join(self.sdk_root, 'emulator', 'package.xml'),
+                 '[=======================================] 100% Computing updates...',
+                 'Installed packages:',
+                 '--------------------------------------']
+        for package in self.installed_packages:
+            lines.extend([
+                package,
+                '    Description:        %s' % _get_description(package),
+                '    Version:            %s' % _get_version(package),
+                '    Installed Location: %s' % os.path.join(self.sdk_root, *package.split(';')),
+                ''])
+        lines.extend(['Available Packages:', '--------------------------------------'])
+        for package in packages:
+            lines.extend([
+                package,
+                '    Description:        %s' % _get_description(package),
+                '    Version:            %s' % _get_version(package)])
+            if package.startswith('system-images;'):
+                lines.extend([
+                    '    Dependencies:',
+                    '        emulator revision 28.0.23',
+                    '        patcher;v4'])
+            lines.append('')
+        lines.extend(['Available Updates:', '--------------------------------------'])
+        for package in self.installed_packages[::_UPDATABLE_PACKAGE_INTERVAL]:
+            lines.extend([
+                package,
+                '    Installed Version: %s' % _get_version(package),
+                '    Available Version: %s' % _get_update_version(package),
+                ''])
+        lines.append('done')
+        return '\n'.join(lines) + '\n'
+
+    def _write_updates(self) -> None:
+        os.makedirs(self.updates_dir, exist_ok=True)
+        for package in self.installed_packages[::_UPDATABLE_PACKAGE_INTERVAL]:
+            with open(os.path.join(self.updates_dir, package), 'w', encoding='utf-8') as fh:
+                fh.write('%s\n%s' % (os.path.join(self.sdk_root, *package.split(';')),
+                                     _get_package_xml(package, _get_update_version(package))))
+
+    def _write_repository(self) -> None:
+        remote_packages = {}
+        for (xml_path, package, dependencies) in _REPOSITORY_PACKAGES:
+            archive_name = '%s.zip' % package.replace(';', '_')
+            # Unique content for every archive, the mirror stores them by their checksum.
+            archive = package.encode('utf-8').ljust(_REPOSITORY_ARCHIVE_SIZE, b'\0')
+            with open(self._get_repository_path(xml_path, archive_name), 'wb') as fh:
+                fh.write(archive)
+            major, minor, micro = (_get_version(package).split('.') + ['0', '0'])[:3]
+            remote_packages.setdefault(xml_path, []).append(_REMOTE_PACKAGE_XML_TEMPLATE % (
+                package, major, minor, micro, _get_description(package),
+                ''.join('<dependency path="%s"/>' % dependency for dependency in dependencies),
+                len(archive), hashlib.sha1(archive).hexdigest(), archive_name))
+        for (xml_path, packages) in remote_packages.items():
+            with open(self._get_repository_path(xml_path), 'w', encoding='utf-8') as fh:
+                fh.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<sdk:sdk-repository xmlns:sdk="http://schemas.android.com/sdk/android/repo/repository2/03">'
+                         '%s</sdk:sdk-repository>' % ''.join(packages))
+        with open(self._get_repository_path('addons_list-5.xml'), 'w', encoding='utf-8') as fh:
+            fh.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                     '<sdk:sdk-addons-list xmlns:sdk="http://schemas.android.com/sdk/android/addons-list/5">%s'
+                     '</sdk:sdk-addons-list>' % ''.join(
+                         '<site><displayName>%s</displayName><url>%s</url></site>' % (xml_path, xml_path)
+                         for xml_path in remote_packages if xml_path != 'repository2-3.xml'))
+
+    def _get_repository_path(self, xml_path, file_name=None) -> str:
+        """
+        :return: path of the XML in the stand-in repository or of file_name next to the XML
+        """
+        path = os.path.join(self.repository_dir, *xml_path.split('/'))
+        if file_name is not None:
+            path = os.path.join(os.path.dirname(path), file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _write_package_xml(self, package) -> None:
+        package_dir = os.path.join(self.sdk_root, *package.split(';'))
+        os.makedirs(package_dir, exist_ok=True)
+        with open(os.path.join(package_dir, 'package.xml'), 'w', encoding='utf-8') as fh:
+            fh.write(_get_package_xml(package, _get_version(package)))
+
+    def _write_stub(self, path, template) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as fh:
+            fh.write(template % {
+                'calls_log': self.calls_log,
+                'listing': self.listing_path,
+                'avd_home': self.avd_home,
+                'updates_dir': self.updates_dir,
+                'java_version': _JAVA_VERSION,
+            })
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def _get_packages(num_packages) -> [str]:
+    """
+    :return: num_packages package paths, real package names first and made up extras after them
+    """
+    packages = list(_BASIC_PACKAGES)
+    packages.extend('build-tools;%s' % version for version in _BUILD_TOOLS_VERSIONS)
+    for api_level in _API_LEVELS:
+        packages.append('platforms;android-%d' % api_level)
+        packages.append('sources;android-%d' % api_level)
+        packages.append('add-ons;addon-google_apis-google-%d' % api_level)
+        for tag in _SYSTEM_IMAGE_TAGS:
+            for abi in _SYSTEM_IMAGE_ABIS:
+                packages.append('system-images;android-%d;%s;%s' % (api_level, tag, abi))
+    packages = sorted(set(packages), key=packages.index)
+    i = 0
+    while len(packages) < num_packages:
+        packages.append('extras;vendor%d;library%d' % (i // 10, i % 10))
+        i += 1
+    return packages[:max(num_packages, len(_BASIC_PACKAGES))]
+
+
+def _get_version(package) -> str:
+    last_component = package.split(';')[-1]
+    if package.startswith('build-tools;'):
+        return last_component
+    if package.startswith(('platforms;', 'sources;', 'system-images;', 'add-ons;')):
+        return '%d' % (sum(ord(c) for c in package) % 9 + 1)
+    return '%d.0.%d' % (len(package) % 30 + 1, sum(ord(c) for c in package) % 10)
+
+
+def _get_update_version(package) -> str:
+    return _get_version(package).replace('.0', '.1', 1)
+
+
+def _get_package_xml(package, version) -> str:
+    major, minor, micro = (version.split('.') + ['0', '0'])[:3]
+    return _PACKAGE_XML_TEMPLATE % (package, 'false', major, minor, micro, _get_description(package))
+
+
+def _get_description(package) -> str:
+    return 'Android SDK %s' % package.replace(';', ' ')
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Benchmarks androidtool against a synthetic SDK with stub binaries, see fake_sdk.py.
+
+Usage:
+    run_benchmarks.py [options]
+
+Options:
+    --packages=<n>      Number of packages in the sdkmanager listing [default: 3000]
+    --avds=<n>          Number of AVDs in the AVD home [default: 50]
+    --repeat=<n>        Number of timed runs of each benchmark, the median is reported. The startup benchmarks
+                        are run at least 15 times [default: 5]
+    --filter=<text>     Only run the benchmarks whose name contains this text
+    --baseline=<file>   Baseline to compare against [default: baseline.json next to this script]
+    --tolerance=<x>     Allowed slowdown relative to the baseline, 0.5 means 50% slower [default: 0.5]
+    --update-baseline   Store the results as the new baseline instead of comparing against it
+    --keep              Keep the synthetic SDK directory
+
+The exit code is 1 if any benchmark is slower than its baseline by more than the tolerance, or if the startup of
+androidtool takes longer than its budget. The startup budget is 50 ms on top of the interpreter startup, with a
+tolerance of 25 ms, checked against the median of the startup runs.
+"""
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import docopt
+
+from fake_sdk import FakeSdk
+
+_SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'src')
+_DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# Differences below this are noise, irrespective of the tolerance.
+_MIN_REGRESSION_IN_SECONDS = 0.02
+# Wrapper scripts call androidtool a lot, the time these take on top of starting the interpreter is budgeted.
+# The startup is measured against an SDK of a typical size rather than the large one used for the other benchmarks.
+# A single run is too noisy to gate on, so the startup benchmarks are timed at least _MIN_STARTUP_RUNS times whatever
+# --repeat says, and their median is compared against the budget plus a tolerance for the noise of the machine.
+_STARTUP_BUDGET_IN_SECONDS = 0.05
+_STARTUP_BUDGET_TOLERANCE_IN_SECONDS = 0.025
+_MIN_STARTUP_RUNS = 15
+_STARTUP_SDK_PACKAGES = 1000
+_STARTUP_SDK_INSTALLED_PACKAGE_INTERVAL = 50
+_STARTUP_SDK_AVDS = 5
+_PYTHON_STARTUP = 'startup: python'
+_STARTUP_COMMANDS = [
+    ('--help', ['--help']),
+    ('--version', ['--version']),
+    ('list build tools', ['list', 'build', 'tools']),
+    ('list avds', ['list', 'avds']),
+]
+
+# (name, androidtool arguments), each command is run in a fresh process with a warm cache.
+_COMMANDS = [
+    ('doctor', ['doctor']),
+    ('doctor --json', ['doctor', '--json']),
+    ('list build tools', ['list', 'build', 'tools']),
+    ('list build tools --refresh', ['--refresh', 'list', 'build', 'tools']),
+    ('list installed packages', ['list', 'installed', 'packages']),
+    ('list api versions', ['list', 'api', 'versions']),
+    ('list api versions --arm --no-google-apis', ['list', 'api', 'versions', '--arm', '--no-google-apis']),
+    ('list other packages', ['list', 'other', 'packages']),
+    ('list avds', ['list', 'avds']),
+    ('install basic packages', ['install', 'basic', 'packages']),
+    ('install version 28', ['install', 'version', '28']),
+    ('create avd', ['create', 'avd', 'bench_new_avd', '28']),
+    ('start avd', ['start', 'avd', 'bench_avd_0', '--headless']),
+    ('start avds', ['start', 'avds', 'bench_avd_0', 'bench_avd_1', '--headless']),
+    ('update all', ['update', 'all']),
+    ('accept licenses', ['accept', 'licenses']),
+]
+# Benchmarks whose timed runs must not start sdkmanager, these are warmed up twice. The first warm-up run of update all
+# installs the updates and the second one lists the packages of the updated SDK, the timed runs then find all the
+# packages up-to-date.
+_NO_SDK_MANAGER_BENCHMARKS = ('command: update all',)
+# (name, androidtool arguments), each command is sent to a warm daemon by a fresh client process.
+_DAEMON_COMMANDS = [
+    ('list build tools', ['list', 'build', 'tools']),
+    ('list installed packages', ['list', 'installed', 'packages']),
+    ('list api versions', ['list', 'api', 'versions']),
+    ('list avds', ['list', 'avds']),
+]
+_DAEMON_STARTUP_TIMEOUT_IN_SECONDS = 10
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    num_packages = int(args['--packages'])
+    num_avds = int(args['--avds'])
+    repeat = int(args['--repeat'])
+    baseline_path = args['--baseline']
+    if baseline_path.startswith('baseline.json next to'):
+        baseline_path = _DEFAULT_BASELINE
+
+    root_dir = tempfile.mkdtemp(prefix='androidtool-benchmark-')
+    daemon = None
+    try:
+        fake_sdk = FakeSdk(root_dir, num_packages, num_avds)
+        fake_sdk.create()
+        print('Synthetic SDK with %d packages (%d installed) and %d AVDs in %s' % (
+            num_packages, len(fake_sdk.installed_packages), num_avds, root_dir))
+        startup_sdk = FakeSdk(os.path.join(root_dir, 'startup'), _STARTUP_SDK_PACKAGES, _STARTUP_SDK_AVDS,
+                              installed_package_interval=_STARTUP_SDK_INSTALLED_PACKAGE_INTERVAL)
+        startup_sdk.create()
+        daemon_socket = os.path.join(root_dir, 'daemon.sock')
+        daemon = _start_daemon(fake_sdk, daemon_socket)
+        results = {}
+        for (name, function) in _get_benchmarks(fake_sdk, startup_sdk, daemon_socket):
+            if args['--filter'] and name.find(args['--filter']) == -1:
+                continue
+            for _ in range(2 if name in _NO_SDK_MANAGER_BENCHMARKS else 1):
+                function()  # Warm up the caches
+            fake_sdk.clear_calls()
+            timings = []
+            for _ in range(max(repeat, _MIN_STARTUP_RUNS) if name.startswith('startup: ') else repeat):
+                start_time = time.perf_counter()
+                function()
+                timings.append(time.perf_counter() - start_time)
+            results[name] = statistics.median(timings)
+            calls = fake_sdk.read_calls()
+            print('%-45s %8.3f s  %s' % (name, results[name], _count_calls(calls, len(timings))))
+            if name in _NO_SDK_MANAGER_BENCHMARKS and any(call.startswith('sdkmanager ') for call in calls):
+                raise RuntimeError('"%s" started sdkmanager, expected no calls' % name)
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            daemon.wait()
+        if args['--keep']:
+            print('Synthetic SDK kept in %s' % root_dir)
+        else:
+            shutil.rmtree(root_dir, ignore_errors=True)
+
+    parameters = {'packages': num_packages, 'avds': num_avds}
+    if args['--update-baseline']:
+        with open(baseline_path, 'w', encoding='utf-8') as fh:
+            rounded_results = {name: round(duration, 4) for (name, duration) in results.items()}
+            json.dump({'parameters': parameters, 'results': rounded_results}, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+        print('Baseline written to %s' % baseline_path)
+        return
+    within_budget = _check_startup_budget(results)
+    if not _compare_with_baseline(baseline_path, parameters, results, float(args['--tolerance'])) or \
+            not within_budget:
+        sys.exit(1)
+
+
+def _start_daemon(fake_sdk, socket_path) -> subprocess.Popen:
+    env = fake_sdk.get_env()
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    cmd = [sys.executable, os.path.join(_SRC_DIR, 'main.py'), 'daemon', '--socket=%s' % socket_path]
+    daemon = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + _DAEMON_STARTUP_TIMEOUT_IN_SECONDS
+    while not os.path.exists(socket_path):
+        if daemon.poll() is not None or time.monotonic() > deadline:
+            daemon.kill()
+            raise RuntimeError('The daemon did not start')
+        time.sleep(0.05)
+    return daemon
+
+
+def _get_benchmarks(fake_sdk, startup_sdk, daemon_socket) -> [(str, callable)]:
+    """
+    :return: list of (name, function), the functions are timed.
+    """
+    env = fake_sdk.get_env()
+    # Installed packages have their bytecode compiled, the commands are timed the same way.
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    # The helpers read the environment when they are called, the in-process phases see the fake SDK as well.
+    os.environ.clear()
+    os.environ.update(env)
+    sys.path.insert(0, _SRC_DIR)
+    # pylint: disable=import-error
+    from android_sdk_helper import AndroidSdkHelper
+    from avd_helper import AvdHelper
+    from cache_helper import CacheHelper
+    from java_helper import JavaHelper
+    from platform_helper import PlatformHelper
+    from sdk_catalog import SdkCatalog, SdkCatalogParser
+    from sdk_scanner import SdkScanner
+
+    with open(fake_sdk.listing_path, 'r', encoding='utf-8') as fh:
+        listing = fh.read()
+    sdk_manager_path = AndroidSdkHelper.get_sdk_manager_path_uncached()
+
+    def stream_parse():
+        parser = SdkCatalogParser()
+        PlatformHelper.execute_cmd([sdk_manager_path, '--list'], stdout_callback=parser.feed_line)
+        return parser.finish()
+
+    # Individual phases of the commands
+    benchmarks = [
+        ('phase: execute_cmd sdkmanager --list', lambda: PlatformHelper.execute_cmd([sdk_manager_path, '--list'])),
+        ('phase: parse listing', lambda: SdkCatalog.parse(listing)),
+        ('phase: stream and parse listing', stream_parse),
+        ('phase: scan installed packages', lambda: SdkScanner.get_installed_packages(fake_sdk.sdk_root)),
+        ('phase: sdk fingerprint', lambda: CacheHelper.get_sdk_fingerprint(fake_sdk.sdk_root)),
+        ('phase: resolve sdkmanager', AndroidSdkHelper.get_sdk_manager_path_uncached),
+        ('phase: read avds', lambda: AvdHelper.list_avds(with_disk_size=True)),
+        ('phase: java version', JavaHelper.get_default_java_version),
+    ]
+    # Startup, the commands are timed with a warm cache
+    benchmarks.append((_PYTHON_STARTUP, lambda: subprocess.run([sys.executable, '-c', 'pass'], check=True)))
+    startup_env = startup_sdk.get_env()
+    startup_env.pop('PYTHONDONTWRITEBYTECODE', None)
+    for (name, command) in _STARTUP_COMMANDS:
+        benchmarks.append(('startup: %s' % name, _get_command_runner(startup_sdk, startup_env, command)))
+    # End to end
+    for (name, command) in _COMMANDS:
+        benchmarks.append(('command: %s' % name, _get_command_runner(fake_sdk, env, command)))
+    # The warm-up run downloads the packages, the timed runs find them in the mirror.
+    mirror_command = ['mirror', 'system-images;android-28;google_apis;x86_64', 'build-tools;34.0.3',
+                      '--repository=%s' % fake_sdk.repository_dir]
+    benchmarks.append(('command: mirror', _get_command_runner(fake_sdk, env, mirror_command)))
+    daemon_env = dict(env)
+    daemon_env['ANDROIDTOOL_SOCKET'] = daemon_socket
+    for (name, command) in _DAEMON_COMMANDS:
+        benchmarks.append(('daemon: %s' % name, _get_command_runner(fake_sdk, daemon_env, command)))
+    return benchmarks
+
+
+def _get_command_runner(fake_sdk, env, command) -> callable:
+    def run():
+        process = subprocess.run([sys.executable, os.path.join(_SRC_DIR, 'main.py')] + command, env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
+        if command[0] == 'create':
+            # Leave the AVD home as it was for the next run.
+            shutil.rmtree(os.path.join(fake_sdk.avd_home, command[2] + '.avd'), ignore_errors=True)
+            os.remove(os.path.join(fake_sdk.avd_home, command[2] + '.ini'))
+        if process.returncode != 0 and command[0] != 'doctor':
+            raise RuntimeError('"androidtool %s" failed:\n%s' % (
+                ' '.join(command), process.stdout.decode('utf-8', errors='replace')))
+    return run
+
+
+def _count_calls(calls, repeat) -> str:
+    """
+    :return: the average number of calls of each stub binary per run, e.g. "sdkmanager: 1.0"
+    """
+    counts = {}
+    for call in calls:
+        binary = call.split(' ', 1)[0]
+        counts[binary] = counts.get(binary, 0) + 1
+    return ', '.join('%s: %.1f' % (binary, count / repeat) for (binary, count) in sorted(counts.items()))
+
+
+def _check_startup_budget(results) -> bool:
+    """
+    :param results: median duration of each benchmark
+    :return: False if any startup benchmark took longer than the budget and its tolerance on top of the interpreter
+        startup
+    """
+    if _PYTHON_STARTUP not in results:
+        return True
+    over_budget = []
+    for (name, duration) in sorted(results.items()):
+        if not name.startswith('startup: ') or name == _PYTHON_STARTUP:
+            continue
+        if duration - results[_PYTHON_STARTUP] > _STARTUP_BUDGET_IN_SECONDS + _STARTUP_BUDGET_TOLERANCE_IN_SECONDS:
+            over_budget.append('%s: %.3f s on top of %.3f s for the interpreter' % (
+                name, duration - results[_PYTHON_STARTUP], results[_PYTHON_STARTUP]))
+    if over_budget:
+        print('Startup budget of %.3f s (+%.3f s tolerance) exceeded:\n    %s' % (
+            _STARTUP_BUDGET_IN_SECONDS, _STARTUP_BUDGET_TOLERANCE_IN_SECONDS, '\n    '.join(over_budget)))
+        return False
+    return True
+
+
+def _compare_with_baseline(baseline_path, parameters, results, tolerance) -> bool:
+    """
+    :return: False if any result regressed past the baseline
+    """
+    try:
+        with open(baseline_path, 'r', encoding='utf-8') as fh:
+            baseline = json.load(fh)
+    except (OSError, ValueError) as e:
+        print('No baseline to compare against (%s), run with --update-baseline to create one' % e)
+        return True
+    if baseline.get('parameters') != parameters:
+        print('Baseline was recorded with %s, not comparing against it' % baseline.get('parameters'))
+        return True
+
+    regressions = []
+    for (name, duration) in sorted(results.items()):
+        baseline_duration = baseline['results'].get(name, None)
+        if baseline_duration is None:
+            print('%s: not in the baseline' % name)
+            continue
+        if duration > baseline_duration * (1 + tolerance) and \
+                duration - baseline_duration > _MIN_REGRESSION_IN_SECONDS:
+            regressions.append('%s: %.3f s, baseline is %.3f s' % (name, duration, baseline_duration))
+    if regressions:
+        print('Performance regressions:\n    %s' % '\n    '.join(regressions))
+        return False
+    print('No performance regressions')
+    return True
+
+
+if __name__ == '__main__':
+    main()
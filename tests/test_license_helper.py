@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests of the license hashes in the licenses directory of the SDK root, run with "python3 -m unittest discover tests".
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+# pylint: disable=wrong-import-position
+from license_helper import LicenseHelper, _get_license_hash
+
+_PACKAGE_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<ns2:repository xmlns:ns2="http://schemas.android.com/repository/android/common/01">
+    <license id="android-sdk-license" type="text">
+Terms and Conditions
+    </license>
+    <localPackage path="platform-tools" obsolete="false">
+        <uses-license ref="android-sdk-license"/>
+    </localPackage>
+</ns2:repository>
+"""
+
+
+class LicenseHelperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sdk_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.sdk_root)
+
+    def test_hash_ignores_the_surrounding_whitespace(self):
+        self.assertEqual(_get_license_hash('\n  Terms and Conditions\n'), _get_license_hash('Terms and Conditions'))
+        self.assertEqual(_get_license_hash('Terms and Conditions'), '894031ed8d341b5ecab5e23002585055f0b7ee4d')
+
+    def test_licenses_of_the_package_xml(self):
+        xml_path = os.path.join(self.sdk_root, 'package.xml')
+        with open(xml_path, 'w', encoding='utf-8') as fh:
+            fh.write(_PACKAGE_XML)
+        self.assertEqual(LicenseHelper.get_licenses([xml_path, os.path.join(self.sdk_root, 'missing.xml')]),
+                         {'android-sdk-license': {_get_license_hash('Terms and Conditions')}})
+
+    def test_accepted_licenses_are_appended(self):
+        licenses = {'android-sdk-license': {'a' * 40, 'b' * 40}}
+        self.assertEqual(LicenseHelper.get_unaccepted_licenses(self.sdk_root, licenses), licenses)
+        LicenseHelper.accept(self.sdk_root, {'android-sdk-license': {'a' * 40}})
+        self.assertEqual(LicenseHelper.get_unaccepted_licenses(self.sdk_root, licenses),
+                         {'android-sdk-license': {'b' * 40}})
+        LicenseHelper.accept(self.sdk_root, licenses)
+        self.assertEqual(LicenseHelper.get_unaccepted_licenses(self.sdk_root, licenses), {})
+        with open(os.path.join(self.sdk_root, 'licenses', 'android-sdk-license'), 'r', encoding='utf-8') as fh:
+            self.assertEqual(fh.read(), '\n%s\n%s' % ('a' * 40, 'b' * 40))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests of the splitting of the output of the commands into lines, run with "python3 -m unittest discover tests".
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+# pylint: disable=wrong-import-position
+from platform_helper import _LineReader
+
+
+class LineReaderTest(unittest.TestCase):
+
+    def test_lines_split_across_reads(self):
+        reader = _LineReader(None)
+        for data in (b'first', b' line\nsecond line', b'\n', b'last line'):
+            reader.feed(data)
+        reader.close()
+        self.assertEqual(reader.get_output(), 'first line\nsecond line\nlast line\n')
+
+    def test_empty_lines_and_surrounding_whitespace_are_dropped(self):
+        reader = _LineReader(None)
+        reader.feed(b'  indented  \n\n\r\nwindows line\r\n')
+        reader.close()
+        self.assertEqual(reader.get_output(), 'indented\nwindows line\n')
+
+    def test_progress_redraws_are_reported_as_lines(self):
+        lines = []
+        reader = _LineReader(lines.append)
+        num_redraws = 32000
+        for i in range(num_redraws):
+            reader.feed(b'\r[%-20s] %d%%' % (b'=' * (i * 20 // num_redraws), i * 100 // num_redraws))
+        reader.feed(b'\rdone\n')
+        reader.close()
+        self.assertEqual(len(lines), num_redraws + 1)
+        self.assertEqual(lines[0], '[                    ] 0%')
+        self.assertEqual(lines[-1], 'done')
+        # Only the partial last line is buffered, the redraws are not copied over and over.
+        self.assertEqual(len(reader._buffer), 0)  # pylint: disable=protected-access
+
+    def test_lines_passed_to_the_callback_are_not_kept(self):
+        lines = []
+        reader = _LineReader(lines.append)
+        reader.feed(b'a\nb\nc')
+        reader.close()
+        self.assertEqual(lines, ['a', 'b', 'c'])
+        self.assertEqual(reader.get_output(), '')
+        self.assertEqual(reader.num_bytes, 5)
+
+    def test_invalid_utf8_is_replaced(self):
+        reader = _LineReader(None)
+        reader.feed(b'caf\xe9\n')
+        self.assertEqual(reader.get_output(), 'caf�\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Tests of the parsing of the sdkmanager listing and of the ordering of the SDK packages by their revision, run with
+"python3 -m unittest discover tests".
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+# pylint: disable=wrong-import-position
+from sdk_catalog import SdkCatalog, SdkCatalogParser, SdkPackage, SdkPackageIndex, _get_revision_key
+
+# Output of "sdkmanager --verbose --list --include_obsolete", shortened.
+_LISTING = """Info: Parsing /sdk/emulator/package.xml
+[==     ] 20% Loading local repository...\r[=======] 100% Computing updates...
+Installed packages:
+--------------------------------------
+build-tools;28.0.3
+    Description:        Android SDK Build-Tools 28.0.3
+    Version:            28.0.3
+    Installed Location: /sdk/build-tools/28.0.3
+
+platform-tools
+    Description:        Android SDK Platform-Tools
+    Version:            29.0.5
+    Installed Location: /sdk/platform-tools
+
+Available Packages:
+--------------------------------------
+build-tools;28.0.3
+    Description:        Android SDK Build-Tools 28.0.3
+    Version:            28.0.3
+
+build-tools;29.0.2
+    Description:        Android SDK Build-Tools 29.0.2
+    Version:            29.0.2
+
+platform-tools
+    Description:        Android SDK Platform-Tools
+    Version:            30.0.1
+
+system-images;android-28;google_apis;x86
+    Description:        Google APIs Intel x86 Atom System Image
+    Version:            10
+    Dependencies:
+        emulator revision 28.0.23
+        patcher;v4
+
+Available Obsolete Packages:
+--------------------------------------
+tools
+    Description:        Android SDK Tools
+    Version:            26.1.1
+
+Available Updates:
+--------------------------------------
+platform-tools
+    Installed Version: 29.0.5
+    Available Version: 30.0.1
+done
+"""
+
+
+def _get_package(path, version=None) -> SdkPackage:
+    package = SdkPackage(path)
+    package.version = version
+    return package
+
+
+def _get_paths(packages) -> [str]:
+    return [package.path for package in packages]
+
+
+class RevisionKeyTest(unittest.TestCase):
+
+    def test_compares_the_components_as_numbers(self):
+        self.assertLess(_get_revision_key('9.0.0'), _get_revision_key('28.0.3'))
+        self.assertLess(_get_revision_key('28.0.3'), _get_revision_key('28.0.10'))
+        self.assertLess(_get_revision_key('28.0.3'), _get_revision_key('29'))
+
+    def test_missing_components_are_zero(self):
+        self.assertEqual(_get_revision_key('29'), _get_revision_key('29.0.0'))
+        self.assertEqual(_get_revision_key('29.1'), _get_revision_key('29.1.0'))
+
+    def test_preview_is_older_than_its_release(self):
+        self.assertLess(_get_revision_key('30.0.0 rc4'), _get_revision_key('30.0.0'))
+        self.assertLess(_get_revision_key('30.0.0 rc1'), _get_revision_key('30.0.0 rc4'))
+        self.assertGreater(_get_revision_key('30.0.0 rc1'), _get_revision_key('29.0.3'))
+
+    def test_both_preview_spellings_are_the_same(self):
+        self.assertEqual(_get_revision_key('30.0.0-rc4'), _get_revision_key('30.0.0 rc4'))
+
+    def test_not_a_revision(self):
+        self.assertIsNone(_get_revision_key(''))
+        self.assertIsNone(_get_revision_key('latest'))
+
+
+class SdkPackageIndexTest(unittest.TestCase):
+
+    def test_build_tools_are_sorted_by_revision(self):
+        index = SdkPackageIndex([_get_package('build-tools;28.0.3'), _get_package('build-tools;9.0.0'),
+                                 _get_package('build-tools;30.0.0-rc4'), _get_package('build-tools;30.0.0'),
+                                 _get_package('build-tools;28.0.10')])
+        self.assertEqual(_get_paths(index.get_build_tools()),
+                         ['build-tools;9.0.0', 'build-tools;28.0.3', 'build-tools;28.0.10', 'build-tools;30.0.0-rc4',
+                          'build-tools;30.0.0'])
+
+    def test_latest_build_tools_skips_the_newer_previews(self):
+        index = SdkPackageIndex([_get_package('build-tools;9.0.0'), _get_package('build-tools;28.0.3'),
+                                 _get_package('build-tools;31.0.0-rc1')])
+        self.assertEqual(index.get_latest_build_tools().path, 'build-tools;28.0.3')
+        self.assertEqual(index.get_latest_build_tools(stable=False).path, 'build-tools;31.0.0-rc1')
+
+    def test_latest_build_tools_prefers_the_release_over_its_preview(self):
+        index = SdkPackageIndex([_get_package('build-tools;30.0.0'), _get_package('build-tools;30.0.0-rc4')])
+        self.assertEqual(index.get_latest_build_tools().path, 'build-tools;30.0.0')
+        self.assertEqual(index.get_latest_build_tools(stable=False).path, 'build-tools;30.0.0')
+
+    def test_no_stable_build_tools(self):
+        index = SdkPackageIndex([_get_package('build-tools;31.0.0-rc1'), _get_package('platform-tools')])
+        self.assertIsNone(index.get_latest_build_tools())
+        self.assertEqual(index.get_latest_build_tools(stable=False).path, 'build-tools;31.0.0-rc1')
+
+    def test_version_is_used_if_the_path_is_not_a_revision(self):
+        index = SdkPackageIndex([_get_package('build-tools;28.0.3'), _get_package('build-tools;latest', '29.0.2')])
+        self.assertEqual(index.get_latest_build_tools().path, 'build-tools;latest')
+
+    def test_system_images_are_sorted_by_api_level(self):
+        index = SdkPackageIndex([_get_package('system-images;android-28;google_apis;x86'),
+                                 _get_package('system-images;android-9;default;x86'),
+                                 _get_package('system-images;android-R;google_apis;x86'),
+                                 _get_package('system-images;android-28;default;x86_64')])
+        self.assertEqual([(api_level, tag, abi) for (_, api_level, tag, abi) in index.get_system_images()],
+                         [(9, 'default', 'x86'), (28, 'default', 'x86_64'), (28, 'google_apis', 'x86')])
+        self.assertEqual(_get_paths(package for (package, _, _, _) in
+                                    index.get_system_images(min_api_level=10, max_api_level=28, abi_prefix='x86')),
+                         ['system-images;android-28;default;x86_64', 'system-images;android-28;google_apis;x86'])
+
+
+class SdkCatalogParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = SdkCatalog.parse(_LISTING)
+
+    def test_sections(self):
+        self.assertEqual([name for (name, _) in self.catalog.get_sections()],
+                         ['Installed packages', 'Available Packages', 'Available Obsolete Packages',
+                          'Available Updates'])
+
+    def test_installed_packages(self):
+        self.assertEqual(_get_paths(self.catalog.get_installed_packages()), ['build-tools;28.0.3', 'platform-tools'])
+        package = self.catalog.get('build-tools;28.0.3')
+        self.assertEqual(package.version, '28.0.3')
+        self.assertEqual(package.location, '/sdk/build-tools/28.0.3')
+        self.assertEqual(package.description, 'Android SDK Build-Tools 28.0.3')
+        self.assertTrue(package.available)
+        self.assertFalse(package.is_updatable())
+
+    def test_available_packages(self):
+        package = self.catalog.get('build-tools;29.0.2')
+        self.assertFalse(package.installed)
+        self.assertTrue(package.available)
+        self.assertEqual(package.version, '29.0.2')
+        self.assertEqual(package.available_version, '29.0.2')
+        self.assertTrue(self.catalog.get('tools').obsolete)
+        self.assertFalse(self.catalog.get('build-tools;29.0.2').obsolete)
+
+    def test_available_version_of_an_installed_package_keeps_its_version(self):
+        package = self.catalog.get('platform-tools')
+        self.assertEqual(package.version, '29.0.5')
+        self.assertEqual(package.available_version, '30.0.1')
+
+    def test_available_updates(self):
+        package = self.catalog.get('platform-tools')
+        self.assertTrue(package.is_updatable())
+        self.assertEqual(package.update_version, '30.0.1')
+        self.assertEqual([(package.path, version) for (package, version) in
+                          self.catalog.get_updates(self.catalog.get_installed_packages())],
+                         [('platform-tools', '30.0.1')])
+
+    def test_dependencies_are_not_packages(self):
+        self.assertEqual(_get_paths(self.catalog.get_packages()),
+                         ['build-tools;28.0.3', 'platform-tools', 'build-tools;29.0.2',
+                          'system-images;android-28;google_apis;x86', 'tools'])
+        self.assertNotIn('patcher;v4', self.catalog)
+        self.assertEqual(self.catalog.get('system-images;android-28;google_apis;x86').version, '10')
+
+    def test_progress_bar_redraws_are_ignored(self):
+        parser = SdkCatalogParser()
+        parser.feed_line('[===      ] 10% Fetch remote repository...\r[=========] 100% Fetch remote repository...')
+        for line in _LISTING.split('\n')[2:]:
+            parser.feed_line(line)
+        self.assertEqual(parser.finish().to_dict(), self.catalog.to_dict())
+
+    def test_to_dict_round_trip(self):
+        catalog = SdkCatalog.from_dict(self.catalog.to_dict())
+        self.assertEqual(catalog.to_dict(), self.catalog.to_dict())
+        self.assertEqual(_get_paths(catalog.get_installed_packages()), ['build-tools;28.0.3', 'platform-tools'])
+
+
+if __name__ == '__main__':
+    unittest.main()